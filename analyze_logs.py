@@ -0,0 +1,257 @@
+"""問答紀錄的離線統計
+
+逐行讀取 interaction_log.py 寫出的紀錄檔（.jsonl.gz 與寫入中的 .jsonl），不會把紀錄全部載入記憶體：
+熱門問題以 Space-Saving 只追蹤固定數量的候選，延遲百分位數以固定大小的蓄水池抽樣估計。
+輸出拒答率、處理路徑分布、熱門問題（不是由常見問題回答表回答的熱門問題可加入 faq_catalogue.json）與各階段延遲。
+
+用法：
+    python analyze_logs.py
+    python analyze_logs.py --dir interaction_logs --since 2024-03-01 --top 30
+    python analyze_logs.py --json > report.json
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+from collections import Counter
+
+from interaction_log import SEGMENT_PREFIX, read_records, segment_paths
+from text_utils import normalize_query
+
+# 沒有生成回答的路徑，不計入拒答率與熱門問題
+NOT_ANSWERED = ("rate_limited", "queue_full", "expired")
+# 由常見問題回答表回答的路徑，熱門問題中不是這些路徑的才列為候選
+FAQ_ROUTES = ("faq",)
+
+
+def percentile(values, q):
+    """計算百分位數（q 介於 0~100）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SpaceSaving:
+    """只追蹤 capacity 個候選的熱門項目統計，記憶體與資料量無關
+
+    計數會高估最多 error，出現次數超過總數 / capacity 的項目一定會被追蹤到。
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.samples = {}
+        # (次數, 項目) 的最小堆積，次數已過時的項目在取出時略過
+        self._heap = []
+
+    def add(self, key, sample=None):
+        if key in self.counts:
+            self.counts[key] += 1
+            self._push(key)
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            # 取代目前最少的候選，新候選繼承它的次數作為誤差
+            evicted = self._pop_min()
+            error = self.counts.pop(evicted)
+            del self.errors[evicted]
+            del self.samples[evicted]
+        self.counts[key] = error + 1
+        self.errors[key] = error
+        self.samples[key] = sample if sample is not None else key
+        self._push(key)
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(n, k) for k, n in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            n, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == n:
+                return key
+
+    def top(self, n):
+        """回傳 [(原始問題, 次數, 誤差上限)]"""
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+        return [(self.samples[key], self.counts[key], self.errors[key]) for key in keys]
+
+
+class Reservoir:
+    """固定大小的均勻抽樣，用來估計百分位數"""
+
+    def __init__(self, size=10000, rng=None):
+        self.size = size
+        self.rng = rng or random.Random(0)
+        self.values = []
+        self.seen = 0
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+            return
+        index = self.rng.randrange(self.seen)
+        if index < self.size:
+            self.values[index] = value
+
+
+def segment_date(path):
+    """紀錄檔名中的開始日期（YYYY-MM-DD），無法解析時回傳 None"""
+    stamp = os.path.basename(path)[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 8]
+    if not stamp.isdigit():
+        return None
+    return f"{stamp[:4]}-{stamp[4:6]}-{stamp[6:]}"
+
+
+def analyze(records, top=20, capacity=1000, reservoir_size=10000):
+    """逐筆統計紀錄並回傳報表 dict"""
+    rng = random.Random(0)
+    total = answered = refused = cache_hits = 0
+    routes = Counter()
+    refusal_rules = Counter()
+    models = Counter()
+    days = {}
+    questions = SpaceSaving(capacity)
+    candidates = SpaceSaving(capacity)
+    latencies = {}
+
+    for record in records:
+        total += 1
+        route = record.get("route") or "unknown"
+        routes[route] += 1
+        for stage, seconds in (record.get("latency") or {}).items():
+            if stage not in latencies:
+                latencies[stage] = Reservoir(reservoir_size, rng)
+            latencies[stage].add(seconds)
+        if route in NOT_ANSWERED:
+            continue
+
+        answered += 1
+        day = days.setdefault((record.get("ts") or "")[:10], [0, 0])
+        day[0] += 1
+        if record.get("refused"):
+            refused += 1
+            day[1] += 1
+            refusal_rules[record.get("refusal_rule") or "model"] += 1
+        if record.get("cache_hit"):
+            cache_hits += 1
+        if record.get("model"):
+            models[record["model"]] += 1
+
+        query = record.get("query") or ""
+        key = normalize_query(query)
+        if not key:
+            continue
+        questions.add(key, query)
+        if route not in FAQ_ROUTES and not record.get("refused"):
+            candidates.add(key, query)
+
+    return {
+        "records": total,
+        "answered": answered,
+        "refusal_rate": refused / answered if answered else 0.0,
+        "cache_hit_rate": cache_hits / answered if answered else 0.0,
+        "routes": dict(routes.most_common()),
+        "refusal_rules": dict(refusal_rules.most_common()),
+        "models": dict(models.most_common()),
+        "daily": {
+            day: {"answered": n, "refusal_rate": r / n if n else 0.0}
+            for day, (n, r) in sorted(days.items()) if day
+        },
+        "top_questions": [
+            {"question": q, "count": n, "error": e} for q, n, e in questions.top(top)
+        ],
+        "faq_candidates": [
+            {"question": q, "count": n, "error": e} for q, n, e in candidates.top(top)
+        ],
+        "latency": {
+            stage: {
+                "count": reservoir.seen,
+                "p50": percentile(reservoir.values, 50),
+                "p95": percentile(reservoir.values, 95),
+                "p99": percentile(reservoir.values, 99),
+            }
+            for stage, reservoir in sorted(latencies.items())
+        },
+    }
+
+
+def filter_by_date(records, since=None, until=None):
+    for record in records:
+        day = (record.get("ts") or "")[:10]
+        if since and day < since:
+            continue
+        if until and day > until:
+            continue
+        yield record
+
+
+def print_report(report):
+    print(f"紀錄 {report['records']} 筆，有生成回覆 {report['answered']} 筆")
+    print(f"拒答率 {report['refusal_rate']:.1%}，快取／常見問題命中率 {report['cache_hit_rate']:.1%}")
+    print("處理路徑: " + "，".join(f"{route} {n}" for route, n in report["routes"].items()))
+    if report["refusal_rules"]:
+        print("拒答原因: " + "，".join(f"{rule} {n}" for rule, n in report["refusal_rules"].items()))
+    if report["models"]:
+        print("模型: " + "，".join(f"{model} {n}" for model, n in report["models"].items()))
+    print("=====================================================================================")
+    for day, stats in report["daily"].items():
+        print(f"{day}  {stats['answered']:6d} 則  拒答率 {stats['refusal_rate']:6.1%}")
+    print("=====================================================================================")
+    print("熱門問題:")
+    for item in report["top_questions"]:
+        print(f"{item['count']:6d}  {item['question']}")
+    print("=====================================================================================")
+    print("可加入常見問題回答表的熱門問題（不是由回答表回答）:")
+    for item in report["faq_candidates"]:
+        print(f"{item['count']:6d}  {item['question']}")
+    print("=====================================================================================")
+    print(f"{'階段':<20}{'筆數':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, stats in report["latency"].items():
+        print(f"{stage:<20}{stats['count']:>8}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="問答紀錄的離線統計")
+    parser.add_argument("--dir", default=None, help="紀錄目錄，預設為設定中的 INTERACTION_LOG_DIR")
+    parser.add_argument("--since", default=None, help="只統計此日期（YYYY-MM-DD）之後的紀錄")
+    parser.add_argument("--until", default=None, help="只統計此日期（YYYY-MM-DD）之前的紀錄")
+    parser.add_argument("--top", type=int, default=20, help="列出的熱門問題數")
+    parser.add_argument("--capacity", type=int, default=1000, help="熱門問題追蹤的候選數，越大越準確")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    args = parser.parse_args()
+
+    directory = args.dir
+    if directory is None:
+        import config
+
+        config.init_config(validate=False)
+        directory = config.INTERACTION_LOG_DIR
+    paths = segment_paths(directory)
+    if args.until:
+        # 檔案中的紀錄都不早於檔名的開始時間
+        paths = [path for path in paths if (segment_date(path) or "") <= args.until]
+    if not paths:
+        print(f"{directory or '（未設定 INTERACTION_LOG_DIR）'} 中沒有問答紀錄", file=sys.stderr)
+        sys.exit(1)
+
+    records = filter_by_date(read_records(paths), args.since, args.until)
+    report = analyze(records, top=args.top, capacity=args.capacity)
+    report["segments"] = len(paths)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
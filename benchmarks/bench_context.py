@@ -0,0 +1,138 @@
+"""比較完整公告與檢索模式的 prompt token 數與延遲
+
+另外以 RECALL_CASES 檢查檢索模式是否選到回答需要的項目，有遺漏時 exit 1（CONTEXT_MODE=retrieval 的前提）。
+
+用法：
+    python benchmarks/bench_context.py            # 只比較 token 數與檢索耗時
+    python benchmarks/bench_context.py --live     # 另外實際呼叫 Ollama 比較 prompt eval 與總延遲
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from course_knowledge import PromptCompiler, load_knowledge
+from course_retrieval import CourseIndex
+from promptTesting import system_prompt, assistant_prompts, test_prompts
+from text_utils import estimate_tokens
+
+
+# (問題, 回答需要的項目 id 前綴或完整 id)：以「:」結尾代表該類別的全部項目
+RECALL_CASES = [
+    ("有什麼公告", ["announcement:"]),
+    ("本週作業是什麼", ["assignment:"]),
+    ("請告訴我作業內容", ["assignment:"]),
+    ("作業三Cv2.imread()可以用嗎", ["assignment:作業三"]),
+    ("作業一什麼時候要交", ["assignment:作業一"]),
+    ("這週在上甚麼", ["content:課堂主題（第十週）"]),
+    ("期中考什麼時候", ["announcement:期中考"]),
+    ("小組分組的期限是哪天", ["announcement:小組分組提醒"]),
+    ("缺席要怎麼補件", ["announcement:缺席補件"]),
+    ("期末報告什麼時候", ["announcement:學期末報告"]),
+]
+
+
+def check_recall(index, top_k, token_budget):
+    """回傳 [(問題, 遺漏的項目 id)]"""
+    missing = []
+    for query, expected in RECALL_CASES:
+        selected = set(index.select(query, top_k=top_k, token_budget=token_budget))
+        for pattern in expected:
+            doc_ids = [d for d in index.documents if d == pattern or (pattern.endswith(":") and d.startswith(pattern))]
+            missing.extend((query, d) for d in doc_ids or [pattern] if index.documents.get(d) not in selected)
+    return missing
+
+
+def build_index(knowledge):
+    """與 CourseAssistantBot.apply_knowledge 相同的方式建立索引"""
+    index = CourseIndex()
+    for key, text in PromptCompiler().entries(knowledge).items():
+        index.add(key, text)
+    return index
+
+
+def retrieval_context(index, query, top_k, token_budget):
+    selected = index.select(query, top_k=top_k, token_budget=token_budget)
+    return "📌 目前公告內容如下（僅列出與問題相關的部分）：\n\n" + "\n\n".join(selected)
+
+
+def run_live(model, context, query):
+    """實際呼叫 Ollama，回傳 (prompt_eval_count, prompt_eval 秒數, 總秒數)"""
+    import ollama
+
+    start_time = time.perf_counter()
+    response = ollama.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "assistant", "content": context},
+            {"role": "user", "content": query}
+        ]
+    )
+    elapsed = time.perf_counter() - start_time
+    return response.get("prompt_eval_count", 0), response.get("prompt_eval_duration", 0) / 1e9, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完整公告 vs 檢索模式 benchmark")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--token-budget", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=200, help="檢索耗時量測的重複次數")
+    parser.add_argument("--live", action="store_true", help="實際呼叫 Ollama")
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL", "llama2:13b-chat"))
+    args = parser.parse_args()
+
+    index = build_index(load_knowledge())
+    system_tokens = estimate_tokens(system_prompt)
+    full_tokens = system_tokens + estimate_tokens(assistant_prompts)
+
+    print(f"索引項目數: {len(index)}，system prompt 約 {system_tokens} tokens")
+    print(f"{'問題':<40}{'完整':>8}{'檢索':>8}{'節省':>8}{'檢索耗時(µs)':>14}")
+    ratios = []
+    for query in test_prompts:
+        start_time = time.perf_counter()
+        for _ in range(args.repeat):
+            context = retrieval_context(index, query, args.top_k, args.token_budget)
+        micros = (time.perf_counter() - start_time) / args.repeat * 1e6
+        tokens = system_tokens + estimate_tokens(context)
+        ratios.append(tokens / full_tokens)
+        print(f"{query[:38]:<40}{full_tokens:>8}{tokens:>8}{1 - tokens / full_tokens:>8.0%}{micros:>14.1f}")
+    print(f"平均 prompt token 比例: {statistics.mean(ratios):.0%}（token 數為估計值）")
+
+    missing = check_recall(index, args.top_k, args.token_budget)
+    print(f"檢索召回檢查: {len(RECALL_CASES)} 題，遺漏 {len(missing)} 個項目")
+    for query, doc_id in missing:
+        print(f"  ❌ {query} 缺少 {doc_id}")
+
+    if args.live:
+        run_live_comparison(args, index)
+    if missing:
+        sys.exit(1)
+
+
+def run_live_comparison(args, index):
+    print("\n實際呼叫 Ollama（每題各跑一次完整與檢索模式）")
+    results = {"full": [], "retrieval": []}
+    for query in test_prompts:
+        contexts = {
+            "full": assistant_prompts,
+            "retrieval": retrieval_context(index, query, args.top_k, args.token_budget),
+        }
+        for mode, context in contexts.items():
+            prompt_tokens, prompt_seconds, elapsed = run_live(args.model, context, query)
+            results[mode].append((prompt_tokens, prompt_seconds, elapsed))
+            print(f"[{mode:<9}] prompt_eval={prompt_tokens:>5} tokens {prompt_seconds:6.2f}s 總計 {elapsed:6.2f}s | {query}")
+
+    for mode, rows in results.items():
+        print(
+            f"{mode:<9} 平均 prompt tokens {statistics.mean(r[0] for r in rows):7.1f}"
+            f"  prompt eval {statistics.mean(r[1] for r in rows):6.2f}s"
+            f"  總延遲 p50 {statistics.median(r[2] for r in rows):6.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""作業提醒 multicast 吞吐量測試
+
+以假 LINE 的 /v2/bot/message/multicast（可設定延遲與每秒請求上限）測試 ReminderScheduler，
+比較不同並行批次數的送達速度、429 次數，並檢查每位使用者剛好收到一次提醒。
+--crash-after 會在送出指定批次數後模擬行程中斷（LINE 已收到、進度尚未寫入），再以同一個進度檔重新執行，
+驗證續傳後沒有漏送也沒有重複送達。
+
+用法：
+    python benchmarks/bench_reminders.py --users 20000 --concurrency 1,4,8
+    python benchmarks/bench_reminders.py --rate-limit 20 --crash-after 7
+"""
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhook import CHANNEL_SECRET, load_bot
+from fake_services import FakeLineServer
+from reminder_scheduler import TAIWAN_TZ, KnownUsers, MulticastSender, ReminderScheduler
+
+
+class SimulatedCrash(BaseException):
+    """模擬行程在 LINE 收到請求後、寫入進度前中斷"""
+
+
+def assignments_due_soon():
+    due = datetime.now(TAIWAN_TZ) + timedelta(hours=1)
+    return {"作業一": {"主題": "benchmark", "繳交期限": f"{due:%Y/%m/%d %H:%M}"}}
+
+
+def make_scheduler(send, users, args, concurrency, progress_path):
+    sender = MulticastSender(send, concurrency=concurrency, max_retries=args.max_retries, backoff=args.backoff)
+    return ReminderScheduler(assignments_due_soon, users, sender, offsets_hours=(24,),
+                             progress_path=progress_path, batch_size=args.batch_size)
+
+
+def delivered(fake_line):
+    counts = collections.Counter()
+    for _, to, _ in fake_line.multicasts:
+        counts.update(to)
+    return counts
+
+
+def run_once(args, send, users, fake_line, concurrency):
+    """送出一次提醒並回傳統計"""
+    fake_line.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        progress_path = os.path.join(tmp, "reminder_progress.json")
+        crashed = False
+        start_time = time.perf_counter()
+        scheduler = make_scheduler(send, users, args, concurrency, progress_path)
+        if args.crash_after:
+            sent = [0]
+            lock = threading.Lock()
+
+            def crashing_send(user_ids, text, retry_key):
+                send(user_ids, text, retry_key)
+                with lock:
+                    sent[0] += 1
+                    if sent[0] == args.crash_after:
+                        raise SimulatedCrash()
+
+            scheduler = make_scheduler(crashing_send, users, args, concurrency, progress_path)
+            try:
+                scheduler.run_pending()
+            except SimulatedCrash:
+                crashed = True
+            # 重新啟動：從進度檔繼續
+            scheduler = make_scheduler(send, users, args, concurrency, progress_path)
+        scheduler.run_pending()
+        seconds = time.perf_counter() - start_time
+        stats = scheduler.stats()
+
+    counts = delivered(fake_line)
+    return {
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "recipients_per_second": sum(counts.values()) / seconds if seconds else 0.0,
+        "requests": len(fake_line.multicasts),
+        "rate_limited": fake_line.rate_limited,
+        "retries": stats["retries"],
+        "duplicates_detected": stats["duplicates"],
+        "crashed": crashed,
+        "missing": sum(1 for user in users.all() if counts[user] == 0),
+        "delivered_twice": sum(1 for n in counts.values() if n > 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="作業提醒 multicast 吞吐量測試")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,4,8", help="要測試的並行批次數，以逗號分隔")
+    parser.add_argument("--line-latency", type=float, default=0.05, help="假 LINE 每個請求的延遲秒數")
+    parser.add_argument("--rate-limit", type=float, default=0, help="假 LINE 每秒可接受的 multicast 數，0 表示不限制")
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--backoff", type=float, default=0.2, help="第一次重試前等待的秒數")
+    parser.add_argument("--crash-after", type=int, default=0, help="送出幾個批次後模擬中斷並續傳，0 表示不模擬")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    fake_line = FakeLineServer(latency=args.line_latency, multicast_rate=args.rate_limit).start()
+    bot = load_bot({
+        "LINE_CHANNEL_ACCESS_TOKEN": "benchmark-token",
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_API_HOST": fake_line.url,
+        "KNOWN_USERS_PATH": "",
+        # 不讀寫專案目錄中的常見問題回答表
+        "FAQ_TABLE_PATH": "",
+        "INTERACTION_LOG_DIR": "",
+        "REMINDER_PROGRESS_PATH": "",
+        "FAQ_ENABLED": "false",
+    })
+    users = KnownUsers("")
+    for i in range(args.users):
+        users.add(f"U{i:032x}")
+
+    results = []
+    try:
+        for concurrency in [int(n) for n in args.concurrency.split(",")]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_once(args, bot.course_bot.send_multicast, users, fake_line, concurrency)
+            results.append(result)
+            print(f"並行 {concurrency}: {result['seconds']:.2f}s，{result['recipients_per_second']:.0f} 人/秒，"
+                  f"{result['requests']} 次 multicast，429 {result['rate_limited']} 次，"
+                  f"漏送 {result['missing']}，重複 {result['delivered_twice']}")
+    finally:
+        fake_line.stop()
+
+    print("=====================================================================================")
+    print(f"{args.users} 位使用者，每批 {args.batch_size} 人，LINE 延遲 {args.line_latency * 1000:.0f} ms，"
+          f"限制 {args.rate_limit or '不限'} 次/秒" + (f"，第 {args.crash_after} 批後中斷續傳" if args.crash_after else ""))
+    for result in results:
+        print(f"並行 {result['concurrency']:>2}  {result['recipients_per_second']:9.0f} 人/秒  重試 {result['retries']:3d}"
+              f"  retry key 擋下重複 {result['duplicates_detected']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    if any(r["missing"] or r["delivered_twice"] for r in results):
+        print("❌ 有使用者漏送或重複收到提醒")
+        sys.exit(1)
+    print("✅ 每位使用者剛好收到一次提醒")
+
+
+if __name__ == "__main__":
+    main()
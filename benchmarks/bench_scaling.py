@@ -0,0 +1,148 @@
+"""多 worker 擴展測試
+
+以 gunicorn（gunicorn.conf.py + wsgi.py）分別用 1、2、4… 個 worker 行程啟動機器人，共用同一個 SHARED_STATE_PATH，
+用與 bench_webhook.py 相同的負載打 /webhook，比較各 worker 數的吞吐量與端到端延遲。
+LINE Messaging API 與 Ollama 都以本機假服務取代；每則訊息加上編號避免命中快取。
+
+用法：
+    python benchmarks/bench_scaling.py --workers 1,2,4 --requests 200 --concurrency 32
+    python benchmarks/bench_scaling.py --output scaling.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhook import CHANNEL_SECRET, load_bot, run_once
+from fake_services import FakeLineServer, FakeOllamaServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(workers, env, threads, timeout=30):
+    """以 gunicorn 啟動指定數量的 worker，回傳 webhook 網址"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers),
+         "--threads", str(threads), "--bind", f"127.0.0.1:{port}", "wsgi:app"],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn 啟動失敗（exit code {process.returncode}）")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/test", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError("gunicorn 啟動逾時")
+            time.sleep(0.05)
+        # 第一個 worker 可以回應時，其他 worker 可能還在載入
+        time.sleep(0.5 * workers)
+        yield f"http://127.0.0.1:{port}/webhook"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicorn worker 數與吞吐量的關係")
+    parser.add_argument("--workers", default="1,2,4", help="要測試的 worker 數，以逗號分隔")
+    parser.add_argument("--threads", type=int, default=4, help="每個 worker 處理請求的執行緒數")
+    parser.add_argument("--reply-workers", type=int, default=2, help="每個 worker 的背景回覆執行緒數（WORKER_COUNT）")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=0, help="平均每秒到達的訊息數（Poisson），0 表示盡快送出")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ollama-latency", type=float, default=0.2)
+    parser.add_argument("--ollama-token-latency", type=float, default=0.005)
+    parser.add_argument("--line-latency", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    # run_once 使用的參數
+    args.unique = True
+    args.batch = 1
+    args.redeliver = 0
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    fake_ollama = FakeOllamaServer(latency=args.ollama_latency, token_latency=args.ollama_token_latency).start()
+    fake_line = FakeLineServer(latency=args.line_latency).start()
+    env = {
+        "LINE_CHANNEL_ACCESS_TOKEN": "benchmark-token",
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_API_HOST": fake_line.url,
+        "OLLAMA_HOST": fake_ollama.url,
+        "WARM_UP_ON_START": "false",
+        "FAQ_ENABLED": "false",
+        "KNOWLEDGE_RELOAD_INTERVAL": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+        "KNOWN_USERS_PATH": "",
+        # 不讀寫專案目錄中的常見問題回答表
+        "FAQ_TABLE_PATH": "",
+        "WORKER_COUNT": str(args.reply_workers),
+    }
+    # 只用來取得固定的忙碌回覆訊息
+    bot = load_bot(env)
+    canned_replies = (bot.BUSY_MESSAGE, bot.RATE_LIMITED_MESSAGE)
+
+    results = []
+    try:
+        for workers in [int(n) for n in args.workers.split(",")]:
+            with tempfile.TemporaryDirectory() as tmp:
+                worker_env = dict(env, SHARED_STATE_PATH=os.path.join(tmp, "shared_state.db"),
+                                  INTERACTION_LOG_DIR=os.path.join(tmp, "interaction_logs"))
+                with serve(workers, worker_env, args.threads) as webhook_url:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = run_once(args, webhook_url, fake_line, random.Random(args.seed), canned_replies)
+            result["workers"] = workers
+            results.append(result)
+            print(f"{workers} 個 worker: 吞吐量 {result['throughput']:.1f} msg/s，e2e p50 {result['e2e_p50']:.3f}s "
+                  f"p95 {result['e2e_p95']:.3f}s，忙碌回覆 {result['busy_rate']:.1%}，錯誤率 {result['error_rate']:.1%}")
+    finally:
+        fake_line.stop()
+        fake_ollama.stop()
+
+    base = results[0]["throughput"] or 1
+    print("=====================================================================================")
+    print(f"請求數 {args.requests}，並行 {args.concurrency}，每個 worker {args.threads} 個請求執行緒、{args.reply_workers} 個回覆執行緒")
+    for result in results:
+        print(f"{result['workers']:>3} 個 worker  吞吐量 {result['throughput']:7.1f} msg/s（{result['throughput'] / base:.2f}x）"
+              f"  e2e p95 {result['e2e_p95']:7.3f} s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
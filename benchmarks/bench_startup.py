@@ -0,0 +1,115 @@
+"""冷啟動測試
+
+以子行程執行 `python machine-vision-chatbot.py`，量測從啟動到 `/test` 第一次回應 200 的時間，
+LINE Messaging API 與 Ollama 都以本機假服務取代。多輪取中位數，超過 --budget 秒時 exit 1，
+可放進 CI 避免重新引入拖慢啟動的匯入或初始化。
+
+用法：
+    python benchmarks/bench_startup.py --runs 5 --budget 1.5
+    python benchmarks/bench_startup.py --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_services import FakeLineServer, FakeOllamaServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_once(env, port, timeout):
+    """啟動機器人並回傳到 /test 回應 200 的秒數，逾時回傳 None"""
+    url = f"http://127.0.0.1:{port}/test"
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "machine-vision-chatbot.py"],
+        cwd=ROOT,
+        env={**os.environ, **env, "PORT": str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start_time < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"機器人啟動失敗（exit code {process.returncode}）")
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    return time.perf_counter() - start_time
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷啟動到第一個 /test 回應的時間")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="中位數超過此秒數時 exit 1")
+    parser.add_argument("--timeout", type=float, default=30, help="單輪等待上限秒數")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    fake_ollama = FakeOllamaServer().start()
+    fake_line = FakeLineServer().start()
+    env = {
+        "LINE_CHANNEL_ACCESS_TOKEN": "benchmark-token",
+        "LINE_CHANNEL_SECRET": "benchmark-channel-secret",
+        "LINE_API_HOST": fake_line.url,
+        "OLLAMA_HOST": fake_ollama.url,
+        "WARM_UP_ON_START": "false",
+        # 不讀寫專案目錄中的常見問題回答表
+        "FAQ_TABLE_PATH": "",
+        "KNOWN_USERS_PATH": "",
+        "INTERACTION_LOG_DIR": "",
+    }
+
+    runs = []
+    try:
+        for run in range(args.runs):
+            seconds = measure_once(env, free_port(), args.timeout)
+            if seconds is None:
+                print(f"第 {run + 1} 輪: 超過 {args.timeout:.0f} 秒仍未回應")
+                seconds = args.timeout
+            else:
+                print(f"第 {run + 1} 輪: {seconds:.3f}s")
+            runs.append(seconds)
+    finally:
+        fake_line.stop()
+        fake_ollama.stop()
+
+    median = statistics.median(runs)
+    print("=====================================================================================")
+    print(f"冷啟動到第一個 /test 回應：中位數 {median:.3f}s，最慢 {max(runs):.3f}s（{args.runs} 輪，預算 {args.budget:.2f}s）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "median": median, "max": max(runs), "runs": runs}, f, ensure_ascii=False, indent=2)
+
+    if median > args.budget:
+        print(f"❌ 冷啟動超過預算 {args.budget:.2f}s")
+        sys.exit(1)
+    print("✅ 冷啟動在預算內")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""/webhook 端到端壓力測試
+
+以正確簽名（LINE_CHANNEL_SECRET）的 webhook 請求，依設定的並行數與到達速率打 Flask app，
+LINE Messaging API 與 Ollama 都以本機假服務取代（可設定延遲）。
+回報 webhook 回應延遲與端到端（收到訊息到 LINE 收到回覆）延遲的 p50/p95/p99、吞吐量、
+reply token 過期比例、忙碌回覆（限流或排隊過久）比例與錯誤率。每輪都會清空快取與對話記憶，多輪取中位數讓結果穩定。
+--batch 讓一次 webhook 帶多個事件，--redeliver 以 isRedelivery 重送部分 webhook，檢查重送不會產生第二次回覆。
+
+用法：
+    python benchmarks/bench_webhook.py --requests 200 --concurrency 16 --rate 20
+    python benchmarks/bench_webhook.py --output bench.json
+    python benchmarks/bench_webhook.py --batch 3 --redeliver 0.2
+    python benchmarks/bench_webhook.py --baseline bench.json   # p95 或吞吐量變差超過 --tolerance 時 exit 1
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import hmac
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analyze_logs import analyze
+from fake_services import FakeLineServer, FakeOllamaServer
+from interaction_log import read_records, segment_paths
+from promptTesting import test_prompts
+
+CHANNEL_SECRET = "benchmark-channel-secret"
+
+
+def load_bot(env):
+    """設定環境變數後載入 machine-vision-chatbot.py"""
+    os.environ.update(env)
+    spec = importlib.util.spec_from_file_location("machine_vision_chatbot", os.path.join(ROOT, "machine-vision-chatbot.py"))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def sign(body, secret=CHANNEL_SECRET):
+    """計算 X-Line-Signature"""
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def make_event(text, user_id, reply_token, timestamp_ms, redelivery=False):
+    """產生 LINE 文字訊息事件"""
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": timestamp_ms,
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex,
+        "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": reply_token,
+        "message": {"id": uuid.uuid4().hex[:12], "type": "text", "quoteToken": "q", "text": text},
+    }
+
+
+def make_body(events):
+    return json.dumps({"destination": "Ubenchmark", "events": events}, ensure_ascii=False)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_once(args, webhook_url, fake_line, rng, canned_replies=()):
+    """執行一輪測試並回傳統計"""
+    fake_line.reset()
+    # 事先決定每則訊息的內容與使用者，讓每輪的負載相同
+    plan = []
+    for i in range(args.requests):
+        query = rng.choice(test_prompts)
+        plan.append((f"{query} #{i}" if args.unique else query, f"U{rng.randrange(args.users)}"))
+
+    sent = []
+    sent_lock = threading.Lock()
+    client = httpx.Client(timeout=30, limits=httpx.Limits(max_connections=args.concurrency))
+
+    def post(body):
+        try:
+            return client.post(
+                webhook_url,
+                content=body.encode("utf-8"),
+                headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"}
+            ).status_code
+        except httpx.HTTPError:
+            return 0
+
+    def send(indexes, redeliver):
+        now = time.time()
+        events = []
+        messages = []
+        for index in indexes:
+            text, user_id = plan[index]
+            reply_token = uuid.uuid4().hex
+            fake_line.issue_token(reply_token, now)
+            events.append(make_event(text, user_id, reply_token, int(now * 1000)))
+            messages.append((reply_token, user_id))
+        body = make_body(events)
+        start_time = time.perf_counter()
+        status = post(body)
+        ack = time.perf_counter() - start_time
+        with sent_lock:
+            for reply_token, user_id in messages:
+                sent.append({"token": reply_token, "user_id": user_id, "sent_at": now, "ack": ack, "status": status})
+        if redeliver:
+            # LINE 沒收到 200 時會帶著相同的 webhookEventId 重送
+            for event in events:
+                event["deliveryContext"]["isRedelivery"] = True
+            post(make_body(events))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        next_at = time.perf_counter()
+        for i in range(0, args.requests, args.batch):
+            if args.rate > 0:
+                next_at += rng.expovariate(args.rate)
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, range(i, min(i + args.batch, args.requests)), rng.random() < args.redeliver)
+
+    # 等待所有回覆（reply 或 push）送達假 LINE
+    deadline = time.time() + args.drain_timeout
+    while time.time() < deadline:
+        if len(fake_line.replies) + len(fake_line.pushes) >= len(sent):
+            break
+        time.sleep(0.05)
+    client.close()
+
+    # 計算端到端延遲：reply 以 token 對應，push 依使用者先進先出對應
+    latencies = []
+    busy = 0
+    errors = sum(1 for s in sent if s["status"] != 200)
+    pending_by_user = {}
+    for s in sorted(sent, key=lambda s: s["sent_at"]):
+        reply = fake_line.replies.get(s["token"])
+        if reply is not None:
+            latencies.append(reply[0] - s["sent_at"])
+            text = reply[1][0]["text"]
+            if text.startswith("生成回應時發生錯誤"):
+                errors += 1
+            elif text in canned_replies:
+                busy += 1
+        else:
+            pending_by_user.setdefault(s["user_id"], []).append(s)
+    for pushed_at, user_id, messages in sorted(fake_line.pushes, key=lambda p: p[0]):
+        waiting = pending_by_user.get(user_id)
+        if waiting:
+            latencies.append(pushed_at - waiting.pop(0)["sent_at"])
+            if messages[0]["text"] in canned_replies:
+                busy += 1
+    missing = sum(len(v) for v in pending_by_user.values())
+    end = max([start] + [r[0] for r in fake_line.replies.values()] + [p[0] for p in fake_line.pushes])
+    acks = [s["ack"] for s in sent]
+    return {
+        "requests": len(sent),
+        "ack_p50": percentile(acks, 50),
+        "ack_p95": percentile(acks, 95),
+        "ack_p99": percentile(acks, 99),
+        "e2e_p50": percentile(latencies, 50),
+        "e2e_p95": percentile(latencies, 95),
+        "e2e_p99": percentile(latencies, 99),
+        "throughput": len(latencies) / (end - start) if end > start else 0.0,
+        "token_expiry_rate": len(fake_line.pushes) / len(sent) if sent else 0.0,
+        "busy_rate": busy / len(sent) if sent else 0.0,
+        "error_rate": (errors + missing) / len(sent) if sent else 0.0,
+        # 同一個 reply token 被回覆第二次（重送的事件又生成了一次回覆）
+        "duplicate_replies": fake_line.invalid,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/webhook 端到端壓力測試")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="同時送出的 webhook 請求數上限")
+    parser.add_argument("--rate", type=float, default=0, help="平均每秒到達的訊息數（Poisson），0 表示盡快送出")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--unique", action="store_true", help="每則訊息加上編號，避免命中快取")
+    parser.add_argument("--batch", type=int, default=1, help="每個 webhook 請求帶的事件數")
+    parser.add_argument("--redeliver", type=float, default=0, help="以 isRedelivery 重送的 webhook 比例")
+    parser.add_argument("--ollama-latency", type=float, default=0.2)
+    parser.add_argument("--ollama-token-latency", type=float, default=0.005)
+    parser.add_argument("--line-latency", type=float, default=0.01)
+    parser.add_argument("--token-ttl", type=float, default=60, help="假 LINE 的 reply token 有效秒數")
+    parser.add_argument("--rate-limit", type=float, default=0, help="每位使用者每分鐘的訊息上限（RATE_LIMIT_PER_MINUTE），0 表示不限流")
+    parser.add_argument("--max-queue-wait", type=float, default=40, help="佇列等待上限秒數（MAX_QUEUE_WAIT）")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="與 baseline 比較時允許變差的比例")
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    fake_ollama = FakeOllamaServer(latency=args.ollama_latency, token_latency=args.ollama_token_latency).start()
+    fake_line = FakeLineServer(latency=args.line_latency, token_ttl=args.token_ttl).start()
+    log_dir = tempfile.TemporaryDirectory()
+    bot = load_bot({
+        "LINE_CHANNEL_ACCESS_TOKEN": "benchmark-token",
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_API_HOST": fake_line.url,
+        "OLLAMA_HOST": fake_ollama.url,
+        "RATE_LIMIT_PER_MINUTE": str(args.rate_limit),
+        "MAX_QUEUE_WAIT": str(args.max_queue_wait),
+        "KNOWN_USERS_PATH": "",
+        # 不讀寫專案目錄中的常見問題回答表
+        "FAQ_TABLE_PATH": "",
+        # 問答紀錄照常在背景寫入，一併量測它對延遲的影響
+        "INTERACTION_LOG_DIR": log_dir.name,
+    })
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    webhook_url = f"http://127.0.0.1:{server.server_port}/webhook"
+
+    runs = []
+    try:
+        for run in range(args.runs):
+            # 每輪都從相同的狀態開始
+            bot.course_bot.response_cache.clear()
+            for user in range(args.users):
+                bot.course_bot.memory.clear(f"U{user}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_once(args, webhook_url, fake_line, random.Random(args.seed),
+                                  (bot.BUSY_MESSAGE, bot.RATE_LIMITED_MESSAGE))
+            runs.append(result)
+            print(f"第 {run + 1} 輪: e2e p95 {result['e2e_p95']:.3f}s，吞吐量 {result['throughput']:.1f} msg/s，"
+                  f"忙碌回覆 {result['busy_rate']:.1%}，錯誤率 {result['error_rate']:.1%}")
+    finally:
+        server.shutdown()
+        fake_line.stop()
+        fake_ollama.stop()
+        bot.interaction_log.close()
+        log_stats = bot.interaction_log.stats()
+        log_latency = analyze(read_records(segment_paths(log_dir.name)))["latency"]
+        log_dir.cleanup()
+
+    summary = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+    print("=====================================================================================")
+    print(f"請求數 {summary['requests']:.0f}，並行 {args.concurrency}，到達速率 {args.rate or '不限'}（{args.runs} 輪中位數）")
+    print(f"webhook 回應  p50 {summary['ack_p50'] * 1000:8.1f} ms  p95 {summary['ack_p95'] * 1000:8.1f} ms  p99 {summary['ack_p99'] * 1000:8.1f} ms")
+    print(f"端到端回覆    p50 {summary['e2e_p50']:8.3f} s   p95 {summary['e2e_p95']:8.3f} s   p99 {summary['e2e_p99']:8.3f} s")
+    print(f"吞吐量 {summary['throughput']:.1f} msg/s，reply token 過期比例 {summary['token_expiry_rate']:.1%}，"
+          f"忙碌回覆比例 {summary['busy_rate']:.1%}，錯誤率 {summary['error_rate']:.1%}，重複回覆 {summary['duplicate_replies']:.0f}")
+    print(f"問答紀錄寫入 {log_stats['written']} 筆，丟棄 {log_stats['dropped']} 筆，壓縮 {log_stats['segments']} 個檔案")
+    queue_wait = log_latency.get("queue_wait")
+    if queue_wait:
+        print(f"問答紀錄中的排隊等待 {queue_wait['count']} 筆，p50 {queue_wait['p50']:.3f}s，p95 {queue_wait['p95']:.3f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary, "runs": runs}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+        failed = []
+        if summary["e2e_p95"] > baseline["e2e_p95"] * (1 + args.tolerance):
+            failed.append(f"e2e p95 {baseline['e2e_p95']:.3f}s -> {summary['e2e_p95']:.3f}s")
+        if summary["throughput"] < baseline["throughput"] * (1 - args.tolerance):
+            failed.append(f"吞吐量 {baseline['throughput']:.1f} -> {summary['throughput']:.1f} msg/s")
+        if summary["error_rate"] > baseline["error_rate"] + 0.01:
+            failed.append(f"錯誤率 {baseline['error_rate']:.1%} -> {summary['error_rate']:.1%}")
+        for message in failed:
+            print(f"❌ 效能退步: {message}")
+        if failed:
+            sys.exit(1)
+        print("✅ 與 baseline 相比沒有明顯退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,161 @@
+"""設定值
+
+匯入本模組不會有任何副作用；程式進入點需先呼叫 init_config() 載入 .env 並讀取設定，
+之後才能 from config import ...。
+"""
 import os
-from dotenv import load_dotenv
 
-# 清除先前可能設定的環境變數
-os.environ.pop('OLLAMA_MODEL', None)
+# 專案目錄，設定中的相對路徑都以此為準
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_initialized = False
+
+
+def _read_settings():
+    """從環境變數讀取所有設定，回傳 {名稱: 值}"""
+    # Line Bot 配置
+    LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
+    LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET', '')
+    # LINE Messaging API 位址（benchmark 時可指向本機假服務）
+    LINE_API_HOST = os.getenv('LINE_API_HOST', 'https://api.line.me')
+
+    # Ollama 模型配置
+    OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama2:13b-chat')
+    # 分級模型：簡單問題先用 FAST_MODEL，需要時才升級到 LARGE_MODEL（預設為 OLLAMA_MODEL）
+    # 預設關閉，FAST_MODEL 需先以 ollama pull 下載；預熱時找不到 FAST_MODEL 會自動關閉
+    MODEL_ROUTING = os.getenv('MODEL_ROUTING', 'false').lower() == 'true'
+    FAST_MODEL = os.getenv('FAST_MODEL', 'qwen:7b-chat')
+    LARGE_MODEL = os.getenv('LARGE_MODEL', OLLAMA_MODEL)
+    # 每個請求的生成時間預算（秒），大模型超過時改用小模型的回答
+    ROUTER_LATENCY_BUDGET = float(os.getenv('ROUTER_LATENCY_BUDGET', '30'))
+    # 超過此字數的問題直接交給大模型
+    ROUTER_MAX_FAST_CHARS = int(os.getenv('ROUTER_MAX_FAST_CHARS', '60'))
+    # 直接交給大模型的問題保留給小模型備援的秒數（大模型在預算減去此秒數時逾時）
+    ROUTER_FALLBACK_SECONDS = float(os.getenv('ROUTER_FALLBACK_SECONDS', '10'))
+    # 模型後端與連線配置
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'ollama')
+    OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+    OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '120'))
+    OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+    # 模型閒置後保留在記憶體中的時間（Ollama keep_alive 格式，例如 30m、-1 表示永久）
+    OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+    # 閒置超過此秒數時送出 ping 保持模型載入，0 表示不啟用
+    KEEP_WARM_INTERVAL = float(os.getenv('KEEP_WARM_INTERVAL', '240'))
+    WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'true').lower() == 'true'
+    # print("(config.py) 目前使用的模型是：", OLLAMA_MODEL)
+    # Webhook 配置
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'http://localhost:5000/webhook')
+    # Flask 監聽的埠號
+    PORT = int(os.getenv('PORT', '5000'))
+
+    # 非同步處理配置：webhook 驗證簽名後立即回應，由背景執行緒生成回覆
+    ASYNC_PROCESSING = os.getenv('ASYNC_PROCESSING', 'true').lower() == 'true'
+    WORKER_COUNT = int(os.getenv('WORKER_COUNT', '2'))
+    WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '100'))
+    # reply token 的有效時間有限，超過此秒數改用 push_message 回覆
+    REPLY_TOKEN_TTL = float(os.getenv('REPLY_TOKEN_TTL', '50'))
+    # 在佇列中等待超過此秒數的訊息直接回覆「請稍後再試」（應小於 REPLY_TOKEN_TTL，0 表示不限制）
+    MAX_QUEUE_WAIT = float(os.getenv('MAX_QUEUE_WAIT', '40'))
+    # 每位使用者的限流：平均每分鐘最多 RATE_LIMIT_PER_MINUTE 則，可連續發送 RATE_LIMIT_BURST 則（0 表示不限流）
+    RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', '6'))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '3'))
+
+    # 同一個 webhookEventId 在此秒數內重送時不再處理
+    WEBHOOK_DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', '3600'))
+    # 同步處理（ASYNC_PROCESSING=false）時，一次 webhook 中不同使用者的事件最多同時處理幾個
+    WEBHOOK_EVENT_CONCURRENCY = int(os.getenv('WEBHOOK_EVENT_CONCURRENCY', '4'))
+
+    # 回覆快取配置（課程內容或模型變更時會自動失效）
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '600'))
+
+    # 快速拒答配置：要程式碼、要實作方式的問題不經過 LLM 直接回覆固定拒答句
+    REFUSAL_FAST_PATH = os.getenv('REFUSAL_FAST_PATH', 'true').lower() == 'true'
+    REFUSAL_THRESHOLD = float(os.getenv('REFUSAL_THRESHOLD', '0.8'))
+
+    # 課程內容檢索配置：retrieval 只送出與問題相關的公告項目，full 送出完整公告
+    CONTEXT_MODE = os.getenv('CONTEXT_MODE', 'retrieval')
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+    RETRIEVAL_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '400'))
+
+    # 串流生成配置：一邊接收一邊過濾 <think>，回答超過長度時提早結束
+    STREAMING = os.getenv('STREAMING', 'true').lower() == 'true'
+    STREAM_MAX_CHARS = int(os.getenv('STREAM_MAX_CHARS', '120'))
+    STREAM_NUM_PREDICT = int(os.getenv('STREAM_NUM_PREDICT', '512'))
+    # 會先輸出思考內容的模型（名稱包含其中任一字串），沒有 <think> 開頭時仍暫存到 </think> 才輸出回答
+    REASONING_MODELS = [m.strip().lower() for m in os.getenv('REASONING_MODELS', 'deepseek-r1,qwq,qwen3').split(',') if m.strip()]
+
+    # 課程知識檔：system prompt、作業、課程內容與公告的唯一來源，修改後每 KNOWLEDGE_RELOAD_INTERVAL 秒內自動重新載入（0 表示不檢查）
+    KNOWLEDGE_PATH = os.path.join(BASE_DIR, os.getenv('KNOWLEDGE_PATH', 'course_knowledge.json'))
+    KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv('KNOWLEDGE_RELOAD_INTERVAL', '5'))
+    # 完整公告的 token 上限（0 表示不限制）
+    KNOWLEDGE_TOKEN_BUDGET = int(os.getenv('KNOWLEDGE_TOKEN_BUDGET', '1500'))
 
-# 載入 .env 文件
-load_dotenv("./.env")
+    # 常見問題回答表：預先生成的答案，課程內容改變時只重建受影響的題目
+    FAQ_ENABLED = os.getenv('FAQ_ENABLED', 'true').lower() == 'true'
+    FAQ_CATALOGUE = os.path.join(BASE_DIR, os.getenv('FAQ_CATALOGUE', 'faq_catalogue.json'))
+    # 設為空字串時只保留在記憶體中，不寫入檔案
+    FAQ_TABLE_PATH = os.getenv('FAQ_TABLE_PATH', 'faq_table.json') and os.path.join(BASE_DIR, os.getenv('FAQ_TABLE_PATH', 'faq_table.json'))
+    FAQ_MATCH_THRESHOLD = float(os.getenv('FAQ_MATCH_THRESHOLD', '0.7'))
+    # 課程內容連續變更時，最後一次變更後等待幾秒才重建
+    FAQ_REBUILD_DELAY = float(os.getenv('FAQ_REBUILD_DELAY', '2'))
 
-# Line Bot 配置
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
-LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET', '')
+    # 對話記憶配置：每位使用者的記憶以 token 數限制，閒置過久或總量過大時清除
+    MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', 'true').lower() == 'true'
+    MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '300'))
+    MEMORY_IDLE_SECONDS = float(os.getenv('MEMORY_IDLE_SECONDS', '1800'))
+    MEMORY_MAX_TOTAL_TOKENS = int(os.getenv('MEMORY_MAX_TOTAL_TOKENS', '200000'))
+
+    # 相同問題同時進行時只生成一次，其他人等待同一個結果（秒）
+    COALESCE_TIMEOUT = float(os.getenv('COALESCE_TIMEOUT', '120'))
+
+    # 多個 worker 行程（gunicorn）共用的狀態檔：回覆快取、對話記憶、限流與課程內容版本，空字串表示只放在本行程的記憶體中
+    SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH', '') and os.path.join(BASE_DIR, os.getenv('SHARED_STATE_PATH', ''))
+
+    # 作業截止提醒：在截止前 REMINDER_OFFSETS_HOURS 小時以 multicast 提醒曾經互動過的使用者（預設關閉）
+    REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', 'false').lower() == 'true'
+    REMINDER_OFFSETS_HOURS = [float(h) for h in os.getenv('REMINDER_OFFSETS_HOURS', '72,24').split(',') if h.strip()]
+    REMINDER_CHECK_INTERVAL = float(os.getenv('REMINDER_CHECK_INTERVAL', '60'))
+    # 每次 multicast 的收件人數（LINE 上限 500）與同時進行的批次數
+    REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '500'))
+    REMINDER_CONCURRENCY = int(os.getenv('REMINDER_CONCURRENCY', '4'))
+    REMINDER_MAX_RETRIES = int(os.getenv('REMINDER_MAX_RETRIES', '5'))
+    # 曾經互動過的使用者與提醒進度（設為空字串時只保留在記憶體中）
+    KNOWN_USERS_PATH = os.getenv('KNOWN_USERS_PATH', 'known_users.txt') and os.path.join(BASE_DIR, os.getenv('KNOWN_USERS_PATH', 'known_users.txt'))
+    REMINDER_PROGRESS_PATH = os.getenv('REMINDER_PROGRESS_PATH', 'reminder_progress.json') and os.path.join(BASE_DIR, os.getenv('REMINDER_PROGRESS_PATH', 'reminder_progress.json'))
+
+    # 結構化問答紀錄（壓縮的 JSONL，以 analyze_logs.py 離線統計），設為空字串時改為直接 print 每則問答
+    INTERACTION_LOG_DIR = os.getenv('INTERACTION_LOG_DIR', 'interaction_logs') and os.path.join(BASE_DIR, os.getenv('INTERACTION_LOG_DIR', 'interaction_logs'))
+    # 寫入中的檔案超過大小（bytes）或時間（秒）時壓縮並換下一個檔案
+    INTERACTION_LOG_SEGMENT_BYTES = int(os.getenv('INTERACTION_LOG_SEGMENT_BYTES', str(8 * 1024 * 1024)))
+    INTERACTION_LOG_SEGMENT_SECONDS = float(os.getenv('INTERACTION_LOG_SEGMENT_SECONDS', '3600'))
+    INTERACTION_LOG_QUEUE_SIZE = int(os.getenv('INTERACTION_LOG_QUEUE_SIZE', '10000'))
+    # 計算使用者雜湊時加入的字串，避免由 LINE user ID 反查
+    INTERACTION_LOG_SALT = os.getenv('INTERACTION_LOG_SALT', '')
+
+    # 管理用 token，設定後才能透過 /profiler/start、/profiler/stop 開關取樣 profiler
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+    PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))
+
+    return {name: value for name, value in locals().items() if name.isupper()}
+
+
+def init_config(env_file="./.env", validate=True):
+    """載入 .env 並讀取設定到模組層級（重複呼叫只會執行一次）"""
+    global _initialized
+    if not _initialized:
+        from dotenv import load_dotenv
+
+        # 清除先前可能設定的環境變數
+        os.environ.pop('OLLAMA_MODEL', None)
+
+        # 載入 .env 文件
+        load_dotenv(env_file)
+        globals().update(_read_settings())
+        _initialized = True
+    if validate:
+        validate_config()
 
-# Ollama 模型配置
-OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama2:13b-chat')
-# print("(config.py) 目前使用的模型是：", OLLAMA_MODEL)
-# Webhook 配置
-WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'http://localhost:5000/webhook')
 
 # 額外的安全檢查
 def validate_config():
@@ -30,6 +170,3 @@ def validate_config():
     
     if errors:
         raise ValueError("\n".join(errors))
-
-# 在導入時立即進行配置驗證
-validate_config()
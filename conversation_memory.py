@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from text_utils import estimate_tokens
+
+
+class Turn:
+    """一則對話紀錄"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content, tokens):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+class Session:
+    """單一使用者的對話紀錄，以 token 數而非對話次數限制長度"""
+
+    __slots__ = ("turns", "tokens", "last_active")
+
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0
+        self.last_active = time.monotonic()
+
+
+class ConversationMemory:
+    """依 user_id 保存的對話記憶
+
+    每個使用者的紀錄不超過 session_token_budget，閒置超過 idle_seconds 的紀錄會被清除，
+    所有使用者的總 token 數超過 max_total_tokens 時，從最久沒說話的使用者開始清除。
+    """
+
+    def __init__(self, session_token_budget=300, idle_seconds=1800, max_total_tokens=200000):
+        self.session_token_budget = session_token_budget
+        self.idle_seconds = idle_seconds
+        self.max_total_tokens = max_total_tokens
+        # 依最後活動時間排序，最久沒說話的在最前面
+        self._sessions = OrderedDict()
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def history(self, user_id):
+        """取得使用者的對話紀錄（ollama messages 格式）"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            session = self._sessions.get(user_id)
+            if session is None:
+                return []
+            return [{"role": turn.role, "content": turn.content} for turn in session.turns]
+
+    def append(self, user_id, user_query, response):
+        """加入一問一答，超過預算時從最舊的對話開始移除"""
+        turns = [
+            Turn("user", user_query, estimate_tokens(user_query)),
+            Turn("assistant", response, estimate_tokens(response)),
+        ]
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = Session()
+            else:
+                self._sessions.move_to_end(user_id)
+            session.last_active = now
+            for turn in turns:
+                session.turns.append(turn)
+                session.tokens += turn.tokens
+                self._total_tokens += turn.tokens
+            # 一問一答成對移除，避免留下沒有問題的回答
+            while session.tokens > self.session_token_budget and len(session.turns) > 2:
+                for _ in range(2):
+                    removed = session.turns.popleft()
+                    session.tokens -= removed.tokens
+                    self._total_tokens -= removed.tokens
+            self._evict_idle(now)
+            self._evict_capacity(user_id)
+
+    def clear(self, user_id):
+        """清除使用者的對話紀錄"""
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                self._total_tokens -= session.tokens
+
+    def _evict_idle(self, now):
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active <= self.idle_seconds:
+                break
+            del self._sessions[user_id]
+            self._total_tokens -= session.tokens
+            self.evicted_idle += 1
+
+    def _evict_capacity(self, current_user_id):
+        while self._total_tokens > self.max_total_tokens and len(self._sessions) > 1:
+            user_id, session = next(iter(self._sessions.items()))
+            if user_id == current_user_id:
+                break
+            del self._sessions[user_id]
+            self._total_tokens -= session.tokens
+            self.evicted_capacity += 1
+
+    def stats(self):
+        """回傳記憶使用量與使用者數"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "total_tokens": self._total_tokens,
+                "total_chars": sum(len(t.content) for s in self._sessions.values() for t in s.turns),
+                "evicted_idle": self.evicted_idle,
+                "evicted_capacity": self.evicted_capacity,
+            }
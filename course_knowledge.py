@@ -0,0 +1,216 @@
+"""課程知識檔（course_knowledge.json）的載入、編譯與熱更新
+
+知識檔是 system prompt、作業、課程內容與公告的唯一來源，機器人、promptTesting.py 與 ollamaTest.py 都從這裡讀取。
+compile_prompt() 把內容轉成精簡的公告文字並控制在 token 預算內；
+每個項目的轉換結果會依內容快取，重新載入時只有改變的項目需要重新轉換。
+KnowledgeWatcher 定期檢查檔案修改時間，內容改變且格式正確時才整份替換，格式錯誤時保留舊內容。
+"""
+import json
+import os
+import threading
+
+from course_retrieval import render_announcement, render_assignment, render_course_content
+from text_utils import estimate_tokens
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "course_knowledge.json")
+PROMPT_HEADER = "📌 目前公告內容如下："
+
+
+class KnowledgeError(ValueError):
+    """知識檔格式錯誤"""
+
+
+def load_knowledge(path=DEFAULT_PATH):
+    """讀取並檢查知識檔，課程內容可寫成字串或逐行的陣列"""
+    with open(path, encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise KnowledgeError(f"{path} 不是合法的 JSON: {e}")
+    if not isinstance(data.get("system_prompt"), str) or not data["system_prompt"].strip():
+        raise KnowledgeError("缺少 system_prompt")
+    assignments = data.get("assignments", {})
+    course_content = data.get("course_content", {})
+    announcements = data.get("announcements", [])
+    if not isinstance(assignments, dict) or not isinstance(course_content, dict) or not isinstance(announcements, list):
+        raise KnowledgeError("assignments、course_content 必須是物件，announcements 必須是陣列")
+    return {
+        "system_prompt": data["system_prompt"],
+        "assignments": assignments,
+        "course_content": {
+            topic: "\n".join(content) if isinstance(content, list) else str(content)
+            for topic, content in course_content.items()
+        },
+        "announcements": [str(announcement) for announcement in announcements],
+    }
+
+
+def announcement_id(announcement, occurrence=1):
+    """公告以標題（全形冒號前的文字）作為 id，插入新公告不會改變其他公告的 id
+
+    同標題的後續公告（例如「期中考：改到 4/30」）依出現順序加上 #2、#3…，不會取代先前的公告。
+    """
+    key = "announcement:" + announcement.partition("：")[0]
+    return key if occurrence == 1 else f"{key}#{occurrence}"
+
+
+def announcement_ids(announcements):
+    """依順序回傳每則公告的 id，同標題的公告各自有不同的 id"""
+    seen = {}
+    ids = []
+    for announcement in announcements:
+        title = announcement.partition("：")[0]
+        seen[title] = seen.get(title, 0) + 1
+        ids.append(announcement_id(announcement, seen[title]))
+    return ids
+
+
+class PromptCompiler:
+    """把知識檔轉成索引項目與精簡的公告文字，每個項目的轉換結果依內容快取"""
+
+    def __init__(self):
+        self._cache = {}
+        self.rendered = 0
+
+    def _render(self, key, value, render):
+        cache_key = (key, json.dumps(value, ensure_ascii=False, sort_keys=True))
+        text = self._cache.get(cache_key)
+        if text is None:
+            text = self._cache[cache_key] = render()
+            self.rendered += 1
+        return text
+
+    def entries(self, knowledge):
+        """回傳 {項目 id: 轉換後的文字}，作為檢索索引與快取指紋的依據"""
+        entries = {}
+        for name, details in knowledge["assignments"].items():
+            key = f"assignment:{name}"
+            entries[key] = self._render(key, details, lambda: render_assignment(name, details))
+        for topic, content in knowledge["course_content"].items():
+            key = f"content:{topic}"
+            entries[key] = self._render(key, content, lambda: render_course_content(topic, content))
+        for key, announcement in zip(announcement_ids(knowledge["announcements"]), knowledge["announcements"]):
+            entries[key] = self._render(key, announcement, lambda: render_announcement(announcement))
+        # 只保留目前用得到的轉換結果
+        live = set(entries.values())
+        self._cache = {k: v for k, v in self._cache.items() if v in live}
+        return entries
+
+    def compile(self, knowledge, token_budget=0):
+        """組出完整公告文字，回傳 (文字, 估計 token 數, 因超過預算而略過的項目)
+
+        公告與課程內容優先，作業從最新（檔案中最後一項）往前加入，直到超過 token_budget（0 表示不限制）；
+        輸出時仍依原本的順序排列。
+        """
+        entries = self.entries(knowledge)
+        announcements = announcement_ids(knowledge["announcements"])
+        contents = [f"content:{topic}" for topic in knowledge["course_content"]]
+        assignments = [f"assignment:{name}" for name in knowledge["assignments"]]
+
+        def block(key):
+            if key.startswith("announcement:"):
+                # 公告合併在同一個「課程公告：」段落下，不重複標題
+                return entries[key].partition("：")[2]
+            return entries[key]
+
+        used = estimate_tokens(PROMPT_HEADER) + estimate_tokens("課程公告：")
+        kept = set()
+        dropped = []
+        for key in announcements + contents + assignments[::-1]:
+            tokens = estimate_tokens(block(key))
+            if token_budget and used + tokens > token_budget:
+                dropped.append(key)
+                continue
+            used += tokens
+            kept.add(key)
+
+        sections = [PROMPT_HEADER]
+        sections.extend(block(key) for key in assignments + contents if key in kept)
+        kept_announcements = [block(key) for key in announcements if key in kept]
+        if kept_announcements:
+            sections.append("課程公告：\n" + "\n".join(kept_announcements))
+        text = "\n\n".join(sections)
+        return text, estimate_tokens(text), dropped
+
+
+def diff_entries(old, new):
+    """比較兩份項目，回傳 (新增或改變的 id, 移除的 id)"""
+    changed = [key for key, text in new.items() if old.get(key) != text]
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+class KnowledgeWatcher:
+    """定期檢查知識檔，內容改變時呼叫 on_change(knowledge)"""
+
+    def __init__(self, path, on_change, interval=5):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self._mtime = self._stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """檔案有變動時重新載入，回傳是否套用了新內容"""
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            knowledge = load_knowledge(self.path)
+        except (OSError, KnowledgeError) as e:
+            # 編輯到一半或格式錯誤時保留目前的內容
+            self.errors += 1
+            print(f"知識檔載入失敗，保留目前內容: {e}")
+            return False
+        self.on_change(knowledge)
+        self.reloads += 1
+        return True
+
+    def start(self):
+        """interval <= 0 表示不啟用"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"套用知識檔時發生錯誤: {e}")
+
+        self._thread = threading.Thread(target=run, name="knowledge-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {"reloads": self.reloads, "errors": self.errors}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="編譯知識檔並回報 token 數")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    parser.add_argument("--token-budget", type=int, default=0)
+    args = parser.parse_args()
+
+    knowledge = load_knowledge(args.path)
+    text, tokens, dropped = PromptCompiler().compile(knowledge, args.token_budget)
+    print(text)
+    print("=====================================================================================")
+    print(f"公告約 {tokens} tokens，system prompt 約 {estimate_tokens(knowledge['system_prompt'])} tokens")
+    if dropped:
+        print(f"超過預算而略過: {', '.join(dropped)}")
@@ -0,0 +1,183 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from text_utils import estimate_tokens, normalize_query
+
+_WORD_RE = re.compile(r"[a-z0-9_]+|[^\sa-z0-9_]+")
+# 問整個類別的問法（「有什麼公告」「本週作業是什麼」）要列出該類別的全部項目，依項目 id 的前綴分類
+CATEGORY_WORDS = {"announcement": ("公告",), "assignment": ("作業",)}
+
+
+def item_title(doc_id):
+    """項目 id 中的標題，例如 announcement:期中考#2 -> 期中考"""
+    return doc_id.partition(":")[2].partition("#")[0]
+
+
+def tokenize(text):
+    """把文字切成檢索用的詞：中文取單字與相鄰兩字（bigram），英數字取整個單字"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _WORD_RE.findall(text):
+        if run[0].isascii():
+            tokens.append(run)
+            continue
+        chars = [ch for ch in run if unicodedata.category(ch)[0] not in ("P", "Z", "S")]
+        tokens.extend(chars)
+        tokens.extend(a + b for a, b in zip(chars, chars[1:]))
+    return tokens
+
+
+class CourseIndex:
+    """課程內容的 BM25 檢索索引，新增或更新單一項目時只更新該項目"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = {}
+        self._postings = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, text):
+        """新增或取代一個項目"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._remove(doc_id)
+            self.documents[doc_id] = text
+            self._doc_lengths[doc_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[doc_id]
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = count
+
+    def remove(self, doc_id):
+        """移除一個項目"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        if doc_id not in self.documents:
+            return
+        for term in set(tokenize(self.documents[doc_id])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        del self.documents[doc_id]
+
+    def search(self, query, top_k=3):
+        """回傳與問題最相關的 [(doc_id, 分數)]，依分數由高到低排序"""
+        with self._lock:
+            doc_count = len(self.documents)
+            if not doc_count:
+                return []
+            avg_length = self._total_length / doc_count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def category_items(self, query):
+        """問題提到類別但沒有指定其中任何一項時，回傳該類別全部項目的 id，否則回傳空串列"""
+        text = normalize_query(query)
+        with self._lock:
+            doc_ids = list(self.documents)
+        for category, words in CATEGORY_WORDS.items():
+            if not any(word in text for word in words):
+                continue
+            items = [doc_id for doc_id in doc_ids if doc_id.startswith(category + ":")]
+            if items and not any(normalize_query(item_title(doc_id)) in text for doc_id in items):
+                return items
+        return []
+
+    def select(self, query, top_k=3, token_budget=400):
+        """選出最相關且總 token 數不超過預算的項目內容
+
+        問整個類別（公告、作業）時回傳該類別的全部項目，不受 top_k 與預算限制，少列一項就會答錯。
+        """
+        category = self.category_items(query)
+        if category:
+            with self._lock:
+                return [self.documents[doc_id] for doc_id in category if doc_id in self.documents]
+        selected = []
+        used = 0
+        for doc_id, _ in self.search(query, top_k):
+            text = self.documents.get(doc_id)
+            if text is None:
+                continue
+            tokens = estimate_tokens(text)
+            if used + tokens > token_budget:
+                continue
+            selected.append(text)
+            used += tokens
+        return selected
+
+
+def render_assignment(name, details):
+    """把作業詳情轉成公告格式的文字"""
+    if not isinstance(details, dict):
+        return f"{name}：\n- {details}"
+    lines = [f"{name}："]
+    for key, value in details.items():
+        if isinstance(value, dict):
+            value = "、".join(f"{k} {v}" for k, v in value.items())
+        lines.append(f"- {key}：{value}")
+    return "\n".join(lines)
+
+
+def render_course_content(topic, content):
+    """把課程內容轉成公告格式的文字"""
+    return f"{topic}：\n{content}"
+
+
+def render_announcement(announcement):
+    """把單則公告轉成文字"""
+    return f"課程公告：{announcement}"
+
+
+def parse_course_prompt(prompt_text):
+    """把 assistant_prompts 格式的公告文字拆成公告、作業與課程內容
+
+    回傳 (announcements, assignments, course_content)，可直接用來填入 course_info。
+    """
+    announcements = []
+    assignments = {}
+    course_content = {}
+    section = None
+    for raw_line in prompt_text.splitlines():
+        line = raw_line.strip()
+        if not line or "📌" in line:
+            continue
+        if line.endswith("：") and not line.startswith("-"):
+            section = line[:-1]
+            continue
+        if section is None:
+            continue
+        if section.startswith("作業"):
+            item = line.lstrip("- ").strip()
+            key, sep, value = item.partition("：")
+            if not sep:
+                key, value = "說明", item
+            details = assignments.setdefault(section, {})
+            details[key] = f"{details[key]}；{value}" if key in details else value
+        elif section == "課程公告":
+            announcements.append(line)
+        else:
+            existing = course_content.get(section)
+            course_content[section] = f"{existing}\n{line}" if existing else line
+    return announcements, assignments, course_content
@@ -0,0 +1,279 @@
+"""本機假服務，用於離線測試與 benchmark
+
+- FakeOllamaServer：模擬 Ollama 的 /api/chat（含串流）與 /api/tags，可設定延遲
+- FakeLineServer：模擬 LINE Messaging API 的 reply / push，會檢查 reply token 是否過期
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from text_utils import estimate_tokens
+
+# 假模型看到這些字時回覆拒答句
+REFUSAL_TRIGGERS = ["程式", "function", "函式", "怎麼做", "實作", "原理", "邏輯", "pseudocode", "怎麼處理"]
+
+
+def fake_answer(user_query):
+    """依問題產生固定的假回答"""
+    if any(word in user_query.lower() for word in REFUSAL_TRIGGERS):
+        return "我無法提供"
+    return f"根據課程公告，{user_query[:20]}的相關資訊請參考公告內容。"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # 用戶端提早關閉連線（例如串流被中斷）不算錯誤
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeService:
+    """在背景執行緒中執行的本機 HTTP 服務"""
+
+    handler_class = None
+
+    def __init__(self, host="127.0.0.1", port=0):
+        handler = type("Handler", (self.handler_class,), {"service": self})
+        self.server = _Server((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _OllamaHandler(_JSONHandler):
+    def do_GET(self):
+        if self.path != "/api/tags" or self.service.models is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {"models": [{"name": name} for name in self.service.models]})
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_json(404, {"error": "not found"})
+            return
+        service = self.service
+        request = self.read_json()
+        messages = request.get("messages") or []
+        user_query = messages[-1]["content"] if messages else ""
+        answer = fake_answer(user_query)
+        num_predict = (request.get("options") or {}).get("num_predict")
+        if num_predict:
+            answer = answer[:num_predict]
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        latency = service.model_latency.get(request.get("model"), service.latency)
+        prompt_seconds = latency + prompt_tokens * service.prompt_token_latency
+        eval_seconds = len(answer) * service.token_latency
+        service.record(request)
+
+        time.sleep(prompt_seconds)
+        stats = {
+            "model": request.get("model"),
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": len(answer),
+            "eval_duration": int(eval_seconds * 1e9),
+            "total_duration": int((prompt_seconds + eval_seconds) * 1e9),
+        }
+        if not request.get("stream", True):
+            time.sleep(eval_seconds)
+            stats["message"] = {"role": "assistant", "content": answer}
+            self.send_json(200, stats)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for ch in answer:
+                time.sleep(service.token_latency)
+                self._write_chunk({"model": request.get("model"), "message": {"role": "assistant", "content": ch}, "done": False})
+            stats["message"] = {"role": "assistant", "content": ""}
+            self._write_chunk(stats)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端提早結束串流
+            pass
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(FakeService):
+    """模擬 Ollama /api/chat
+
+    latency 為每次請求的固定延遲，prompt_token_latency 與 token_latency 分別模擬 prompt eval 與生成每個 token 的時間，
+    model_latency 可針對個別模型設定不同的固定延遲，models 為 /api/tags 回傳的模型清單（None 時回傳 404）。
+    """
+
+    handler_class = _OllamaHandler
+
+    def __init__(self, latency=0.05, token_latency=0.001, prompt_token_latency=0.0,
+                 model_latency=None, models=None, host="127.0.0.1", port=0):
+        super().__init__(host, port)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.model_latency = model_latency or {}
+        self.models = models
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+
+class _LineHandler(_JSONHandler):
+    def do_POST(self):
+        service = self.service
+        request = self.read_json()
+        time.sleep(service.latency)
+        if self.path == "/v2/bot/message/reply":
+            status, payload = service.handle_reply(request)
+        elif self.path == "/v2/bot/message/push":
+            status, payload = service.handle_push(request)
+        elif self.path == "/v2/bot/message/multicast":
+            status, payload = service.handle_multicast(request, self.headers.get("X-Line-Retry-Key"))
+        else:
+            status, payload = 404, {"message": "Not found"}
+        self.send_json(status, payload)
+
+
+class FakeLineServer(FakeService):
+    """模擬 LINE Messaging API
+
+    reply token 需先以 issue_token() 登記，超過 token_ttl 秒或重複使用時回傳 400（與 LINE 相同），
+    每次 reply / push 都會記錄收到的時間，供 benchmark 計算端到端延遲。
+    multicast 每秒超過 multicast_rate 次（0 表示不限制）時回傳 429，重複的 X-Line-Retry-Key 回傳 409。
+    """
+
+    handler_class = _LineHandler
+
+    def __init__(self, latency=0.0, token_ttl=60, multicast_rate=0, host="127.0.0.1", port=0):
+        super().__init__(host, port)
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.multicast_rate = multicast_rate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.tokens = {}
+            self.replies = {}
+            self.pushes = []
+            self.multicasts = []
+            self.retry_keys = set()
+            self.expired = 0
+            self.invalid = 0
+            self.rate_limited = 0
+            self._window = (0, 0)
+
+    def issue_token(self, reply_token, issued_at=None):
+        """登記 reply token 與發出時間"""
+        with self._lock:
+            self.tokens[reply_token] = time.time() if issued_at is None else issued_at
+
+    def handle_reply(self, request):
+        token = request.get("replyToken")
+        now = time.time()
+        with self._lock:
+            issued_at = self.tokens.pop(token, None)
+            if issued_at is None:
+                self.invalid += 1
+                return 400, {"message": "Invalid reply token"}
+            if now - issued_at > self.token_ttl:
+                self.expired += 1
+                return 400, {"message": "Invalid reply token"}
+            self.replies[token] = (now, request.get("messages"))
+        return 200, {}
+
+    def handle_push(self, request):
+        with self._lock:
+            self.pushes.append((time.time(), request.get("to"), request.get("messages")))
+        return 200, {}
+
+
+    def handle_multicast(self, request, retry_key):
+        to = request.get("to") or []
+        now = time.time()
+        with self._lock:
+            if not to or len(to) > 500:
+                self.invalid += 1
+                return 400, {"message": "The request body has 1 error(s)"}
+            if retry_key in self.retry_keys:
+                return 409, {"message": "The retry key is already accepted"}
+            if self.multicast_rate:
+                second, requests = self._window
+                if int(now) != second:
+                    second, requests = int(now), 0
+                if requests >= self.multicast_rate:
+                    self.rate_limited += 1
+                    return 429, {"message": "The API rate limit has been exceeded. Try again later."}
+                self._window = (second, requests + 1)
+            if retry_key:
+                self.retry_keys.add(retry_key)
+            self.multicasts.append((now, list(to), request.get("messages")))
+        return 200, {}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="啟動本機假 Ollama 服務")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    service = FakeOllamaServer(latency=args.latency, token_latency=args.token_latency, port=args.port)
+    print(f"假 Ollama 服務運行中: {service.url}")
+    service.server.serve_forever()
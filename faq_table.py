@@ -0,0 +1,366 @@
+"""預先計算的常見問題回答表
+
+faq_catalogue.json 列出常見問題與各種問法；每個問題的答案只在它用到的課程內容改變時才重新生成，
+生成後經過檢查（不可空白、不可是拒答、日期類問題必須包含公告中的日期）才會寫入 faq_table.json。
+收到問題時先以正規化後完全相同或 bigram 相似度比對，命中就直接回覆，不經過模型。
+
+用法：
+    python faq_table.py                # 以 OLLAMA_HOST 上的模型重新建立 faq_table.json
+    python faq_table.py --mock         # 使用本機假 Ollama，離線執行
+    python faq_table.py --check        # 檢查 faq_catalogue.json 的問法與不可命中的問法
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from refusal_filter import is_refusal
+from text_utils import normalize_query
+
+CHINESE_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+# 阿拉伯數字，或接在「作業」「第」後面的中文數字（避免把「哪一天」的一當成編號）
+_KEY_TOKEN = re.compile(r"\d+|(?<=作業)[一二三四五六七八九十]+|(?<=第)[一二三四五六七八九十]+")
+_HOMEWORK = re.compile(r"(?:hw|homework|作業)0?([1-9])")
+# 比對時忽略的虛字
+_FILLERS = re.compile(r"請問|的|是|嗎|呢|啊|呀|要")
+# 問句類型，依序比對：「什麼時候」要先於「什麼」，「怎麼寫」要先於「怎麼」
+_QUESTION_TYPES = (
+    ("write", re.compile(r"(?:怎麼|如何)(?:寫|做|實作)")),
+    ("when", re.compile(r"什麼時候|何時|期限|截止|幾號|幾點|哪一?天|日期|deadline")),
+    ("how", re.compile(r"怎麼|怎樣|如何|哪裡|方式|格式")),
+    ("what", re.compile(r"什麼|哪些|內容|範圍|主題|幾個|限制")),
+)
+_DATE = re.compile(r"(?:\d{4}\s*[/年-]\s*)?(\d{1,2})\s*[/月-]\s*(\d{1,2})")
+
+
+def _number(token):
+    if token.isdigit():
+        return int(token)
+    if "十" not in token:
+        return int("".join(str(CHINESE_DIGITS[ch]) for ch in token))
+    tens, _, ones = token.partition("十")
+    return CHINESE_DIGITS.get(tens, 1) * 10 + CHINESE_DIGITS.get(ones, 0)
+
+
+def _key_tokens(text):
+    """問題中的編號（作業三、HW3、第十週），模糊比對時必須完全相同"""
+    return frozenset(_number(token) for token in _KEY_TOKEN.findall(text))
+
+
+def question_type(text):
+    """問句類型（write、when、how、what），沒有疑問詞時回傳 None"""
+    for kind, pattern in _QUESTION_TYPES:
+        if pattern.search(text):
+            return kind
+    return None
+
+
+def canonical(text):
+    """正規化後統一作業編號寫法（HW3、作業3 -> 作業三）並去掉虛字"""
+    text = _HOMEWORK.sub(lambda m: "作業" + "一二三四五六七八九"[int(m.group(1)) - 1], normalize_query(text))
+    return _FILLERS.sub("", text)
+
+
+def _bigrams(text):
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def extract_dates(text):
+    """取出文字中的 (月, 日)，例如 2025/04/19、4/15、4月19日"""
+    return {(int(m), int(d)) for m, d in _DATE.findall(text) if 1 <= int(m) <= 12 and 1 <= int(d) <= 31}
+
+
+def validate_answer(entry, answer, context):
+    """檢查生成的答案是否可以放進回答表，回傳不通過的原因或 None"""
+    text = (answer or "").strip()
+    if not text:
+        return "empty"
+    if is_refusal(text):
+        return "refusal"
+    if entry.get("kind") == "date":
+        expected = extract_dates(context)
+        if expected and not extract_dates(text) & expected:
+            return "missing_date"
+    return None
+
+
+def load_catalogue(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FAQMatcher:
+    """以正規化後完全相同或 bigram Dice 相似度比對常見問題"""
+
+    def __init__(self, catalogue, threshold=0.7):
+        self.threshold = threshold
+        self._exact = {}
+        self._variants = []
+        self._postings = {}
+        for entry in catalogue:
+            for text in [entry["question"], *entry.get("paraphrases", [])]:
+                normalized = canonical(text)
+                if not normalized:
+                    continue
+                self._exact.setdefault(normalized, entry["id"])
+                grams = _bigrams(normalized)
+                index = len(self._variants)
+                self._variants.append((entry["id"], len(grams), _key_tokens(normalized), question_type(normalized)))
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(index)
+
+    def match(self, query):
+        """回傳 (問題 id, 相似度)，沒有夠相似的問題時回傳 (None, 最高相似度)"""
+        normalized = canonical(query)
+        entry_id = self._exact.get(normalized)
+        if entry_id is not None:
+            return entry_id, 1.0
+        grams = _bigrams(normalized)
+        if not grams:
+            return None, 0.0
+        overlap = {}
+        for gram in grams:
+            for index in self._postings.get(gram, ()):
+                overlap[index] = overlap.get(index, 0) + 1
+        keys = _key_tokens(normalized)
+        kind = question_type(normalized)
+        best_id, best_score = None, 0.0
+        for index, shared in overlap.items():
+            entry_id, size, variant_keys, variant_kind = self._variants[index]
+            score = 2 * shared / (len(grams) + size)
+            # 「作業二期限」與「作業三期限」很像，但編號不同就不能算同一題；
+            # 「期中考考什麼」與「期中考什麼時候」也很像，但問的是內容不是日期
+            if score > best_score and variant_keys == keys and variant_kind == kind:
+                best_id, best_score = entry_id, score
+        if best_score >= self.threshold:
+            return best_id, best_score
+        return None, best_score
+
+
+def check_catalogue(catalogue, threshold=0.7):
+    """每個問法都要比對到自己的問題，not_matching 中的問法不可比對到該問題，回傳不通過的 [(問法, 預期, 結果)]"""
+    matcher = FAQMatcher(catalogue, threshold)
+    failures = []
+    for entry in catalogue:
+        for text in [entry["question"], *entry.get("paraphrases", [])]:
+            entry_id, _ = matcher.match(text)
+            if entry_id != entry["id"]:
+                failures.append((text, entry["id"], entry_id))
+        for text in entry.get("not_matching", []):
+            entry_id, _ = matcher.match(text)
+            if entry_id == entry["id"]:
+                failures.append((text, None, entry_id))
+    return failures
+
+
+class FAQTable:
+    """常見問題回答表，依每題的內容指紋決定是否需要重新生成
+
+    fingerprint_fn(question) 回傳這題目前用到的課程內容指紋，context_fn(question) 回傳生成時的課程內容，
+    generate(question, context) 呼叫模型生成答案。
+    多個 worker 行程共用 store（SharedStore）時，同一時間只有一個行程重建，其他行程從回答表檔案載入結果。
+    """
+
+    def __init__(self, catalogue, path, fingerprint_fn, context_fn, generate, threshold=0.7, rebuild_delay=2.0,
+                 store=None, rebuild_lease=600):
+        self.entries = {entry["id"]: entry for entry in catalogue}
+        self.path = path
+        self.fingerprint_fn = fingerprint_fn
+        self.context_fn = context_fn
+        self.generate = generate
+        self.rebuild_delay = rebuild_delay
+        self.store = store
+        self.rebuild_lease = rebuild_lease
+        self.matcher = FAQMatcher(catalogue, threshold=threshold)
+        self._answers = {}
+        self._fingerprints = {}
+        # 答案沒通過檢查的題目，內容沒變之前不再重試
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._timer = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.rejected = {}
+        self.load()
+
+    def load(self):
+        """載入磁碟上的回答表（指紋不符的答案之後會被 refresh 淘汰）"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                table = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"讀取常見問題回答表失敗: {e}")
+            return
+        with self._lock:
+            for entry_id, row in table.get("answers", {}).items():
+                if entry_id in self.entries:
+                    self._answers[entry_id] = row["answer"]
+                    self._fingerprints[entry_id] = row["fingerprint"]
+            for entry_id, fingerprint in table.get("failed", {}).items():
+                if entry_id in self.entries:
+                    self._failed[entry_id] = fingerprint
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            answers = {
+                entry_id: {
+                    "question": self.entries[entry_id]["question"],
+                    "answer": answer,
+                    "fingerprint": self._fingerprints[entry_id],
+                }
+                for entry_id, answer in self._answers.items()
+            }
+            failed = dict(self._failed)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "answers": answers, "failed": failed}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """重新計算每題的內容指紋，淘汰內容已改變的答案，回傳需要重新生成的題目"""
+        stale = {}
+        for entry_id, entry in self.entries.items():
+            fingerprint = self.fingerprint_fn(entry["question"])
+            with self._lock:
+                if self._failed.get(entry_id) == fingerprint:
+                    continue
+                if self._fingerprints.get(entry_id) != fingerprint:
+                    self._answers.pop(entry_id, None)
+                    self._fingerprints.pop(entry_id, None)
+                    stale[entry_id] = fingerprint
+        return stale
+
+    def rebuild(self):
+        """只重新生成內容有變動的題目並存檔，回傳生成的題數"""
+        if self.store is None:
+            return self._rebuild()
+        with self.store.lease("faq_rebuild", self.rebuild_lease) as acquired:
+            if not acquired:
+                # 其他行程正在重建，稍後再載入它的結果
+                self.schedule_rebuild()
+                return 0
+            # 先載入其他行程已生成的答案，指紋相同的題目不必重新生成
+            self.load()
+            return self._rebuild()
+
+    def _rebuild(self):
+        with self._rebuild_lock:
+            stale = self.refresh()
+            built = 0
+            for entry_id, fingerprint in stale.items():
+                entry = self.entries[entry_id]
+                context = self.context_fn(entry["question"])
+                try:
+                    answer = self.generate(entry["question"], context)
+                except Exception as e:
+                    print(f"生成常見問題 {entry_id} 的答案失敗: {e}")
+                    continue
+                reason = validate_answer(entry, answer, context)
+                if reason is not None:
+                    print(f"常見問題 {entry_id} 的答案未通過檢查: {reason}")
+                    with self._lock:
+                        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+                        self._failed[entry_id] = fingerprint
+                    continue
+                # 生成期間內容又被修改時，留給下一次重建
+                if self.fingerprint_fn(entry["question"]) != fingerprint:
+                    continue
+                with self._lock:
+                    self._answers[entry_id] = answer.strip()
+                    self._fingerprints[entry_id] = fingerprint
+                    self.generated += 1
+                built += 1
+            if stale:
+                self.save()
+                print(f"常見問題回答表已更新：{built}/{len(stale)} 題")
+            return built
+
+    def schedule_rebuild(self):
+        """課程內容變更時呼叫；連續多次變更只會在最後一次後 rebuild_delay 秒重建一次"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.rebuild_delay, self._run_rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"重建常見問題回答表時發生錯誤: {e}")
+
+    def lookup(self, query):
+        """回傳預先生成的答案，沒有命中時回傳 None"""
+        entry_id, _ = self.matcher.match(query)
+        with self._lock:
+            answer = self._answers.get(entry_id) if entry_id else None
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "ready": len(self._answers),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "generated": self.generated,
+                "rejected": dict(self.rejected),
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description="重新建立常見問題回答表")
+    parser.add_argument("--mock", action="store_true", help="啟動本機假 Ollama 服務離線執行（不寫入回答表檔案）")
+    parser.add_argument("--check", action="store_true", help="只檢查 faq_catalogue.json 的問法比對結果，不重建")
+    args = parser.parse_args()
+
+    if args.check:
+        import sys
+
+        root = os.path.dirname(os.path.abspath(__file__))
+        failures = check_catalogue(load_catalogue(os.path.join(root, "faq_catalogue.json")),
+                                   float(os.getenv("FAQ_MATCH_THRESHOLD", "0.7")))
+        for text, expected, actual in failures:
+            print(f"❌ {text}: 預期 {expected or '不命中'}，結果 {actual or '不命中'}")
+        print("=====================================================================================")
+        print(f"{'✅ 全部通過' if not failures else f'❌ {len(failures)} 個問法不通過'}")
+        sys.exit(1 if failures else 0)
+
+    mock = None
+    if args.mock:
+        from fake_services import FakeOllamaServer
+
+        mock = FakeOllamaServer().start()
+        os.environ["OLLAMA_HOST"] = mock.url
+        # 假答案只用來檢查重建流程，不能寫進正式的 faq_table.json
+        os.environ["FAQ_TABLE_PATH"] = ""
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location("machine_vision_chatbot", os.path.join(root, "machine-vision-chatbot.py"))
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    try:
+        bot.course_bot.faq.rebuild()
+    finally:
+        if mock is not None:
+            mock.stop()
+    print(bot.course_bot.faq.stats())
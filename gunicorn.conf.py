@@ -0,0 +1,21 @@
+"""gunicorn 設定
+
+python machine-vision-chatbot.py 是單一行程的開發伺服器；正式環境以多個 worker 行程執行：
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+
+from dotenv import dotenv_values
+
+bind = f"0.0.0.0:{os.getenv('PORT', dotenv_values('.env').get('PORT') or '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# webhook 大多時間在等待 LINE 與模型，每個 worker 以多個執行緒處理請求
+worker_class = "gthread"
+threads = int(os.getenv('WEB_THREADS', '4'))
+timeout = 60
+# 每個 worker 自己載入機器人：背景執行緒與 SQLite 連線不能跨 fork 共用
+preload_app = False
+
+# 多個 worker 必須共用狀態，環境變數與 .env 都沒有指定時使用專案目錄下的 shared_state.db
+if not os.getenv('SHARED_STATE_PATH') and not dotenv_values('.env').get('SHARED_STATE_PATH'):
+    os.environ['SHARED_STATE_PATH'] = 'shared_state.db'
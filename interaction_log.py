@@ -0,0 +1,205 @@
+"""結構化的問答紀錄
+
+每則訊息的處理結果（使用者雜湊、問題、處理路徑、是否命中快取、各階段耗時、模型、是否拒答）
+放進有上限的佇列，由背景執行緒寫成 JSONL，請求執行緒不會等待磁碟；佇列已滿時丟棄並計數。
+寫入中的檔案超過大小或時間上限時關閉並壓縮成 interactions-<時間>-<pid>-<序號>.jsonl.gz，檔案只會新增不會修改，
+多個 worker 行程可以寫入同一個目錄。analyze_logs.py 逐行讀取這些檔案做離線統計。
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from metrics import count
+from reminder_scheduler import TAIWAN_TZ
+
+SEGMENT_PREFIX = "interactions-"
+_STOP = object()
+
+
+def hash_user(user_id, salt=""):
+    """使用者 ID 的雜湊：同一位使用者得到相同的值，但紀錄中不會出現 ID 本身"""
+    if not user_id:
+        return None
+    return hashlib.sha256(f"{salt}{user_id}".encode("utf-8")).hexdigest()[:16]
+
+
+def segment_paths(directory):
+    """依時間順序列出紀錄檔（已壓縮的 .jsonl.gz 與寫入中的 .jsonl）"""
+    if not directory or not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory)
+             if name.startswith(SEGMENT_PREFIX) and name.endswith((".jsonl", ".jsonl.gz"))]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def read_records(paths):
+    """逐行讀取紀錄檔，一次只有一筆在記憶體中；無法解析的行（例如寫到一半）略過"""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (OSError, EOFError) as e:
+            print(f"讀取 {path} 時發生錯誤: {e}")
+
+
+class InteractionLog:
+    """以背景執行緒寫入的問答紀錄，directory 為空字串時不記錄"""
+
+    def __init__(self, directory, max_segment_bytes=8 * 1024 * 1024, max_segment_seconds=3600,
+                 queue_size=10000, salt=""):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.salt = salt
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._sequence = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.segments = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def start(self):
+        """啟動背景寫入執行緒（重複呼叫不會重複啟動）"""
+        with self._lock:
+            if self._thread is not None or not self.enabled or self._closed:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="interaction-log", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, record):
+        """加入一筆紀錄並立即返回，佇列已滿時丟棄"""
+        if not self.enabled or self._closed:
+            return
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            count("chatbot_interaction_log_dropped_total", "佇列已滿而丟棄的問答紀錄數")
+
+    def close(self, timeout=5):
+        """寫完佇列中的紀錄並壓縮目前的檔案"""
+        with self._lock:
+            thread = self._thread
+            if self._closed:
+                return
+            self._closed = True
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self._seconds_until_rotation())
+            except queue.Empty:
+                record = None
+            batch = []
+            stop = record is _STOP
+            if record is not None and not stop:
+                batch.append(record)
+                # 一次取出已在佇列中的紀錄，合併成一次寫入
+                while len(batch) < 1000:
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is _STOP:
+                        stop = True
+                        break
+                    batch.append(record)
+            if batch:
+                self._write(batch)
+            if stop:
+                self._rotate()
+                return
+            if self._file is not None and (self._size >= self.max_segment_bytes or
+                                           time.monotonic() - self._opened_at >= self.max_segment_seconds):
+                self._rotate()
+
+    def _seconds_until_rotation(self):
+        if self._file is None:
+            return None
+        return max(0.0, self.max_segment_seconds - (time.monotonic() - self._opened_at))
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = f"{SEGMENT_PREFIX}{datetime.now(TAIWAN_TZ):%Y%m%d-%H%M%S}-{os.getpid()}-{self._sequence:04d}.jsonl"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, "a", encoding="utf-8")
+        self._opened_at = time.monotonic()
+        self._size = 0
+
+    def _write(self, batch):
+        try:
+            if self._file is None:
+                self._open_segment()
+            data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data.encode("utf-8"))
+            with self._lock:
+                self.written += len(batch)
+        except (OSError, TypeError, ValueError) as e:
+            with self._lock:
+                self.errors += 1
+            print(f"寫入問答紀錄時發生錯誤: {e}")
+
+    def _rotate(self):
+        """關閉目前的檔案並壓縮，壓縮完成前不會出現 .jsonl.gz，讀取端不會讀到寫一半的壓縮檔"""
+        if self._file is None:
+            return
+        path = self._path
+        self._file.close()
+        self._file = None
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            os.remove(path)
+            with self._lock:
+                self.segments += 1
+        except OSError as e:
+            with self._lock:
+                self.errors += 1
+            print(f"壓縮問答紀錄 {path} 時發生錯誤: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "segments": self.segments,
+                "pending": self._queue.qsize(),
+            }
@@ -0,0 +1,163 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class LLMBackend(ABC):
+    """模型後端介面，CourseAssistantBot 只透過 chat() 呼叫模型，子類別必須實作 chat()"""
+
+    name = "base"
+
+    @abstractmethod
+    def chat(self, model, messages, stream=False, options=None):
+        """與 ollama.chat 相同的參數與回傳格式"""
+
+    def available_models(self):
+        """後端已有的模型名稱，無法取得時回傳 None"""
+        return None
+
+    def warm_up(self, model, messages):
+        """啟動時預先載入模型"""
+
+    def start_keep_warm(self, model, messages, interval):
+        """定期呼叫模型，避免閒置後被卸載"""
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class OllamaBackend(LLMBackend):
+    """使用常駐 HTTP 連線的 Ollama 後端
+
+    所有請求共用同一個 ollama.Client（底層為 httpx 連線池），並設定逾時與 keep_alive，
+    讓模型在閒置期間仍保留在記憶體中。ollama 套件在第一次使用時才載入，不拖慢啟動。
+    """
+
+    name = "ollama"
+
+    def __init__(self, host=None, timeout=120, connect_timeout=5, keep_alive="30m", max_connections=8):
+        self.keep_alive = keep_alive
+        self.host = host
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self._client = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._keep_warm_threads = {}
+        self.last_used = {}
+        self.requests = 0
+        self.pings = 0
+        self.warm_up_seconds = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    import ollama
+
+                    self._client = ollama.Client(
+                        host=self.host,
+                        timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                        limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+                    )
+        return self._client
+
+    def chat(self, model, messages, stream=False, options=None):
+        with self._lock:
+            self.requests += 1
+            self.last_used[model] = time.monotonic()
+        return self.client.chat(
+            model=model,
+            messages=messages,
+            stream=stream,
+            options=options,
+            keep_alive=self.keep_alive
+        )
+
+    def available_models(self):
+        try:
+            return {model["name"] for model in self.client.list().get("models", [])}
+        except Exception as e:
+            print(f"取得模型清單時發生錯誤: {e}")
+            return None
+
+    def _ping(self, model, messages):
+        """只生成 1 個 token 的請求，用來載入模型並讓 system prompt 進入前綴快取"""
+        start_time = time.perf_counter()
+        self.client.chat(
+            model=model,
+            messages=messages,
+            options={"num_predict": 1},
+            keep_alive=self.keep_alive
+        )
+        return time.perf_counter() - start_time
+
+    def warm_up(self, model, messages):
+        """連續呼叫兩次：第一次為冷啟動（載入模型），第二次為模型已載入的延遲"""
+        try:
+            cold_start_seconds = self._ping(model, messages)
+            warm_seconds = self._ping(model, messages)
+            with self._lock:
+                self.warm_up_seconds[model] = {"cold_start": cold_start_seconds, "warm": warm_seconds}
+                self.last_used[model] = time.monotonic()
+            print(f"模型 {model} 預熱完成：冷啟動 {cold_start_seconds:.2f} 秒，已載入 {warm_seconds:.2f} 秒")
+        except Exception as e:
+            print(f"模型預熱時發生錯誤: {e}")
+
+    def start_keep_warm(self, model, messages, interval):
+        """模型閒置超過 interval 秒時發送一次 ping，interval <= 0 表示不啟用（每個模型各一個執行緒）"""
+        if interval <= 0 or model in self._keep_warm_threads:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                with self._lock:
+                    idle = time.monotonic() - self.last_used.get(model, 0.0)
+                if idle < interval:
+                    continue
+                try:
+                    self._ping(model, messages)
+                    with self._lock:
+                        self.pings += 1
+                        self.last_used[model] = time.monotonic()
+                except Exception as e:
+                    print(f"保持模型 {model} 載入的 ping 失敗: {e}")
+
+        thread = threading.Thread(target=run, name=f"keep-warm-{model}", daemon=True)
+        self._keep_warm_threads[model] = thread
+        thread.start()
+
+    def stop(self):
+        """停止 keep-warm 並關閉連線"""
+        self._stop.set()
+        if self._client is not None:
+            self._client._client.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "requests": self.requests,
+                "keep_warm_pings": self.pings,
+                "warm_up_seconds": dict(self.warm_up_seconds),
+            }
+
+
+def model_available(model, available):
+    """模型是否在清單中，沒有標籤的名稱視為 :latest（與 ollama 相同）"""
+    return model in available or (":" not in model and f"{model}:latest" in available)
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+}
+
+
+def create_backend(name="ollama", **kwargs):
+    """依名稱建立模型後端"""
+    if name not in BACKENDS:
+        raise ValueError(f"不支援的模型後端: {name}（可用: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](**kwargs)
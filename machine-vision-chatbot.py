@@ -1,135 +1,283 @@
 import os
-from flask import Flask, request, abort
-import ollama
+import json
+from flask import Flask, request, abort, Response
 import time
 import re
-from datetime import datetime, timedelta, timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-# 導入Line Bot V3 SDK
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
-from linebot.v3.webhook import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.messaging.models import TextMessage, ReplyMessageRequest, PushMessageRequest, BroadcastRequest
+# Line Bot V3 SDK 與 ollama 載入較慢，在第一次使用時才匯入（見 CourseAssistantBot.line_messaging_api、handler）
 
-# 引入配置
+# 引入配置（先載入 .env 並檢查設定）
+import config
+config.init_config()
 from config import (
     LINE_CHANNEL_ACCESS_TOKEN, 
     LINE_CHANNEL_SECRET, 
+    LINE_API_HOST,
     OLLAMA_MODEL, 
-    WEBHOOK_URL
+    MODEL_ROUTING,
+    FAST_MODEL,
+    LARGE_MODEL,
+    ROUTER_LATENCY_BUDGET,
+    ROUTER_MAX_FAST_CHARS,
+    ROUTER_FALLBACK_SECONDS,
+    WEBHOOK_URL,
+    PORT,
+    LLM_BACKEND,
+    OLLAMA_HOST,
+    OLLAMA_TIMEOUT,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_KEEP_ALIVE,
+    KEEP_WARM_INTERVAL,
+    WARM_UP_ON_START,
+    ASYNC_PROCESSING,
+    WORKER_COUNT,
+    WORKER_QUEUE_SIZE,
+    REPLY_TOKEN_TTL,
+    MAX_QUEUE_WAIT,
+    WEBHOOK_DEDUP_TTL,
+    WEBHOOK_EVENT_CONCURRENCY,
+    RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_BURST,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    REFUSAL_FAST_PATH,
+    REFUSAL_THRESHOLD,
+    CONTEXT_MODE,
+    RETRIEVAL_TOP_K,
+    RETRIEVAL_TOKEN_BUDGET,
+    STREAMING,
+    STREAM_MAX_CHARS,
+    STREAM_NUM_PREDICT,
+    REASONING_MODELS,
+    FAQ_ENABLED,
+    FAQ_CATALOGUE,
+    FAQ_TABLE_PATH,
+    FAQ_MATCH_THRESHOLD,
+    FAQ_REBUILD_DELAY,
+    MEMORY_ENABLED,
+    MEMORY_TOKEN_BUDGET,
+    MEMORY_IDLE_SECONDS,
+    MEMORY_MAX_TOTAL_TOKENS,
+    COALESCE_TIMEOUT,
+    KNOWLEDGE_PATH,
+    KNOWLEDGE_RELOAD_INTERVAL,
+    KNOWLEDGE_TOKEN_BUDGET,
+    SHARED_STATE_PATH,
+    REMINDERS_ENABLED,
+    REMINDER_OFFSETS_HOURS,
+    REMINDER_CHECK_INTERVAL,
+    REMINDER_BATCH_SIZE,
+    REMINDER_CONCURRENCY,
+    REMINDER_MAX_RETRIES,
+    KNOWN_USERS_PATH,
+    REMINDER_PROGRESS_PATH,
+    INTERACTION_LOG_DIR,
+    INTERACTION_LOG_SEGMENT_BYTES,
+    INTERACTION_LOG_SEGMENT_SECONDS,
+    INTERACTION_LOG_QUEUE_SIZE,
+    INTERACTION_LOG_SALT,
+    ADMIN_TOKEN,
+    PROFILER_INTERVAL
 )
+from worker_pool import ReplyWorkerPool
+from rate_limiter import UserRateLimiter
+from response_cache import ResponseCache, content_fingerprint
+from text_utils import normalize_query
+from refusal_filter import build_refusal_classifier, is_refusal
+from course_retrieval import CourseIndex
+from course_knowledge import (
+    KnowledgeWatcher,
+    PromptCompiler,
+    diff_entries,
+    load_knowledge
+)
+from streaming import StreamStats, collect_stream, is_reasoning_model
+from conversation_memory import ConversationMemory
+from single_flight import SingleFlight
+from llm_backend import create_backend, model_available
+from model_router import FAST, LARGE, ModelRouter
+from faq_table import FAQTable, load_catalogue
+from shared_state import (
+    SharedConversationMemory,
+    SharedEventDeduplicator,
+    SharedRateLimiter,
+    SharedResponseCache,
+    SharedStore
+)
+from webhook_events import EventDeduplicator, filter_events, group_by_user
+from reminder_scheduler import TAIWAN_TZ, KnownUsers, MulticastSender, ReminderScheduler
+from interaction_log import InteractionLog, hash_user
+from metrics import REGISTRY, SamplingProfiler, collect_stages, count, observe_stage, timer
 
 # Flask Web應用
 app = Flask(__name__)
 
+# 忙碌時立即回覆的固定訊息
+BUSY_MESSAGE = "目前詢問人數眾多，請稍後再試"
+RATE_LIMITED_MESSAGE = "你傳送訊息的速度太快了，請稍等一下再發問"
+
 def get_taiwan_time():
     """取得台灣時間 (GMT+8)"""
-    # 創建台灣時區 (UTC+8)
-    tw_timezone = timezone(timedelta(hours=8))
-    # 獲取目前UTC時間並轉換為台灣時間
-    tw_time = datetime.now(tw_timezone)
+    # 獲取目前UTC時間並轉換為台灣時間 (UTC+8)
+    tw_time = datetime.now(TAIWAN_TZ)
     # 格式化時間字串
     print(f"tw_time:{tw_time}")
     print(f"現在時間:{datetime.now()}")
     return tw_time.strftime("%Y-%m-%d %H:%M:%S")
 
-system_prompt = """
-你是「機器視覺課程」的助教機器人，僅提供課程公告、課堂大綱、與作業規範說明。你禁止提供任何形式的程式碼或邏輯內容，或課程無關的回答。
-
-你**嚴格禁止**：
-- 撰寫任何程式碼（如 Python、C++、MATLAB 等）
-- 提供任何函式（function）、演算法邏輯、步驟或原理
-- 解釋程式、分析邏輯、提供替代實作方式
-- 回答「如何實作」、「怎麼做」、「不能用某函式怎麼辦」之類的問題
-- 即使使用者換句話說、間接提問、或只要「邏輯」也不能回答
-
-對這些問題，你唯一的回答為下列其中之一：
-- 「我無法回答」
-- 「我無法提供」
-- 「這不是我處理的範疇，請寄信給助教詢問」
-- 「我無法提供作業解答」
-
-你**可以回答的內容**包括：
-- 本週上課主題與摘要
-- 課程公告、期限、上傳方式
-- 作業內容描述（公告中的原文或摘要）
-- 作業規範（可用套件、限制、格式等）
-
-請遵守以下原則：
-- 所有回答都使用繁體中文
-- 所有回答請簡短（50字以內）
-- 即使被要求多次，也不能提供任何技術性說明或程式碼
-
-你的角色是助教，目的是防止學生抄作業或讓模型幫他們完成程式。
-"""
-
-assistant_prompts = """
-📌 目前公告內容如下：
-
-作業一：
-- 主題：灰階轉換與直方圖均衡化
-- 說明：將彩色圖片轉為灰階後，實作直方圖均衡化以提升對比度
-- 限制：不可使用 cv2.equalizeHist()，需自行實作演算法
-- 繳交方式：命名格式 HW1_學號_姓名.zip，並上傳至 iStudy
-- 繳交期限：2025/03/08（五）23:59
-- 提醒：需附上原始圖片、處理後圖片與簡要說明（PDF）
-
-作業二：
-- 主題：影像平移、旋轉與縮放
-- 內容：根據給定的參數進行仿射變換，輸出前後對照圖
-- 限制：禁止使用cv2.warpAffine()、cv2.getRotationMatrix2D()等現有函式
-- 繳交方式：命名格式 HW2_學號_姓名.zip，並上傳至 iStudy
-- 繳交期限：2025/03/22（五）23:59
-
-作業三：
-- 主題：實作邊緣檢測功能
-- 限制：限使用 OpenCV 的基本操作（不可使用如 `cv2.Canny()` 等現有函式）
-- 上傳期限：2025/04/19 23:59
-- 上傳方式：至 iStudy 上傳程式壓縮檔與說明文件
-
-課堂主題（第十週）：
-- 邊緣偵測原理（Sobel, Prewitt）
-- 二值化與形態學操作
-
-課程公告：
-期中考：2025/04/23（週三）上課時間進行，請攜帶計算機與學生證
-小組分組提醒：請於 4/15 前完成期末專題小組分組（3～4人為限），逾期將由助教隨機分配
-缺席補件：任何因故缺席者須於兩週內完成補交程序，並主動告知助教
-學期末報告：題目不限，但需與機器視覺有實作關聯，報告日期為 6/19（三）
-"""
-
 class CourseAssistantBot:
     def __init__(self):
-        # V3 SDK 配置
-        configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-        
-        # 創建API客戶端
-        self.line_api_client = ApiClient(configuration)
-        self.line_messaging_api = MessagingApi(self.line_api_client)
-        
-        # Webhook Handler
-        self.handler = WebhookHandler(LINE_CHANNEL_SECRET)
+        # LINE API 客戶端與 Webhook Handler 在第一次使用時才建立
+        self.line_api_client = None
+        self._line_messaging_api = None
+        self._handler = None
+        self._client_lock = threading.Lock()
         
         # 使用配置中的Ollama模型
         self.ollama_model = OLLAMA_MODEL
         print(f"OLLAMA_MODEL: {OLLAMA_MODEL}")
         
-        # 課程相關知識庫
+        # 分級模型路由（簡單問題用小模型，需要時升級到大模型）
+        self.router = None
+        if MODEL_ROUTING:
+            self.router = ModelRouter(
+                FAST_MODEL,
+                LARGE_MODEL,
+                latency_budget=ROUTER_LATENCY_BUDGET,
+                max_fast_chars=ROUTER_MAX_FAST_CHARS,
+                fallback_seconds=ROUTER_FALLBACK_SECONDS
+            )
+            print(f"分級模型: {FAST_MODEL} -> {LARGE_MODEL}")
+        
+        # 模型後端（常駐連線、逾時與 keep_alive）
+        self.backend = create_backend(
+            LLM_BACKEND,
+            host=OLLAMA_HOST,
+            timeout=OLLAMA_TIMEOUT,
+            connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        
+        # 課程相關知識庫（由知識檔載入）
         self.course_info = {
             "announcements": [],
             "assignments": {},
             "course_content": {}
         }
+        # 課程內容版本，每次新增公告、作業或課程內容時遞增
+        self.content_version = 0
+        # 課程內容的雜湊，內容相同的 worker 行程會得到相同的值，用於共用快取
+        self.content_digest = None
+        
+        # 多個 worker 行程共用的狀態（未設定 SHARED_STATE_PATH 時為 None）
+        self.shared_store = SharedStore(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+        
+        # 課程內容檢索索引（隨 add_* 與知識檔重新載入逐筆更新）
+        self.course_index = CourseIndex()
+        
+        # 知識檔編譯後的提示詞
+        self.system_prompt = ""
+        self.knowledge_prompt = ""
+        self.knowledge_tokens = 0
+        self.prompt_compiler = PromptCompiler()
+        self._entries = {}
+        self._knowledge_lock = threading.Lock()
+        # 知識檔重新載入與 add_* 依序套用，避免同時修改時遺失其中一筆
+        self._update_lock = threading.Lock()
+        
+        # 回覆快取
+        if self.shared_store is not None:
+            self.response_cache = SharedResponseCache(self.shared_store, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        else:
+            self.response_cache = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        self._fingerprint_key = None
+        self._fingerprint = None
+        
+        # 每位使用者的對話記憶
+        memory_class = ConversationMemory
+        memory_args = ()
+        if self.shared_store is not None:
+            memory_class = SharedConversationMemory
+            memory_args = (self.shared_store,)
+        self.memory = memory_class(
+            *memory_args,
+            session_token_budget=MEMORY_TOKEN_BUDGET,
+            idle_seconds=MEMORY_IDLE_SECONDS,
+            max_total_tokens=MEMORY_MAX_TOTAL_TOKENS
+        )
+        
+        # 合併同時進行的相同問題
+        self.single_flight = SingleFlight(timeout=COALESCE_TIMEOUT)
+        
+        # 串流生成的首字延遲與 token 數統計
+        self.stream_stats = StreamStats()
+        
+        # 快速拒答分類器（依公告中的作業限制建立，載入知識檔時更新）
+        self.refusal_classifier = None
+        
+        # 常見問題回答表（課程內容變更時在背景重建受影響的題目）
+        self.faq = None
+        if FAQ_ENABLED:
+            self.faq = FAQTable(
+                load_catalogue(FAQ_CATALOGUE),
+                FAQ_TABLE_PATH,
+                fingerprint_fn=self.faq_fingerprint,
+                context_fn=self.build_context,
+                generate=self.generate_faq_answer,
+                threshold=FAQ_MATCH_THRESHOLD,
+                rebuild_delay=FAQ_REBUILD_DELAY,
+                store=self.shared_store
+            )
+        
+        self.apply_knowledge(load_knowledge(KNOWLEDGE_PATH))
 
+    @property
+    def line_messaging_api(self):
+        """第一次使用時才載入 LINE SDK 並建立 API 客戶端"""
+        if self._line_messaging_api is None:
+            with self._client_lock:
+                if self._line_messaging_api is None:
+                    from linebot.v3.messaging import ApiClient, Configuration, MessagingApi
+                    
+                    # V3 SDK 配置
+                    configuration = Configuration(host=LINE_API_HOST, access_token=LINE_CHANNEL_ACCESS_TOKEN)
+                    self.line_api_client = ApiClient(configuration)
+                    self._line_messaging_api = MessagingApi(self.line_api_client)
+        return self._line_messaging_api
+    
+    @property
+    def handler(self):
+        """Webhook Handler（只用到它的簽名驗證），第一次使用時才建立"""
+        if self._handler is None:
+            with self._client_lock:
+                if self._handler is None:
+                    from linebot.v3.webhook import WebhookHandler
+                    
+                    self._handler = WebhookHandler(LINE_CHANNEL_SECRET)
+        return self._handler
+    
+    def preload(self):
+        """在背景預先載入 SDK 與建立連線，讓第一位使用者不用等待"""
+        import linebot.v3.webhooks  # noqa: F401
+        from linebot.v3.messaging import models  # noqa: F401
+        
+        self.handler
+        self.line_messaging_api
+        self.backend.client
+    
     def send_startup_message(self):
         """在應用程式啟動時發送訊息"""
         try:
+            from linebot.v3.messaging.models import BroadcastRequest, TextMessage
+            
             # 使用broadcast方法發送給所有好友
             broadcast_request = BroadcastRequest(
                 messages=[TextMessage(
                     type='text',
-                    text='🤖 機器視覺課程助教機器人已啟動！\n台灣時間: ' + get_taiwan_time() + '\n目前Ollama模型: ' + self.ollama_model
+                    text='🤖 機器視覺課程助教機器人已啟動！\n台灣時間: ' + get_taiwan_time() + '\n目前Ollama模型: ' + ' / '.join(self.models())
                 )]
             )
             
@@ -140,50 +288,372 @@ class CourseAssistantBot:
             print(f"發送啟動訊息時發生錯誤: {e}")
             print("==================================================")
     
+    def send_multicast(self, user_ids, text, retry_key=None):
+        """以 multicast 傳送同一則訊息給多位使用者（最多 500 人），失敗時拋出 ApiException"""
+        from linebot.v3.messaging.models import MulticastRequest, TextMessage
+        
+        with timer("line_multicast"):
+            self.line_messaging_api.multicast(
+                MulticastRequest(to=user_ids, messages=[TextMessage(text=text)]),
+                x_line_retry_key=retry_key
+            )
+        count("chatbot_multicast_recipients_total", "multicast 送出的收件人數", amount=len(user_ids))
+    
+    def models(self):
+        """目前會使用到的模型"""
+        if self.router is None:
+            return [self.ollama_model]
+        return list(dict.fromkeys(self.router.models.values()))
+    
+    def check_models(self):
+        """確認分級模型的小模型已下載，找不到時關閉分級模型（無法取得模型清單時維持原設定）"""
+        router = self.router
+        if router is None:
+            return
+        available = self.backend.available_models()
+        if available is not None and not model_available(router.models[FAST], available):
+            print(f"找不到小模型 {router.models[FAST]}，關閉分級模型，全部使用 {self.ollama_model}")
+            self.router = None
+    
+    def warm_up(self):
+        """預先載入模型並讓 system prompt 進入前綴快取，之後定期保持模型載入"""
+        messages = [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': '你好'}
+        ]
+        for model in self.models():
+            self.backend.warm_up(model, messages)
+            self.backend.start_keep_warm(model, messages, KEEP_WARM_INTERVAL)
+    
+    def apply_knowledge(self, knowledge):
+        """套用（重新）載入的知識檔：只更新有變動的索引項目，並讓依內容版本的快取失效"""
+        with self._update_lock:
+            self._apply_knowledge(knowledge)
+    
+    def _apply_knowledge(self, knowledge):
+        entries = self.prompt_compiler.entries(knowledge)
+        prompt, tokens, dropped = self.prompt_compiler.compile(knowledge, KNOWLEDGE_TOKEN_BUDGET)
+        with self._knowledge_lock:
+            changed, removed = diff_entries(self._entries, entries)
+            for key in removed:
+                self.course_index.remove(key)
+            for key in changed:
+                self.course_index.add(key, entries[key])
+            self._entries = entries
+            self.course_info = {
+                "announcements": list(knowledge["announcements"]),
+                "assignments": dict(knowledge["assignments"]),
+                "course_content": dict(knowledge["course_content"])
+            }
+            prompt_changed = (knowledge["system_prompt"], prompt) != (self.system_prompt, self.knowledge_prompt)
+            if prompt_changed:
+                self.refusal_classifier = build_refusal_classifier(prompt, threshold=REFUSAL_THRESHOLD)
+            self.system_prompt = knowledge["system_prompt"]
+            self.knowledge_prompt = prompt
+            self.knowledge_tokens = tokens
+        print(f"知識檔已載入：{len(changed)} 項更新、{len(removed)} 項移除，公告約 {tokens} tokens")
+        if dropped:
+            print(f"超過 KNOWLEDGE_TOKEN_BUDGET 而略過: {', '.join(dropped)}")
+        if changed or removed or prompt_changed:
+            self.content_changed()
+    
+    def _update_knowledge(self, category, value, key=None):
+        """在目前的課程內容中新增一項後重新套用，與知識檔重新載入走同一條路徑（knowledge_prompt 與指紋一併更新）"""
+        with self._update_lock:
+            with self._knowledge_lock:
+                knowledge = {
+                    "system_prompt": self.system_prompt,
+                    "announcements": list(self.course_info["announcements"]),
+                    "assignments": dict(self.course_info["assignments"]),
+                    "course_content": dict(self.course_info["course_content"])
+                }
+            if key is None:
+                knowledge[category].append(value)
+            else:
+                knowledge[category][key] = value
+            self._apply_knowledge(knowledge)
+    
     def add_announcement(self, announcement):
         """新增課程公告"""
-        self.course_info["announcements"].append(announcement)
+        self._update_knowledge("announcements", announcement)
     
     def add_assignment(self, assignment_name, details):
         """新增作業詳情"""
-        self.course_info["assignments"][assignment_name] = details
+        self._update_knowledge("assignments", details, assignment_name)
     
     def add_course_content(self, topic, content):
         """新增課程內容"""
-        self.course_info["course_content"][topic] = content
+        self._update_knowledge("course_content", content, topic)
+    
+    def content_changed(self):
+        """課程內容變更：遞增版本並在背景重建受影響的常見問題答案"""
+        with self._knowledge_lock:
+            self.content_version += 1
+            self.content_digest = content_fingerprint(*sorted(self._entries.items()))
+        if self.shared_store is not None:
+            self.shared_store.set_meta("content_version", self.content_digest)
+        if self.faq is not None:
+            self.faq.schedule_rebuild()
+    
+    def build_context(self, user_query):
+        """組出要送給模型的課程公告，檢索模式下只取與問題相關的項目"""
+        if CONTEXT_MODE != "retrieval" or not len(self.course_index):
+            return self.knowledge_prompt
+        selected = self.course_index.select(
+            user_query,
+            top_k=RETRIEVAL_TOP_K,
+            token_budget=RETRIEVAL_TOKEN_BUDGET
+        )
+        return "📌 目前公告內容如下（僅列出與問題相關的部分）：\n\n" + "\n\n".join(selected)
     
-    def generate_response(self, user_query):
-        """使用Ollama生成回應"""
+    def cache_fingerprint(self):
+        """目前提示詞、課程內容版本與模型的指紋，用於讓回覆快取自動失效"""
+        key = (*self.models(), self.content_digest)
+        if key != self._fingerprint_key:
+            self._fingerprint = content_fingerprint(self.system_prompt, self.knowledge_prompt, *key)
+            self._fingerprint_key = key
+        return self._fingerprint
+    
+    def faq_fingerprint(self, question):
+        """這題生成答案時用到的提示詞、課程內容、模型與模型後端的指紋
+
+        包含後端位址：以假 Ollama 或其他主機生成的答案不會被正式環境當成有效答案。
+        """
+        return content_fingerprint(self.system_prompt, self.build_context(question), self.faq_model(), LLM_BACKEND, OLLAMA_HOST)
+    
+    def faq_model(self):
+        """常見問題的答案只生成一次，使用最好的模型"""
+        return self.router.models[LARGE] if self.router is not None else self.ollama_model
+    
+    def generate_faq_answer(self, question, context):
+        """為常見問題生成答案（背景重建時呼叫）"""
+        messages = [
+            {'role': 'system', 'content': self.system_prompt},
+            {"role": "assistant", "content": context},
+            {'role': 'user', 'content': question}
+        ]
+        return self.generate_llm(messages, model=self.faq_model())
+    
+    def remember(self, user_id, user_query, response):
+        """把這次的問答加入使用者的對話記憶"""
+        if MEMORY_ENABLED and user_id:
+            self.memory.append(user_id, user_query, response)
+    
+    def generate_response(self, user_query, user_id=None, trace=None):
+        """使用Ollama生成回應，有 user_id 時會帶入該使用者先前的對話
+
+        trace 為 dict 時記錄這次走的路徑（refusal、faq、cache、llm、coalesced 或 error）與使用的模型，寫入問答紀錄用。
+        """
+        trace = {} if trace is None else trace
+        if REFUSAL_FAST_PATH:
+            with timer("refusal_check"):
+                decision = self.refusal_classifier.classify(user_query)
+            if decision.refuse:
+                trace.update(route="refusal", refusal_rule=decision.rule)
+                self.remember(user_id, user_query, decision.reply)
+                return decision.reply
+        
+        if self.faq is not None:
+            with timer("faq_lookup"):
+                answer = self.faq.lookup(user_query)
+            if answer is not None:
+                trace["route"] = "faq"
+                self.remember(user_id, user_query, answer)
+                return answer
+        
+        history = self.memory.history(user_id) if MEMORY_ENABLED and user_id else []
+        # 有對話紀錄時回答會受先前對話影響，不使用快取
+        cache_key = "" if history else normalize_query(user_query)
+        # 查詢前取得指紋，生成期間內容改變時回覆仍存在舊內容的指紋下
+        fingerprint = self.cache_fingerprint() if cache_key else None
+        if cache_key:
+            with timer("cache_lookup"):
+                cached = self.response_cache.get(fingerprint, cache_key)
+            if cached is not None:
+                trace["route"] = "cache"
+                self.remember(user_id, user_query, cached)
+                return cached
+        
         try:
-            response = ollama.chat(
-                model=self.ollama_model,  # 使用配置的模型
-                messages=[
-                    {'role': 'system', 'content': system_prompt},
-                    {"role": "assistant","content":assistant_prompts},
-                    {'role': 'user', 'content': user_query}
-                ]
-            )
-            
-            response = re.sub(r'.*?</think>\n*', '', response['message']['content'], flags=re.DOTALL)
+            start_time = time.time()
+            messages = [
+                {'role': 'system', 'content': self.system_prompt},
+                {"role": "assistant","content":self.build_context(user_query)},
+                *history,
+                {'role': 'user', 'content': user_query}
+            ]
+            if cache_key:
+                # 相同問題同時進行時共用同一次生成，沒有自己生成時路徑維持 coalesced
+                trace["route"] = "coalesced"
+                response = self.single_flight.do(
+                    (fingerprint, cache_key),
+                    lambda: self.generate_routed(messages, user_query, history, trace)
+                )
+                self.response_cache.put(fingerprint, cache_key, response, cost=time.time() - start_time)
+            else:
+                response = self.generate_routed(messages, user_query, history, trace)
+            self.remember(user_id, user_query, response)
             return response
         
         except Exception as e:
+            trace["route"] = "error"
             return f"生成回應時發生錯誤: {str(e)}"
+    
+    def generate_routed(self, messages, user_query, history, trace=None):
+        """啟用分級模型時由 router 選擇模型，否則使用 OLLAMA_MODEL"""
+        if trace is not None:
+            trace["route"] = "llm"
+        router = self.router
+        if router is None:
+            if trace is not None:
+                trace["model"] = self.ollama_model
+            return self.generate_llm(messages)
+        return router.route(self.generate_llm, messages, user_query, history, trace)
+    
+    def generate_llm(self, messages, model=None, deadline=None):
+        """呼叫模型生成回應並去除思考內容，串流模式下超過 deadline 會提早結束"""
+        if STREAMING:
+            return self.generate_streaming(messages, model, deadline)
+        with timer("llm_total"):
+            response = self.backend.chat(
+                model=model or self.ollama_model,  # 使用配置的模型
+                messages=messages
+            )
+        self.observe_llm_stages(response.get('prompt_eval_duration'), response.get('eval_duration'))
+        with timer("think_strip"):
+            return re.sub(r'.*?</think>\n*', '', response['message']['content'], flags=re.DOTALL)
+    
+    def observe_llm_stages(self, prompt_eval_ns, eval_ns):
+        """記錄 Ollama 回傳的 prompt eval 與 eval 耗時（奈秒）"""
+        if prompt_eval_ns is not None:
+            observe_stage("llm_prompt_eval", prompt_eval_ns / 1e9)
+        if eval_ns is not None:
+            observe_stage("llm_eval", eval_ns / 1e9)
+    
+    def generate_streaming(self, messages, model=None, deadline=None):
+        """以串流方式生成回應，過濾思考內容並在回答過長時提早結束"""
+        model = model or self.ollama_model
+        chunks = self.backend.chat(
+            model=model,
+            messages=messages,
+            stream=True,
+            options={'num_predict': STREAM_NUM_PREDICT}
+        )
+        response, stats = collect_stream(
+            chunks,
+            max_chars=STREAM_MAX_CHARS,
+            deadline=deadline,
+            hold_untagged=is_reasoning_model(model, REASONING_MODELS)
+        )
+        self.stream_stats.record(stats)
+        observe_stage("llm_total", stats['total_seconds'])
+        observe_stage("think_strip", stats['think_strip_seconds'])
+        if stats['first_token_seconds'] is not None:
+            observe_stage("llm_first_token", stats['first_token_seconds'])
+        if stats['prompt_eval_seconds'] is not None:
+            observe_stage("llm_prompt_eval", stats['prompt_eval_seconds'])
+        if stats['eval_seconds'] is not None:
+            observe_stage("llm_eval", stats['eval_seconds'])
+        return response
 
 # 初始化Bot
 course_bot = CourseAssistantBot()
 
+# 取樣 profiler（透過 /profiler/start、/profiler/stop 開關）
+profiler = SamplingProfiler(interval=PROFILER_INTERVAL)
+
+# LINE 重送的事件（多個 worker 時共用紀錄）
+if course_bot.shared_store is not None:
+    event_dedupe = SharedEventDeduplicator(course_bot.shared_store, ttl=WEBHOOK_DEDUP_TTL)
+else:
+    event_dedupe = EventDeduplicator(ttl=WEBHOOK_DEDUP_TTL)
+
+# 同步處理時並行處理不同使用者的事件
+event_executor = ThreadPoolExecutor(max_workers=WEBHOOK_EVENT_CONCURRENCY, thread_name_prefix="webhook-event")
+
+def parse_events(body):
+    """把已通過簽名驗證的 webhook 內容轉成事件物件
+
+    先以原始 JSON 篩掉不處理的事件與重送的事件，只有需要處理的事件才轉成 SDK 物件。
+    """
+    from linebot.v3.webhooks import Event
+    
+    raw_events, outcomes = filter_events(json.loads(body)['events'], dedupe=event_dedupe.claim)
+    for outcome in ("handled", "ignored", "duplicate"):
+        if outcomes[outcome]:
+            count("chatbot_webhook_events_total", "收到的 webhook 事件數（依處理方式分類）", amount=outcomes[outcome], outcome=outcome)
+    if outcomes["redelivered"]:
+        count("chatbot_webhook_redeliveries_total", "LINE 標記為重送的事件數", amount=outcomes["redelivered"])
+    if outcomes["duplicate"]:
+        print(f"略過 {outcomes['duplicate']} 個已處理過的事件（LINE 標記為重送: {outcomes['redelivered']}）")
+    events = []
+    for event in raw_events:
+        try:
+            events.append(Event.from_dict(event))
+        except ValueError:
+            # 無法解析的事件重送也一樣無法處理
+            if event.get("webhookEventId"):
+                event_dedupe.done(event["webhookEventId"])
+            continue
+    return events
+
+def dispatch_events(events):
+    """處理一次 webhook 中的事件：同一位使用者的事件依序處理，不同使用者的事件並行處理"""
+    groups = group_by_user(events, key=lambda event: event.source.user_id)
+    if ASYNC_PROCESSING or len(groups) <= 1:
+        # 背景執行緒池本身就會依使用者排序並行處理
+        for group in groups:
+            for event in group:
+                dispatch_claimed(event)
+        return
+
+    def run(group):
+        for event in group:
+            try:
+                dispatch_claimed(event)
+            except Exception as e:
+                print(f"處理事件時發生錯誤: {e}")
+
+    list(event_executor.map(run, groups))
+
+def dispatch_claimed(event):
+    """處理已認領的事件：成功後記為已處理，失敗時釋放認領，讓 LINE 的重送可以再處理"""
+    event_id = event.webhook_event_id
+    try:
+        dispatch_event(event)
+    except Exception:
+        if event_id:
+            event_dedupe.release(event_id)
+        raise
+    if event_id:
+        event_dedupe.done(event_id)
+
+def dispatch_event(event):
+    """處理文字訊息，加入好友時記下使用者（作業提醒的收件人），其他事件忽略"""
+    from linebot.v3.webhooks import FollowEvent, MessageEvent, TextMessageContent
+    
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        handle_message(event)
+    elif isinstance(event, FollowEvent):
+        known_users.add(event.source.user_id)
+
 @app.route("/webhook", methods=['POST'])
 def webhook():
     # print("進去webhook了")
+    count("chatbot_webhook_requests_total", "收到的 webhook 請求數")
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     # print(f"收到webhook請求: {body}")
-    try:
-        course_bot.handler.handle(body, signature)
-    except InvalidSignatureError:
+    with timer("signature"):
+        valid = course_bot.handler.parser.signature_validator.validate(body, signature)
+    if not valid:
         print("簽名驗證失敗")
+        count("chatbot_signature_failures_total", "簽名驗證失敗的 webhook 請求數")
         abort(400)
+    
+    try:
+        with timer("dispatch"):
+            dispatch_events(parse_events(body))
     except Exception as e:
         print(f"處理webhook時發生錯誤: {e}")
     
@@ -193,57 +663,248 @@ def webhook():
 def test():
     return "機器視覺課程助教機器人運行中！"
 
-@course_bot.handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
-    user_query = event.message.text
-    user_id = event.source.user_id
-    now = datetime.now().strftime("%H:%M")
-    print(f"{user_id} | {now} 傳送訊息: {user_query}")
-    response = course_bot.generate_response(user_query)
-    now = datetime.now().strftime("%H:%M")
-    print(f"機器人回覆 {now}: {response}")
-    
-    # replyToken=event.reply_token
-    # messages=TextMessage(text=response)
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+def check_admin_token():
+    """未設定 ADMIN_TOKEN 或 token 不符時拒絕"""
+    token = request.headers.get('X-Admin-Token') or request.args.get('token')
+    if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+        abort(403)
+
+@app.route("/profiler/start", methods=['POST'])
+def profiler_start():
+    check_admin_token()
+    started = profiler.start()
+    return "profiler 已開始取樣\n" if started else "profiler 已在執行中\n"
+
+@app.route("/profiler/stop", methods=['POST'])
+def profiler_stop():
+    check_admin_token()
+    return Response(profiler.stop(), mimetype="text/plain")
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return {
+        "response_cache": course_bot.response_cache.stats(),
+        "refusal_fast_path": course_bot.refusal_classifier.stats(),
+        "streaming": course_bot.stream_stats.stats(),
+        "memory": course_bot.memory.stats(),
+        "coalescing": course_bot.single_flight.stats(),
+        "llm_backend": course_bot.backend.stats(),
+        "model_router": course_bot.router.stats() if course_bot.router else None,
+        "faq": course_bot.faq.stats() if course_bot.faq else None,
+        "knowledge": dict(
+            knowledge_watcher.stats(),
+            content_version=course_bot.content_version,
+            content_digest=course_bot.content_digest,
+            # 多個 worker 時最後一次更新的內容，與本行程的 content_digest 不同代表本行程尚未重新載入
+            shared_content_digest=course_bot.shared_store.get_meta("content_version") if course_bot.shared_store else None,
+            entries=len(course_bot.course_index),
+            prompt_tokens=course_bot.knowledge_tokens
+        ),
+        "reminders": reminder_scheduler.stats(),
+        "webhook_events": event_dedupe.stats(),
+        "interaction_log": interaction_log.stats(),
+        "admission": {
+            "rate_limit": rate_limiter.stats(),
+            "queue": reply_pool.stats()
+        }
+    }
+
+def send_reply(event, text):
+    """回覆訊息，reply token 可能已過期時改用 push_message 傳給使用者"""
+    from linebot.v3.messaging.models import PushMessageRequest, ReplyMessageRequest, TextMessage
+    
+    token_age = time.time() - event.timestamp / 1000
+    if token_age < REPLY_TOKEN_TTL:
+        try:
+            with timer("line_reply"):
+                course_bot.line_messaging_api.reply_message(
+                    ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[
+                    TextMessage(text=text)
+                    ]
+                )
+                    )
+            count("chatbot_replies_total", "送出的回覆數", method="reply")
+            return
+        except Exception as e:
+            count("chatbot_reply_errors_total", "回覆失敗次數", method="reply")
+            print(f"Reply message error: {e}")
+
+    print(f"reply token 可能已過期（{token_age:.1f} 秒），改用 push_message")
     try:
-        course_bot.line_messaging_api.reply_message(
-            ReplyMessageRequest(
-            reply_token=event.reply_token,
-            messages=[
-            TextMessage(text=response)
-            ]
-        )
+        with timer("line_push"):
+            course_bot.line_messaging_api.push_message(
+                PushMessageRequest(
+                    to=event.source.user_id,
+                    messages=[TextMessage(text=text)]
+                )
             )
-        
+        count("chatbot_replies_total", "送出的回覆數", method="push")
     except Exception as e:
-        print(f"Reply message error: {e}")
-
-# 初始化範例數據
-def init_course_data():
-    # 新增公告
-    course_bot.add_announcement("第一次作業將於下週一發布，請同學們準備")
-    course_bot.add_announcement("課程期中專案主題已公布，請同學們盡快開始準備")
-    
-    # 新增作業詳情
-    course_bot.add_assignment("作業一", {
-        "名稱": "影像分類任務",
-        "截止日期": "2024-04-15",
-        "要求": "使用CNN實現CIFAR-10資料集分類",
-        "評分標準": {
-            "模型準確率": 0.4,
-            "程式碼規範": 0.3,
-            "報告文檔": 0.3
-        }
+        count("chatbot_reply_errors_total", "回覆失敗次數", method="push")
+        print(f"Push message error: {e}")
+
+# 結構化問答紀錄（背景寫入，不阻塞回覆）
+interaction_log = InteractionLog(
+    INTERACTION_LOG_DIR,
+    max_segment_bytes=INTERACTION_LOG_SEGMENT_BYTES,
+    max_segment_seconds=INTERACTION_LOG_SEGMENT_SECONDS,
+    queue_size=INTERACTION_LOG_QUEUE_SIZE,
+    salt=INTERACTION_LOG_SALT
+)
+
+def log_interaction(event, route, response, trace=None, stages=None):
+    """把一則問答加入問答紀錄，未啟用紀錄時直接 print"""
+    user_query = event.message.text
+    if not interaction_log.enabled:
+        now = datetime.now().strftime("%H:%M")
+        print(f"{event.source.user_id} | {now} 傳送訊息: {user_query}")
+        print(f"機器人回覆 {now}: {response}")
+        return
+    trace = trace or {}
+    latency = {stage: round(seconds, 4) for stage, seconds in (stages or {}).items()}
+    # 從使用者送出訊息（LINE 事件時間）到送出回覆
+    latency["e2e"] = round(time.time() - event.timestamp / 1000, 4)
+    interaction_log.log({
+        "ts": datetime.now(TAIWAN_TZ).isoformat(timespec="seconds"),
+        "user": hash_user(event.source.user_id, interaction_log.salt),
+        "query": user_query,
+        "route": route,
+        "cache_hit": route in ("faq", "cache", "coalesced"),
+        "refused": route == "refusal" or is_refusal(response),
+        "refusal_rule": trace.get("refusal_rule"),
+        "model": trace.get("model"),
+        "tier": trace.get("tier"),
+        "escalation": trace.get("escalation"),
+        "reply": response,
+        "latency": latency
     })
-    
-    # 新增課程內容
-    course_bot.add_course_content("CNN架構", "介紹卷積神經網路的基本原理和實作")
-    course_bot.add_course_content("影像前處理", "數據增強、標準化和正規化技術")
 
-if __name__ == '__main__':
-    init_course_data()
+def process_message(event):
+    """生成回覆並送出（在背景執行緒或請求執行緒中執行）"""
+    trace = {}
+    with collect_stages() as stages:
+        with timer("generate_response"):
+            response = course_bot.generate_response(event.message.text, event.source.user_id, trace)
+        send_reply(event, response)
+    log_interaction(event, trace.get("route"), response, trace, stages)
+
+def reply_busy(event):
+    """在佇列中等太久的訊息不再生成回覆，直接請使用者稍後再試"""
+    count("chatbot_admission_total", "進入處理流程的訊息數（依結果分類）", decision="expired")
+    with collect_stages() as stages:
+        send_reply(event, BUSY_MESSAGE)
+    log_interaction(event, "expired", BUSY_MESSAGE, stages=stages)
+
+# 背景回覆執行緒池
+reply_pool = ReplyWorkerPool(
+    process_message,
+    worker_count=WORKER_COUNT,
+    queue_size=WORKER_QUEUE_SIZE,
+    max_wait=MAX_QUEUE_WAIT,
+    on_expired=reply_busy
+)
+
+# 每位使用者的限流（多個 worker 時共用計數）
+if course_bot.shared_store is not None:
+    rate_limiter = SharedRateLimiter(course_bot.shared_store, rate=RATE_LIMIT_PER_MINUTE / 60, burst=RATE_LIMIT_BURST)
+else:
+    rate_limiter = UserRateLimiter(rate=RATE_LIMIT_PER_MINUTE / 60, burst=RATE_LIMIT_BURST)
+
+# 各元件的統計值也輸出到 /metrics
+REGISTRY.gauge("chatbot_reply_queue_depth", "等待背景處理的訊息數", reply_pool.pending)
+REGISTRY.gauge("chatbot_reply_queue", "背景處理佇列統計", reply_pool.stats, label="stat")
+REGISTRY.gauge("chatbot_rate_limit", "使用者限流統計", rate_limiter.stats, label="stat")
+REGISTRY.gauge("chatbot_response_cache", "回覆快取統計", course_bot.response_cache.stats, label="stat")
+REGISTRY.gauge("chatbot_refusal_fast_path", "快速拒答統計", lambda: course_bot.refusal_classifier.stats(), label="stat")
+REGISTRY.gauge("chatbot_memory", "對話記憶統計", course_bot.memory.stats, label="stat")
+REGISTRY.gauge("chatbot_coalescing", "相同問題合併統計", course_bot.single_flight.stats, label="stat")
+REGISTRY.gauge("chatbot_streaming", "串流生成統計", course_bot.stream_stats.stats, label="stat")
+REGISTRY.gauge("chatbot_llm_backend", "模型後端統計", course_bot.backend.stats, label="stat")
+REGISTRY.gauge("chatbot_interaction_log", "問答紀錄寫入統計", interaction_log.stats, label="stat")
+if course_bot.faq is not None:
+    REGISTRY.gauge("chatbot_faq", "常見問題回答表統計", course_bot.faq.stats, label="stat")
+
+def handle_message(event):
+    user_id = event.source.user_id
+    known_users.add(user_id)
+    if not rate_limiter.allow(user_id):
+        print(f"{user_id} 傳送訊息過於頻繁，已限流")
+        count("chatbot_admission_total", "進入處理流程的訊息數（依結果分類）", decision="rate_limited")
+        send_reply(event, RATE_LIMITED_MESSAGE)
+        log_interaction(event, "rate_limited", RATE_LIMITED_MESSAGE)
+        return
+
+    if not ASYNC_PROCESSING:
+        count("chatbot_admission_total", "進入處理流程的訊息數（依結果分類）", decision="accepted")
+        process_message(event)
+        return
 
+    if not reply_pool.submit(event, key=user_id):
+        print(f"處理佇列已滿（{reply_pool.pending()} 筆），無法處理 {user_id} 的訊息")
+        count("chatbot_admission_total", "進入處理流程的訊息數（依結果分類）", decision="queue_full")
+        send_reply(event, BUSY_MESSAGE)
+        log_interaction(event, "queue_full", BUSY_MESSAGE)
+        return
+    count("chatbot_admission_total", "進入處理流程的訊息數（依結果分類）", decision="accepted")
+
+# 作業截止提醒（多個 worker 時只由取得租約的行程送出）
+known_users = KnownUsers(KNOWN_USERS_PATH)
+reminder_scheduler = ReminderScheduler(
+    lambda: course_bot.course_info["assignments"],
+    known_users,
+    MulticastSender(course_bot.send_multicast, concurrency=REMINDER_CONCURRENCY, max_retries=REMINDER_MAX_RETRIES),
+    offsets_hours=REMINDER_OFFSETS_HOURS,
+    progress_path=REMINDER_PROGRESS_PATH,
+    batch_size=REMINDER_BATCH_SIZE,
+    interval=REMINDER_CHECK_INTERVAL,
+    lease=course_bot.shared_store.lease if course_bot.shared_store else None
+)
+REGISTRY.gauge("chatbot_reminders", "作業提醒統計", reminder_scheduler.stats, label="stat")
+
+# 知識檔有變動時自動重新載入
+knowledge_watcher = KnowledgeWatcher(KNOWLEDGE_PATH, course_bot.apply_knowledge, interval=KNOWLEDGE_RELOAD_INTERVAL)
+
+def run_startup_tasks():
+    """啟動後在背景執行：預先載入 SDK、發送啟動訊息、預熱模型，不延後開始接收請求"""
+    try:
+        course_bot.preload()
+    except Exception as e:
+        print(f"預先載入時發生錯誤: {e}")
+    
+    # 每個 worker 各自確認分級模型的小模型存在，否則改用單一模型
+    try:
+        course_bot.check_models()
+    except Exception as e:
+        print(f"檢查模型時發生錯誤: {e}")
+    
+    # 多個 worker 同時啟動時，只由其中一個發送啟動訊息並預熱模型
+    if course_bot.shared_store is not None and not course_bot.shared_store.acquire("startup", ttl=60):
+        return
+    
     # 在啟動時發送訊息
     course_bot.send_startup_message()
+    
+    # 預熱模型，避免第一位同學等待模型載入
+    if WARM_UP_ON_START:
+        course_bot.warm_up()
 
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+def start_background_tasks():
+    """啟動知識檔監看、問答紀錄、背景回覆執行緒與啟動工作（直接執行本檔或 gunicorn worker 載入 wsgi.py 時呼叫）"""
+    knowledge_watcher.start()
+    interaction_log.start()
+    if REMINDERS_ENABLED:
+        reminder_scheduler.start()
+    threading.Thread(target=run_startup_tasks, name="startup", daemon=True).start()
+
+    if ASYNC_PROCESSING:
+        reply_pool.start()
+
+if __name__ == '__main__':
+    start_background_tasks()
+    app.run(host="0.0.0.0", port=PORT)
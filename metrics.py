@@ -0,0 +1,251 @@
+"""延遲量測與 Prometheus 格式的 /metrics 輸出
+
+各階段以 timer("階段名稱") 量測，結果記錄在 chatbot_stage_seconds 直方圖；
+SamplingProfiler 可在執行中開啟，定期取樣所有執行緒的呼叫堆疊，找出時間花在哪裡。
+"""
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """只會增加的計數器，可依標籤分開計數"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """累積分布直方圖，可依標籤分開記錄"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各 bucket 的計數..., 總和, 次數]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """在輸出時才呼叫 fn 取值的量測值，fn 回傳數字或 {標籤值: 數字}"""
+
+    def __init__(self, name, help_text, fn, label=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                # 只輸出數值（略過 None 與文字）
+                if isinstance(item, (int, float)):
+                    lines.append(f"{self.name}{_format_labels(((self.label, key),))} {item}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    """所有量測值的集合"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, fn, label=None):
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, fn, label)
+
+    def render(self):
+        """輸出 Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("chatbot_stage_seconds", "各處理階段的耗時（秒）")
+
+
+_collector = threading.local()
+
+
+def observe_stage(stage, seconds):
+    """記錄某個階段的耗時"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = getattr(_collector, "stages", None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timer(stage):
+    """量測 with 區塊的耗時並記錄到 chatbot_stage_seconds{stage=...}"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time)
+
+
+@contextmanager
+def collect_stages():
+    """另外收集本執行緒在 with 區塊內記錄的各階段耗時，產生 {階段: 秒數}（同一階段多次時累加）
+
+    已在收集中時沿用外層的 dict，例如背景執行緒先記錄的 queue_wait 會出現在處理訊息時收集的結果中。
+    """
+    previous = getattr(_collector, "stages", None)
+    if previous is not None:
+        yield previous
+        return
+    stages = {}
+    _collector.stages = stages
+    try:
+        yield stages
+    finally:
+        _collector.stages = previous
+
+
+def count(name, help_text="", amount=1, **labels):
+    """計數器加一"""
+    REGISTRY.counter(name, help_text).inc(amount, **labels)
+
+
+class SamplingProfiler:
+    """取樣式 profiler：每隔 interval 秒記錄一次所有執行緒的呼叫堆疊
+
+    只在開啟期間有額外負擔，適合在負載高時暫時開啟以找出耗時的位置。
+    """
+
+    def __init__(self, interval=0.005, max_depth=30):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = _Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self.samples = _Counter()
+            self.sample_count = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        return self.report()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def report(self, top=30):
+        """回傳 collapsed stack 格式（可直接丟給 flamegraph.pl）的取樣結果"""
+        lines = [f"# {self.sample_count} 次取樣，間隔 {self.interval} 秒"]
+        for stack, samples in self.samples.most_common(top):
+            lines.append(f"{stack} {samples}")
+        return "\n".join(lines) + "\n"
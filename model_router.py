@@ -0,0 +1,198 @@
+"""分級模型路由：先用小而快的模型，需要時才改用大模型
+
+大部分問題只是查期限或公告，7B 模型就能回答；只有問題較長、需要比較或摘要、
+接續先前的對話，或小模型回答空白或沒把握時，才升級到大模型。
+每個請求有延遲預算，大模型在預算內沒回完時改用小模型的結果；直接交給大模型的問題
+會保留 fallback_seconds 給小模型備援，備援同樣受同一個預算限制。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from metrics import REGISTRY, count
+from refusal_filter import is_refusal
+
+FAST = "fast"
+LARGE = "large"
+
+# 需要整理、比較或推論的問法，交給大模型
+ESCALATE_KEYWORDS = ["比較", "差別", "差異", "為什麼", "為何", "摘要", "總結", "整理", "分析", "建議", "所有", "哪些"]
+# 接續先前對話的問法，需要理解對話紀錄
+REFERENCE_MARKERS = ["那個", "這個", "它", "剛剛", "剛才", "上面", "前面", "你說"]
+# 回答中出現這些字代表模型沒把握
+HEDGE_MARKERS = ["不確定", "不清楚", "不知道", "無法確定", "可能是", "i'm not sure", "i don't know", "not sure"]
+
+TIER_SECONDS = REGISTRY.histogram("chatbot_llm_tier_seconds", "各級模型的生成耗時（秒）")
+
+
+def query_features(user_query, history=()):
+    """回傳需要大模型的原因，簡單的問題回傳 None"""
+    if history and any(marker in user_query for marker in REFERENCE_MARKERS):
+        return "follow_up"
+    if sum(user_query.count(mark) for mark in "?？") >= 2:
+        return "multi_question"
+    if any(keyword in user_query for keyword in ESCALATE_KEYWORDS):
+        return "keyword"
+    return None
+
+
+def low_confidence(answer):
+    """回傳回答不可靠的原因，可以採用時回傳 None（拒答句視為有效回答）"""
+    text = (answer or "").strip()
+    if not text:
+        return "empty"
+    if is_refusal(text):
+        return None
+    if len(text) < 4:
+        return "too_short"
+    lowered = text.lower()
+    if any(marker in lowered for marker in HEDGE_MARKERS):
+        return "hedge"
+    # 應以繁體中文回答，幾乎沒有中文代表模型答非所問
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    if len(text) >= 20 and cjk / len(text) < 0.2:
+        return "not_chinese"
+    return None
+
+
+class _TierStats:
+    __slots__ = ("requests", "errors", "timeouts", "seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+
+
+class ModelRouter:
+    """依問題特徵與回答品質在快／大兩級模型之間選擇
+
+    generate(messages, model, deadline) 負責實際呼叫模型，deadline 為 time.perf_counter() 的時間點。
+    """
+
+    def __init__(self, fast_model, large_model, latency_budget=45, max_fast_chars=60, max_workers=4,
+                 fallback_seconds=10):
+        self.models = {FAST: fast_model, LARGE: large_model}
+        self.latency_budget = latency_budget
+        self.fallback_seconds = fallback_seconds
+        self.max_fast_chars = max_fast_chars
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="large-model")
+        self._lock = threading.Lock()
+        self._tiers = {FAST: _TierStats(), LARGE: _TierStats()}
+        self.escalations = {}
+        self.fallbacks = 0
+
+    def choose(self, user_query, history=()):
+        """回傳 (等級, 原因)"""
+        if self.models[FAST] == self.models[LARGE]:
+            return LARGE, "single_model"
+        if len(user_query) > self.max_fast_chars:
+            return LARGE, "long_query"
+        reason = query_features(user_query, history)
+        if reason:
+            return LARGE, reason
+        return FAST, None
+
+    def _record(self, tier, seconds, outcome):
+        with self._lock:
+            stats = self._tiers[tier]
+            stats.requests += 1
+            stats.seconds += seconds
+            if outcome == "error":
+                stats.errors += 1
+            elif outcome == "timeout":
+                stats.timeouts += 1
+        TIER_SECONDS.observe(seconds, tier=tier)
+        count("chatbot_llm_tier_requests_total", "各級模型的請求數（依結果分類）", tier=tier, outcome=outcome)
+
+    def _escalate(self, reason):
+        with self._lock:
+            self.escalations[reason] = self.escalations.get(reason, 0) + 1
+
+    def _call(self, tier, generate, messages, deadline):
+        start_time = time.perf_counter()
+        try:
+            answer = generate(messages, self.models[tier], deadline)
+        except Exception:
+            self._record(tier, time.perf_counter() - start_time, "error")
+            raise
+        self._record(tier, time.perf_counter() - start_time, "ok")
+        return answer
+
+    def _call_large(self, generate, messages, deadline):
+        """在背景執行緒呼叫大模型，超過 deadline 時拋出 TimeoutError"""
+        start_time = time.perf_counter()
+        future = self._executor.submit(generate, messages, self.models[LARGE], deadline)
+        try:
+            answer = future.result(timeout=max(0.0, deadline - start_time))
+        except FutureTimeout:
+            # 串流生成會在下一段讀到 deadline 時自行中斷
+            self._record(LARGE, time.perf_counter() - start_time, "timeout")
+            raise TimeoutError("大模型超過延遲預算")
+        except Exception:
+            self._record(LARGE, time.perf_counter() - start_time, "error")
+            raise
+        self._record(LARGE, time.perf_counter() - start_time, "ok")
+        return answer
+
+    def route(self, generate, messages, user_query, history=(), trace=None):
+        """選擇模型並生成回答，trace 為 dict 時記錄實際採用的等級、模型與升級原因"""
+        deadline = time.perf_counter() + self.latency_budget
+        tier, reason = self.choose(user_query, history)
+        fast_answer = None
+        if tier == FAST:
+            try:
+                fast_answer = self._call(FAST, generate, messages, deadline)
+                reason = low_confidence(fast_answer)
+            except Exception as e:
+                print(f"小模型生成失敗，改用大模型: {e}")
+                reason = "fast_error"
+            if reason is None:
+                return self._answered(trace, FAST, fast_answer)
+        if reason != "single_model":
+            self._escalate(reason)
+            if trace is not None:
+                trace["escalation"] = reason
+
+        # 沒有小模型的回答可以備援時，大模型提早逾時，保留時間給小模型
+        large_deadline = deadline
+        if tier == LARGE and reason != "single_model":
+            large_deadline = deadline - min(self.fallback_seconds, self.latency_budget / 2)
+        try:
+            return self._answered(trace, LARGE, self._call_large(generate, messages, large_deadline))
+        except TimeoutError:
+            if reason == "single_model":
+                raise
+            with self._lock:
+                self.fallbacks += 1
+            if fast_answer:
+                print("大模型逾時，採用小模型的回答")
+                return self._answered(trace, FAST, fast_answer)
+            if tier == FAST:
+                raise
+            print("大模型逾時，改用小模型")
+            return self._answered(trace, FAST, self._call(FAST, generate, messages, deadline))
+
+    def _answered(self, trace, tier, answer):
+        if trace is not None:
+            trace["tier"] = tier
+            trace["model"] = self.models[tier]
+        return answer
+
+    def stats(self):
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._tiers.items():
+                tiers[tier] = {
+                    "model": self.models[tier],
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "timeouts": stats.timeouts,
+                    "avg_seconds": stats.seconds / stats.requests if stats.requests else 0.0,
+                }
+            return {
+                "tiers": tiers,
+                "escalations": dict(self.escalations),
+                "fallbacks": self.fallbacks,
+            }
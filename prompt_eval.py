@@ -0,0 +1,226 @@
+"""多模型、多 prompt 版本的並行評估工具
+
+對 測試問題 × 模型 × prompt 版本 的所有組合並行呼叫 Ollama，記錄延遲、tokens/sec、
+prompt eval 與 eval 時間以及是否正確拒答，輸出 JSON 報告並可與上一次的報告比較。
+
+用法：
+    python prompt_eval.py --models llama2:13b-chat,qwen:7b-chat --output report.json
+    python prompt_eval.py --models llama2:13b-chat --baseline report.json --output new.json
+    python prompt_eval.py --mock                          # 使用本機假 Ollama，離線執行
+    python prompt_eval.py --variant strict=prompts/strict.txt  # 以檔案內容取代 system prompt
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ollama
+
+from refusal_filter import is_refusal
+
+
+def percentile(values, q):
+    """計算百分位數（q 介於 0~100）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_case(client, model, variant, system_prompt, assistant_prompts, prompt, expect_refusal):
+    """執行單一測試並回傳結果"""
+    result = {
+        "model": model,
+        "variant": variant,
+        "prompt": prompt,
+        "expect_refusal": expect_refusal,
+    }
+    start_time = time.perf_counter()
+    try:
+        response = client.chat(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "assistant", "content": assistant_prompts},
+                {"role": "user", "content": prompt}
+            ]
+        )
+    except Exception as e:
+        result.update(error=str(e), latency_seconds=time.perf_counter() - start_time, correct=False)
+        return result
+
+    content = response["message"]["content"].strip()
+    eval_seconds = response.get("eval_duration", 0) / 1e9
+    refused = is_refusal(content)
+    result.update(
+        response=content,
+        refused=refused,
+        correct=refused == expect_refusal,
+        latency_seconds=time.perf_counter() - start_time,
+        prompt_eval_count=response.get("prompt_eval_count", 0),
+        prompt_eval_seconds=response.get("prompt_eval_duration", 0) / 1e9,
+        eval_count=response.get("eval_count", 0),
+        eval_seconds=eval_seconds,
+        tokens_per_second=response.get("eval_count", 0) / eval_seconds if eval_seconds else 0.0,
+    )
+    return result
+
+
+def evaluate(test_cases, models, variants, host=None, concurrency=4, timeout=300):
+    """並行執行所有組合
+
+    test_cases: [(prompt, 是否應拒答)]；variants: {名稱: (system_prompt, assistant_prompts)}
+    """
+    client = ollama.Client(
+        host=host,
+        timeout=httpx.Timeout(timeout, connect=5),
+        limits=httpx.Limits(max_connections=concurrency)
+    )
+    jobs = [
+        (model, variant, system_prompt, assistant_prompts, prompt, expect_refusal)
+        for model in models
+        for variant, (system_prompt, assistant_prompts) in variants.items()
+        for prompt, expect_refusal in test_cases
+    ]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_case, client, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def summarize(results):
+    """依 模型 / prompt 版本 彙整結果"""
+    groups = {}
+    for result in results:
+        groups.setdefault(f"{result['model']}|{result['variant']}", []).append(result)
+
+    summary = {}
+    for key, rows in groups.items():
+        ok = [r for r in rows if "error" not in r]
+        latencies = [r["latency_seconds"] for r in ok]
+        summary[key] = {
+            "cases": len(rows),
+            "errors": len(rows) - len(ok),
+            "accuracy": sum(r["correct"] for r in rows) / len(rows),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "avg_tokens_per_second": statistics.mean(r["tokens_per_second"] for r in ok) if ok else 0.0,
+            "avg_prompt_eval_seconds": statistics.mean(r["prompt_eval_seconds"] for r in ok) if ok else 0.0,
+            "avg_eval_seconds": statistics.mean(r["eval_seconds"] for r in ok) if ok else 0.0,
+        }
+    return summary
+
+
+def diff_reports(previous, current):
+    """比較兩份報告，回傳 (正確性變差的項目, 改善的項目, 各組延遲變化)"""
+    def key(result):
+        return (result["model"], result["variant"], result["prompt"])
+
+    before = {key(r): r for r in previous["results"]}
+    regressions = []
+    fixes = []
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is None or old["correct"] == result["correct"]:
+            continue
+        (fixes if result["correct"] else regressions).append(key(result))
+
+    latency = {}
+    for group, stats in current["summary"].items():
+        old = previous["summary"].get(group)
+        if old is not None:
+            latency[group] = {
+                "latency_p50_delta": stats["latency_p50"] - old["latency_p50"],
+                "accuracy_delta": stats["accuracy"] - old["accuracy"],
+            }
+    return regressions, fixes, latency
+
+
+def print_summary(summary):
+    print(f"{'模型|版本':<36}{'正確率':>8}{'p50(s)':>9}{'p95(s)':>9}{'tok/s':>8}{'prompt(s)':>11}{'eval(s)':>9}{'錯誤':>6}")
+    for group, s in summary.items():
+        print(
+            f"{group:<36}{s['accuracy']:>8.0%}{s['latency_p50']:>9.2f}{s['latency_p95']:>9.2f}"
+            f"{s['avg_tokens_per_second']:>8.1f}{s['avg_prompt_eval_seconds']:>11.2f}{s['avg_eval_seconds']:>9.2f}{s['errors']:>6}"
+        )
+
+
+def main():
+    from promptTesting import assistant_prompts, system_prompt, test_cases
+
+    parser = argparse.ArgumentParser(description="多模型 prompt 並行評估")
+    parser.add_argument("--models", default="llama2:13b-chat", help="以逗號分隔的模型名稱")
+    parser.add_argument("--variant", action="append", default=[],
+                        help="額外的 prompt 版本，格式為 名稱=system_prompt 檔案路徑，可重複指定")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--host", default=None, help="Ollama 位址（預設使用 OLLAMA_HOST）")
+    parser.add_argument("--mock", action="store_true", help="啟動本機假 Ollama 服務離線執行")
+    parser.add_argument("--output", default="prompt_eval_report.json")
+    parser.add_argument("--baseline", default=None, help="上一次的報告，用來比較差異")
+    args = parser.parse_args()
+
+    variants = {"baseline": (system_prompt, assistant_prompts)}
+    for spec in args.variant:
+        name, _, path = spec.partition("=")
+        with open(path, encoding="utf-8") as f:
+            variants[name] = (f.read(), assistant_prompts)
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+
+    mock = None
+    host = args.host
+    if args.mock:
+        from fake_services import FakeOllamaServer
+
+        mock = FakeOllamaServer().start()
+        host = mock.url
+
+    start_time = time.perf_counter()
+    try:
+        results = evaluate(test_cases, models, variants, host=host, concurrency=args.concurrency)
+    finally:
+        if mock is not None:
+            mock.stop()
+    elapsed = time.perf_counter() - start_time
+
+    for r in results:
+        mark = "✅" if r["correct"] else "❌"
+        detail = r.get("error") or r["response"].replace("\n", " ")[:40]
+        print(f"{mark} [{r['model']}|{r['variant']}] {r['latency_seconds']:.2f}s {r['prompt']} -> {detail}")
+
+    summary = summarize(results)
+    print("=====================================================================================")
+    print_summary(summary)
+    print(f"共 {len(results)} 個測試，耗時 {elapsed:.2f} 秒（並行數 {args.concurrency}）")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "models": models,
+        "variants": list(variants),
+        "elapsed_seconds": elapsed,
+        "summary": summary,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"報告已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions, fixes, latency = diff_reports(previous, report)
+        print(f"與 {args.baseline} 比較：變差 {len(regressions)} 項，改善 {len(fixes)} 項")
+        for model, variant, prompt in regressions:
+            print(f"  ❌ [{model}|{variant}] {prompt}")
+        for model, variant, prompt in fixes:
+            print(f"  ✅ [{model}|{variant}] {prompt}")
+        for group, delta in latency.items():
+            print(f"  {group}: p50 {delta['latency_p50_delta']:+.2f}s，正確率 {delta['accuracy_delta']:+.0%}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
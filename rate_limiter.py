@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class _Bucket:
+    """單一使用者的 token bucket"""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated_at = now
+
+
+class UserRateLimiter:
+    """每位使用者各自的 token bucket 限流
+
+    每則訊息消耗一個 token，token 以每秒 rate 個的速度補充，最多累積 burst 個；
+    閒置到 token 補滿的使用者會被清除，不會無限制佔用記憶體。
+    """
+
+    def __init__(self, rate, burst, cleanup_interval=300):
+        self.rate = rate
+        self.burst = burst
+        self.cleanup_interval = cleanup_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = time.monotonic()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, user_id, now=None):
+        """若使用者還有 token 則扣一個並回傳 True，否則回傳 False"""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+                bucket.updated_at = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                self.allowed += 1
+                allowed = True
+            else:
+                self.rejected += 1
+                allowed = False
+            if now - self._last_cleanup >= self.cleanup_interval:
+                self._cleanup(now)
+        return allowed
+
+    def _cleanup(self, now):
+        # token 已補滿的使用者與新使用者沒有差別，可以直接移除
+        refill_seconds = self.burst / self.rate
+        for user_id in [u for u, b in self._buckets.items() if now - b.updated_at >= refill_seconds]:
+            del self._buckets[user_id]
+        self._last_cleanup = now
+
+    def stats(self):
+        with self._lock:
+            total = self.allowed + self.rejected
+            return {
+                "users": len(self._buckets),
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "reject_rate": self.rejected / total if total else 0.0
+            }
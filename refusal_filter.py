@@ -0,0 +1,233 @@
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+from text_utils import normalize_query
+
+# system_prompt 中規定的固定拒答句
+REFUSAL_REPLIES = [
+    "我無法回答",
+    "我無法提供",
+    "這不是我處理的範疇，請寄信給助教詢問",
+    "我無法提供作業解答",
+]
+
+# 關鍵字分類（比對前會經過 normalize_query，所以只需寫小寫、無空白的形式）
+KEYWORDS = {
+    # 要求寫出內容的動詞
+    "request": ["幫我寫", "幫我做", "幫我實作", "寫一個", "寫個", "請寫", "做一個", "實作一個"],
+    # 一般的索取用語（「給我作業三的程式上傳方式」），需搭配程式碼本身才算要程式
+    "want": ["給我", "需要一個"],
+    # 程式相關名詞
+    "code": ["程式", "程式碼", "code", "function", "函式", "函數", "python", "c++", "matlab"],
+    # 指程式碼本身的名詞（「程式」也用來指要繳交的檔案，不列入）
+    "code_artifact": ["程式碼", "code", "function", "函式", "函數"],
+    # 單獨出現就代表要程式的詞
+    "code_strong": ["pseudocode", "虛擬碼", "偽代碼", "原始碼"],
+    # 單獨出現就代表要實作方式的問法
+    "implement": ["怎麼實作", "如何實作", "怎麼實現", "如何實現"],
+    # 「怎麼寫」也用來問檔名、報告格式，需搭配程式或函式才算問實作方式
+    "write_howto": ["怎麼寫", "如何寫"],
+    # 「怎麼寫」的對象是繳交格式而不是程式
+    "write_other": ["檔名", "報告", "格式", "學號"],
+    # 一般的「怎麼做」問法，需搭配其他訊號
+    "howto": ["怎麼做", "怎麼處理", "要怎麼", "該怎麼", "如何做", "如何處理", "怎麼辦"],
+    # 要求解釋原理或邏輯（「步驟」「流程」常出現在繳交方式的問題，所以不列入）
+    "explain": ["原理", "邏輯", "演算法", "解釋"],
+    # 想繞過作業限制
+    "workaround": ["不能用", "不可以用", "不可用", "不准用", "禁止用", "不給用"],
+    # 提到 OpenCV 函式
+    "func_ref": ["cv2", "opencv"],
+}
+
+RefusalDecision = namedtuple("RefusalDecision", ["refuse", "rule", "score", "reply", "matches"])
+
+
+def is_refusal(text):
+    """判斷回覆是否為拒答（與 promptTesting.py 相同的判斷方式）"""
+    return "我無法" in text or "這不是我處理的範疇" in text
+
+
+def extract_forbidden_functions(prompt_text):
+    """從課程公告中找出作業限制不可使用的函式名稱，例如 cv2.Canny()"""
+    functions = set()
+    for line in prompt_text.splitlines():
+        # 同一行可能同時有「不可使用」與「可以使用」，以句號、逗號切開後只看禁止的子句
+        for clause in re.split(r"[。，,]", line):
+            if not re.search(r"不可|禁止", clause):
+                continue
+            for name in re.findall(r"cv2\.(\w+)\s*\(", clause):
+                functions.add(name)
+    return sorted(functions)
+
+
+class AhoCorasick:
+    """多關鍵字比對自動機，一次掃描即可找出所有命中的關鍵字"""
+
+    def __init__(self, patterns):
+        # 每個節點: 子節點 dict、失敗連結、輸出
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, value in patterns:
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append((pattern, value))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._fail[nxt] == nxt:
+                    self._fail[nxt] = 0
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def search(self, text):
+        """回傳所有命中的 (關鍵字, 值)"""
+        node = 0
+        found = []
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._output[node]:
+                found.extend(self._output[node])
+        return found
+
+
+class RefusalClassifier:
+    """在呼叫 LLM 前判斷是否為必須拒答的問題（要程式碼、要實作方式、要繞過作業限制）"""
+
+    def __init__(self, forbidden_functions=(), threshold=0.8):
+        self.threshold = threshold
+        patterns = []
+        for category, words in KEYWORDS.items():
+            for word in words:
+                patterns.append((normalize_query(word), category))
+        for name in forbidden_functions:
+            patterns.append((normalize_query(name), "forbidden"))
+        self.automaton = AhoCorasick(patterns)
+        self.rule_counts = {}
+        self.checked = 0
+        self.refused = 0
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _score(self, hits):
+        """依命中的關鍵字類別計算各規則的信心分數，回傳最高分的規則"""
+        has = lambda category: category in hits
+        function_ref = has("forbidden") or has("func_ref")
+        rules = []
+        if has("request") and (has("code") or has("code_strong")):
+            rules.append(("write_code", 1.0, "我無法提供"))
+        if has("want") and (has("code_artifact") or has("code_strong")):
+            rules.append(("want_code", 0.9, "我無法提供"))
+        if has("code_strong"):
+            rules.append(("pseudocode", 0.9, "我無法提供"))
+        write_howto = has("write_howto") and not has("write_other")
+        if has("implement") or (write_howto and (has("code") or has("code_strong") or function_ref)):
+            rules.append(("how_to_implement", 0.9, "我無法回答"))
+        if has("workaround") and (has("howto") or has("implement") or has("write_howto")):
+            rules.append(("workaround", 0.95, "我無法提供作業解答"))
+        elif has("workaround") and has("forbidden"):
+            rules.append(("workaround", 0.7, "我無法提供作業解答"))
+        if has("howto") and has("forbidden"):
+            rules.append(("forbidden_howto", 0.9, "我無法提供作業解答"))
+        if has("explain"):
+            if len(hits["explain"]) >= 2 or function_ref:
+                rules.append(("explain_logic", 0.9, "我無法回答"))
+            else:
+                rules.append(("explain_logic", 0.6, "我無法回答"))
+        if not rules:
+            return None
+        return max(rules, key=lambda rule: rule[1])
+
+    def classify(self, user_query):
+        """判斷問題是否應直接拒答，回傳 RefusalDecision"""
+        start_time = time.perf_counter()
+        hits = {}
+        for word, category in self.automaton.search(normalize_query(user_query)):
+            hits.setdefault(category, set()).add(word)
+        best = self._score(hits)
+        matches = sorted(word for words in hits.values() for word in words)
+        if best is None:
+            decision = RefusalDecision(False, None, 0.0, None, matches)
+        else:
+            rule, score, reply = best
+            decision = RefusalDecision(score >= self.threshold, rule, score, reply, matches)
+
+        with self._lock:
+            self.checked += 1
+            self.total_seconds += time.perf_counter() - start_time
+            if decision.refuse:
+                self.refused += 1
+                self.rule_counts[decision.rule] = self.rule_counts.get(decision.rule, 0) + 1
+        return decision
+
+    def stats(self):
+        """回傳拒答統計"""
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "refused": self.refused,
+                "rules": dict(self.rule_counts),
+                "avg_microseconds": round(self.total_seconds / self.checked * 1e6, 2) if self.checked else 0.0,
+            }
+
+
+def build_refusal_classifier(prompt_text, threshold=0.8):
+    """依課程公告中的作業限制建立分類器"""
+    return RefusalClassifier(extract_forbidden_functions(prompt_text), threshold=threshold)
+
+
+def run_regression(classifier, test_cases):
+    """以 promptTesting.py 的測試問題檢查分類器
+
+    預期可回答的問題被擋下（誤擋）視為失敗；應拒答但沒擋下的問題會交給 LLM 處理，只列出不算失敗。
+    """
+    false_positives = []
+    missed = []
+    for prompt, expect_refusal in test_cases:
+        decision = classifier.classify(prompt)
+        mark = "🚫" if decision.refuse else "➡️"
+        print(f"{mark} [{decision.rule or '-'} {decision.score:.2f}] {prompt}")
+        if decision.refuse and not expect_refusal:
+            false_positives.append(prompt)
+        if expect_refusal and not decision.refuse:
+            missed.append(prompt)
+
+    print("=====================================================================================")
+    print(f"快速拒答 {classifier.refused}/{len(test_cases)}，交給 LLM 判斷: {len(missed)}，誤擋: {len(false_positives)}")
+    for prompt in missed:
+        print(f"  交給 LLM: {prompt}")
+    for prompt in false_positives:
+        print(f"  ❌ 誤擋: {prompt}")
+    return not false_positives
+
+
+if __name__ == '__main__':
+    import sys
+    from promptTesting import assistant_prompts, test_cases
+
+    classifier = build_refusal_classifier(assistant_prompts)
+    print(f"禁止使用的函式: {extract_forbidden_functions(assistant_prompts)}")
+    sys.exit(0 if run_regression(classifier, test_cases) else 1)
@@ -0,0 +1,344 @@
+"""作業截止提醒
+
+從課程內容的作業（course_info["assignments"]）取出繳交期限，在截止前 REMINDER_OFFSETS_HOURS 小時（台灣時間）
+以 multicast 一次傳給最多 500 位曾經與機器人互動的使用者。
+各批次並行送出（有上限），遇到 429 時所有批次一起退避後重試；同一批次重試時帶相同的 X-Line-Retry-Key，
+LINE 已收到的批次不會重複送達。每個提醒的收件人、批次與完成狀態寫在進度檔中，中斷後重新啟動會從未完成的批次繼續。
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# 台灣時間 (UTC+8)
+TAIWAN_TZ = timezone(timedelta(hours=8))
+# LINE multicast 每次最多 500 位收件人
+MULTICAST_LIMIT = 500
+
+_DUE_DATE = re.compile(r"(\d{4})\s*/\s*(\d{1,2})\s*/\s*(\d{1,2})(?:\s*[（(][^）)]*[）)])?\s*(?:(\d{1,2}):(\d{2}))?")
+
+
+def parse_due_date(text):
+    """把「2025/03/08（五）23:59」轉成台灣時間的 datetime，沒有時間時視為當天 23:59，無法解析時回傳 None"""
+    match = _DUE_DATE.search(str(text))
+    if match is None:
+        return None
+    year, month, day, hour, minute = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day),
+                        int(hour) if hour else 23, int(minute) if minute else 59, tzinfo=TAIWAN_TZ)
+    except ValueError:
+        return None
+
+
+def assignment_deadlines(assignments):
+    """回傳 [(作業名稱, 截止時間, 作業詳情)]，欄位名稱含「期限」或「截止」的值視為截止時間"""
+    deadlines = []
+    for name, details in assignments.items():
+        if not isinstance(details, dict):
+            continue
+        for key, value in details.items():
+            if "期限" in key or "截止" in key:
+                due = parse_due_date(value)
+                if due is not None:
+                    deadlines.append((name, due, details))
+                    break
+    return deadlines
+
+
+def reminder_text(name, due, hours, details):
+    """提醒訊息內容"""
+    topic = details.get("主題")
+    title = f"{name}（{topic}）" if topic else name
+    text = f"⏰ 作業提醒：{title}將於 {due:%Y/%m/%d %H:%M} 截止，剩不到 {hours:g} 小時"
+    how = details.get("繳交方式") or details.get("上傳方式")
+    if how:
+        text += f"\n繳交方式：{how}"
+    return text
+
+
+class KnownUsers:
+    """曾經傳訊息或加入好友的使用者，每行一個 user_id 追加寫入檔案（多個 worker 行程可共用同一檔案）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._users = set()
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            users = {line.strip() for line in f if line.strip()}
+        with self._lock:
+            self._users |= users
+
+    def add(self, user_id):
+        if not user_id:
+            return
+        with self._lock:
+            if user_id in self._users:
+                return
+            self._users.add(user_id)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(user_id + "\n")
+
+    def all(self):
+        """所有已知使用者（包含其他 worker 行程新增的）"""
+        self.reload()
+        with self._lock:
+            return sorted(self._users)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._users)
+
+
+class MulticastSender:
+    """以 multicast 分批送出，限制同時進行的批次數，429 與暫時性錯誤以指數退避重試
+
+    send(user_ids, text, retry_key) 實際呼叫 LINE API，失敗時拋出帶有 status（HTTP 狀態碼）的例外。
+    """
+
+    def __init__(self, send, concurrency=4, max_retries=5, backoff=1.0, max_backoff=60):
+        self.send = send
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # 429 是以整個 channel 計算，任一批次被限流時所有批次都暫停
+        self._paused_until = 0.0
+        self.batches = 0
+        self.recipients = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _pause(self, delay):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def send_batch(self, user_ids, text, retry_key):
+        """送出一個批次，成功（或 LINE 已收過相同 retry key）時回傳 True，
+        重試次數用完回傳 False（之後可再試），請求本身有誤（例如 400）回傳 None（重送也不會成功）"""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_pause()
+            try:
+                self.send(user_ids, text, retry_key)
+            except Exception as e:
+                status = getattr(e, "status", None)
+                if status == 409:
+                    # 相同 retry key 的請求先前已被接受
+                    with self._lock:
+                        self.duplicates += 1
+                        self.batches += 1
+                        self.recipients += len(user_ids)
+                    return True
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == self.max_retries:
+                    print(f"multicast 失敗（{len(user_ids)} 人，狀態 {status}）: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    return False if retryable else None
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+                if retry_after and str(retry_after).isdigit():
+                    delay = max(delay, int(retry_after))
+                with self._lock:
+                    self.retries += 1
+                    if status == 429:
+                        self.rate_limited += 1
+                if status == 429:
+                    self._pause(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            with self._lock:
+                self.batches += 1
+                self.recipients += len(user_ids)
+            return True
+        return False
+
+    def send_all(self, batches, text, on_done=None):
+        """並行送出 [(批次編號, user_ids, retry_key)]，每個批次結束時呼叫 on_done(批次編號, send_batch 的結果)，回傳成功的批次數"""
+        def run(batch):
+            index, user_ids, retry_key = batch
+            result = self.send_batch(user_ids, text, retry_key)
+            if on_done is not None:
+                on_done(index, result)
+            return result is True
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="multicast") as executor:
+            return sum(executor.map(run, batches))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "recipients": self.recipients,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "duplicates": self.duplicates,
+                "failed": self.failed,
+            }
+
+
+class ReminderScheduler:
+    """定期檢查作業截止時間，到了提醒時間就送出提醒
+
+    assignments_fn() 回傳目前的作業詳情，users 為 KnownUsers，sender 為 MulticastSender。
+    進度檔記錄每個提醒的收件人快照、每批的 retry key 與已完成的批次。
+    """
+
+    def __init__(self, assignments_fn, users, sender, offsets_hours=(72, 24), progress_path="",
+                 batch_size=MULTICAST_LIMIT, interval=60, lease=None):
+        self.assignments_fn = assignments_fn
+        self.users = users
+        self.sender = sender
+        self.offsets_hours = sorted(offsets_hours, reverse=True)
+        self.progress_path = progress_path
+        self.batch_size = min(batch_size, MULTICAST_LIMIT)
+        self.interval = interval
+        # 多個 worker 行程時，只有取得租約的行程送出提醒（lease(name, ttl) 為 context manager）
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._progress = self._load_progress()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent_reminders = 0
+
+    def _load_progress(self):
+        if not self.progress_path or not os.path.exists(self.progress_path):
+            return {}
+        try:
+            with open(self.progress_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"讀取提醒進度失敗: {e}")
+            return {}
+
+    def _save_progress(self):
+        if not self.progress_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self._progress, ensure_ascii=False)
+            tmp_path = self.progress_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.progress_path)
+
+    def due_reminders(self, now=None):
+        """回傳目前該送出的 [(提醒 id, 訊息)]；同一份作業只送最近的一個提醒，已截止的作業不再提醒"""
+        now = now or datetime.now(TAIWAN_TZ)
+        due = []
+        for name, deadline, details in assignment_deadlines(self.assignments_fn()):
+            if now >= deadline:
+                continue
+            passed = [hours for hours in self.offsets_hours if now >= deadline - timedelta(hours=hours)]
+            if not passed:
+                continue
+            hours = passed[-1]
+            reminder_id = f"{name}:{deadline:%Y-%m-%dT%H:%M}:{hours:g}h"
+            with self._lock:
+                if self._progress.get(reminder_id, {}).get("completed"):
+                    continue
+            due.append((reminder_id, reminder_text(name, deadline, hours, details)))
+        return due
+
+    def _job(self, reminder_id, text):
+        """取得（或建立）提醒的批次計畫，收件人與 retry key 在第一次建立時固定下來"""
+        with self._lock:
+            job = self._progress.get(reminder_id)
+            if job is None:
+                users = self.users.all()
+                batches = [users[i:i + self.batch_size] for i in range(0, len(users), self.batch_size)]
+                job = self._progress[reminder_id] = {
+                    "text": text,
+                    "batches": [{"to": batch, "retry_key": str(uuid.uuid4()), "done": False} for batch in batches],
+                    "completed": False,
+                }
+        self._save_progress()
+        return job
+
+    def send_reminder(self, reminder_id, text):
+        """送出一個提醒中尚未完成的批次，全部完成時回傳 True"""
+        job = self._job(reminder_id, text)
+        pending = [(i, batch["to"], batch["retry_key"]) for i, batch in enumerate(job["batches"]) if not batch["done"]]
+
+        def on_done(index, result):
+            # 暫時性失敗留到下一次檢查再送，請求有誤的批次不再重送
+            if result is False:
+                return
+            with self._lock:
+                job["batches"][index]["done"] = True
+                job["batches"][index]["failed"] = result is None
+            self._save_progress()
+
+        self.sender.send_all(pending, job["text"], on_done)
+        with self._lock:
+            completed = all(batch["done"] for batch in job["batches"])
+            if completed:
+                # 完成後只保留摘要，進度檔不會隨提醒次數無限變大
+                recipients = sum(len(batch["to"]) for batch in job["batches"] if not batch.get("failed"))
+                self._progress[reminder_id] = {"text": job["text"], "completed": True, "recipients": recipients}
+                self.sent_reminders += 1
+        self._save_progress()
+        if completed:
+            print(f"已送出提醒 {reminder_id}（{recipients} 人）")
+        return completed
+
+    def run_pending(self, now=None):
+        """送出所有到期的提醒，回傳完成的提醒數"""
+        reminders = self.due_reminders(now)
+        if not reminders:
+            return 0
+        if self.lease is None:
+            return sum(self.send_reminder(reminder_id, text) for reminder_id, text in reminders)
+        with self.lease("reminders", max(self.interval * 10, 600)) as acquired:
+            if not acquired:
+                return 0
+            # 其他行程可能已更新進度
+            with self._lock:
+                self._progress = self._load_progress()
+            return sum(self.send_reminder(reminder_id, text) for reminder_id, text in self.due_reminders(now))
+
+    def start(self):
+        """interval <= 0 表示不啟用"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.run_pending()
+                except Exception as e:
+                    print(f"送出作業提醒時發生錯誤: {e}")
+
+        self._thread = threading.Thread(target=run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for job in self._progress.values() if not job["completed"])
+        return dict(self.sender.stats(), known_users=len(self.users), reminders_sent=self.sent_reminders, reminders_pending=pending)
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_fingerprint(*parts):
+    """計算提示詞、課程內容與模型名稱的雜湊，任何一項改變都會得到不同的值"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class ResponseCache:
+    """LLM回覆快取（LRU + TTL）
+
+    key 為正規化後的問題加上內容指紋。get 與 put 都帶入查詢前取得的指紋：
+    查詢時看到新的指紋會清空快取；生成期間內容改變時，舊內容生成的回覆不會存入。
+    """
+
+    def __init__(self, max_size=256, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, fingerprint, key):
+        """取得快取的回覆，沒有或已過期時回傳 None"""
+        now = time.monotonic()
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._entries.clear()
+                self._fingerprint = fingerprint
+            entry = self._entries.get((fingerprint, key))
+            if entry is None or now - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[(fingerprint, key)]
+                self.misses += 1
+                return None
+            self._entries.move_to_end((fingerprint, key))
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+    def put(self, fingerprint, key, response, cost=0.0):
+        """存入回覆，cost 為生成這個回覆花費的秒數（用來統計省下的時間）
+
+        fingerprint 為生成前查詢時的指紋，與目前的指紋不同代表內容已改變，不存入。
+        """
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                return
+            self._entries[(fingerprint, key)] = (response, time.monotonic(), cost)
+            self._entries.move_to_end((fingerprint, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """回傳命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
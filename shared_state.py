@@ -0,0 +1,352 @@
+"""多個 worker 行程共用的狀態
+
+以 gunicorn 執行多個 worker 行程時，每個行程都有自己的 course_bot；回覆快取、對話記憶與限流計數
+若放在各自的記憶體中，同一位使用者的請求分到不同行程時就會彼此不一致。
+SharedStore 把這些狀態放在同一個 SQLite 檔（WAL 模式，讀取不會被寫入擋住），
+下列類別與單一行程的 ResponseCache、ConversationMemory、UserRateLimiter、EventDeduplicator 介面相同，可以直接替換。
+命中次數等統計值仍是各行程自己的計數。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from text_utils import estimate_tokens
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    fingerprint TEXT NOT NULL,
+    key TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (fingerprint, key)
+);
+CREATE INDEX IF NOT EXISTS response_cache_created ON response_cache (created_at);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT PRIMARY KEY,
+    turns TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    last_active REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    user_id TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seen_events (
+    event_id TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_events_seen_at ON seen_events (seen_at);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """SQLite（WAL 模式）共用狀態，每個執行緒使用自己的連線"""
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self.connect().executescript(SCHEMA)
+
+    def connect(self):
+        db = getattr(self._local, "db", None)
+        # fork 之後不可沿用父行程的連線
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def query(self, sql, params=()):
+        """唯讀查詢，回傳所有資料列"""
+        return self.connect().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """寫入交易（BEGIN IMMEDIATE），讀取後再寫入的操作在各行程之間不會互相覆蓋"""
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def get_meta(self, name, default=None):
+        rows = self.query("SELECT value FROM meta WHERE name = ?", (name,))
+        return rows[0][0] if rows else default
+
+    def set_meta(self, name, value):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def acquire(self, name, ttl):
+        """取得名為 name 的租約（ttl 秒後自動失效），已被其他行程持有時回傳 False"""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)", (name, self.owner, now + ttl))
+        return True
+
+    def release(self, name):
+        with self.transaction() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    @contextmanager
+    def lease(self, name, ttl):
+        """with store.lease(name, ttl) as acquired: 只有取得租約的行程執行，結束時釋放"""
+        acquired = self.acquire(name, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(name)
+
+
+class SharedResponseCache:
+    """存放在 SharedStore 的回覆快取（TTL + 依存入時間淘汰）
+
+    讀取不寫入資料庫，命中時不更新順序。get 與 put 都帶入查詢前取得的內容指紋，生成期間內容改變時回覆存在舊指紋下；
+    其他行程可能仍在使用舊的內容指紋，因此指紋改變時不清空，舊指紋的項目會隨 TTL 與容量上限淘汰。
+    """
+
+    def __init__(self, store, max_size=256, ttl=600):
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, fingerprint, key):
+        rows = self.store.query(
+            "SELECT response, cost FROM response_cache WHERE fingerprint = ? AND key = ? AND created_at >= ?",
+            (fingerprint or "", key, time.time() - self.ttl)
+        )
+        with self._lock:
+            if not rows:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += rows[0][1]
+        return rows[0][0]
+
+    def put(self, fingerprint, key, response, cost=0.0):
+        now = time.time()
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO response_cache (fingerprint, key, response, created_at, cost) VALUES (?, ?, ?, ?, ?)",
+                (fingerprint or "", key, response, now, cost)
+            )
+            db.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+            excess = db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_size
+            if excess > 0:
+                db.execute(
+                    "DELETE FROM response_cache WHERE rowid IN (SELECT rowid FROM response_cache ORDER BY created_at LIMIT ?)",
+                    (excess,)
+                )
+
+    def clear(self):
+        with self.store.transaction() as db:
+            db.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        size = self.store.query("SELECT COUNT(*) FROM response_cache")[0][0]
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+class SharedConversationMemory:
+    """存放在 SharedStore 的對話記憶，限制方式與 ConversationMemory 相同"""
+
+    def __init__(self, store, session_token_budget=300, idle_seconds=1800, max_total_tokens=200000):
+        self.store = store
+        self.session_token_budget = session_token_budget
+        self.idle_seconds = idle_seconds
+        self.max_total_tokens = max_total_tokens
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def history(self, user_id):
+        rows = self.store.query(
+            "SELECT turns FROM sessions WHERE user_id = ? AND last_active >= ?",
+            (user_id, time.time() - self.idle_seconds)
+        )
+        if not rows:
+            return []
+        return [{"role": role, "content": content} for role, content, _ in json.loads(rows[0][0])]
+
+    def append(self, user_id, user_query, response):
+        """加入一問一答，超過預算時從最舊的對話開始成對移除"""
+        new_turns = [
+            ["user", user_query, estimate_tokens(user_query)],
+            ["assistant", response, estimate_tokens(response)],
+        ]
+        now = time.time()
+        with self.store.transaction() as db:
+            db.execute("DELETE FROM sessions WHERE last_active < ?", (now - self.idle_seconds,))
+            self.evicted_idle += db.execute("SELECT changes()").fetchone()[0]
+            row = db.execute("SELECT turns FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            turns = (json.loads(row[0]) if row else []) + new_turns
+            tokens = sum(turn[2] for turn in turns)
+            while tokens > self.session_token_budget and len(turns) > 2:
+                tokens -= turns[0][2] + turns[1][2]
+                turns = turns[2:]
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, turns, tokens, last_active) VALUES (?, ?, ?, ?)",
+                (user_id, json.dumps(turns, ensure_ascii=False), tokens, now)
+            )
+            total = db.execute("SELECT COALESCE(SUM(tokens), 0) FROM sessions").fetchone()[0]
+            if total > self.max_total_tokens:
+                # 從最久沒說話的使用者開始清除
+                for other_id, other_tokens in db.execute(
+                    "SELECT user_id, tokens FROM sessions WHERE user_id != ? ORDER BY last_active", (user_id,)
+                ).fetchall():
+                    if total <= self.max_total_tokens:
+                        break
+                    db.execute("DELETE FROM sessions WHERE user_id = ?", (other_id,))
+                    total -= other_tokens
+                    self.evicted_capacity += 1
+
+    def clear(self, user_id):
+        with self.store.transaction() as db:
+            db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        rows = self.store.query("SELECT turns, tokens FROM sessions WHERE last_active >= ?", (time.time() - self.idle_seconds,))
+        return {
+            "sessions": len(rows),
+            "total_tokens": sum(tokens for _, tokens in rows),
+            "total_chars": sum(len(turn[1]) for turns, _ in rows for turn in json.loads(turns)),
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+        }
+
+
+class SharedRateLimiter:
+    """存放在 SharedStore 的每位使用者 token bucket，使用者換到其他 worker 也不會多出額度"""
+
+    def __init__(self, store, rate, burst, cleanup_interval=300):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.cleanup_interval = cleanup_interval
+        self._lock = threading.Lock()
+        self._last_cleanup = time.time()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, user_id, now=None):
+        if self.rate <= 0:
+            return True
+        now = time.time() if now is None else now
+        with self.store.transaction() as db:
+            row = db.execute("SELECT tokens, updated_at FROM rate_buckets WHERE user_id = ?", (user_id,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            db.execute(
+                "INSERT OR REPLACE INTO rate_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)",
+                (user_id, tokens, now)
+            )
+            if now - self._last_cleanup >= self.cleanup_interval:
+                # token 已補滿的使用者與新使用者沒有差別，可以直接移除
+                db.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - self.burst / self.rate,))
+                self._last_cleanup = now
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        return allowed
+
+    def stats(self):
+        users = self.store.query("SELECT COUNT(*) FROM rate_buckets")[0][0]
+        with self._lock:
+            total = self.allowed + self.rejected
+            return {
+                "users": users,
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "reject_rate": self.rejected / total if total else 0.0
+            }
+
+
+class SharedEventDeduplicator:
+    """存放在 SharedStore 的 webhookEventId，LINE 重送到其他 worker 時也能認出來
+
+    認領時先寫入 ttl - claim_ttl 秒前的時間，claim_ttl 秒後就會過期；處理成功時才更新為現在的時間。
+    """
+
+    def __init__(self, store, ttl=3600, cleanup_interval=60, claim_ttl=60):
+        self.store = store
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self.cleanup_interval = cleanup_interval
+        self._lock = threading.Lock()
+        self._last_cleanup = time.time()
+        self.duplicates = 0
+
+    def claim(self, event_id):
+        """認領事件，已處理過或其他 worker 正在處理時回傳 False"""
+        now = time.time()
+        with self.store.transaction() as db:
+            if now - self._last_cleanup >= self.cleanup_interval:
+                db.execute("DELETE FROM seen_events WHERE seen_at < ?", (now - self.ttl,))
+                self._last_cleanup = now
+            # 過期的紀錄（包含處理中斷而沒有完成的認領）不再擋下重送
+            db.execute("DELETE FROM seen_events WHERE event_id = ? AND seen_at < ?", (event_id, now - self.ttl))
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO seen_events (event_id, seen_at) VALUES (?, ?)",
+                (event_id, now - self.ttl + self.claim_ttl)
+            ).rowcount == 1
+        if not inserted:
+            with self._lock:
+                self.duplicates += 1
+        return inserted
+
+    def done(self, event_id):
+        """事件處理成功，ttl 秒內的重送都略過"""
+        with self.store.transaction() as db:
+            db.execute("UPDATE seen_events SET seen_at = ? WHERE event_id = ?", (time.time(), event_id))
+
+    def release(self, event_id):
+        """事件處理失敗，釋放認領讓重送可以再處理"""
+        with self.store.transaction() as db:
+            db.execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+
+    def stats(self):
+        tracked = self.store.query("SELECT COUNT(*) FROM seen_events")[0][0]
+        with self._lock:
+            return {"tracked": tracked, "duplicates": self.duplicates}
@@ -0,0 +1,70 @@
+import threading
+
+
+class _Call:
+    """一個進行中的生成，等待者共用它的結果"""
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合併同時進行的相同請求
+
+    同一個 key 同時只會有一個呼叫真正執行 fn，其他呼叫等待並取得相同的結果或例外。
+    """
+
+    def __init__(self, timeout=120):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.saved = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """執行 fn 或等待相同 key 的進行中呼叫，等待逾時會拋出 TimeoutError"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError("等待相同問題的回覆逾時")
+        else:
+            with self._lock:
+                self.saved += 1
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """回傳合併統計"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "saved": self.saved,
+                "timeouts": self.timeouts,
+            }
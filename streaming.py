@@ -0,0 +1,262 @@
+import threading
+import time
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+SENTENCE_ENDS = "。！？!?"
+# 會輸出思考內容的模型（名稱包含其中任一字串），其他模型的輸出不暫存
+REASONING_MODELS = ("deepseek-r1", "qwq", "qwen3")
+
+
+def is_reasoning_model(model, patterns=REASONING_MODELS):
+    """模型是否會先輸出思考內容（可能省略開頭的 <think>）"""
+    name = (model or "").lower()
+    return any(pattern and pattern in name for pattern in patterns)
+
+
+class ThinkStripper:
+    """逐段過濾模型輸出中的 <think>...</think> 區塊，效果等同原本的 re.sub(r'.*?</think>\\n*', '', ..., flags=re.DOTALL)
+    （例外：回答已開始輸出後才又出現的 </think>，只能丟棄尚未輸出的部分）
+
+    輸出以 <think> 開頭時（如 deepseek-r1），丟棄到 </think> 為止的內容與其後的換行，之後的回答一邊收一邊輸出。
+    deepseek-r1 也常省略開頭的 <think>，沒有標籤的內容在看到 </think> 或串流結束前無法分辨是思考還是回答，
+    hold_untagged=True（會思考的模型）時先暫存：收到 </think> 時連同之前的內容一起丟棄，串流結束都沒有 </think> 時才當成回答輸出；
+    hold_untagged=False（llama2、qwen 等）時沒有標籤的內容直接當成回答輸出，首字延遲與提早結束不受影響。
+    """
+
+    def __init__(self, hold_untagged=False):
+        self.hold_untagged = hold_untagged
+        self.state = "start"
+        self._buffer = ""
+        # untagged 狀態下已確認不含 </think> 的前綴長度，避免每段都從頭搜尋
+        self._scanned = 0
+        self.dropped_chars = 0
+
+    def feed(self, chunk):
+        """輸入一段模型輸出，回傳可以顯示給使用者的部分"""
+        self._buffer += chunk
+        output = []
+        while self._buffer:
+            if self.state == "start":
+                stripped = self._buffer.lstrip()
+                if stripped.startswith(THINK_OPEN):
+                    self.dropped_chars += len(self._buffer) - len(stripped) + len(THINK_OPEN)
+                    self._buffer = stripped[len(THINK_OPEN):]
+                    self.state = "think"
+                elif THINK_OPEN.startswith(stripped):
+                    # 可能是被切開的 <think> 標籤，等下一段再判斷
+                    break
+                elif self.hold_untagged:
+                    self.state = "untagged"
+                    self._scanned = 0
+                else:
+                    self.state = "answer"
+            elif self.state == "untagged":
+                end = self._buffer.find(THINK_CLOSE, self._scanned)
+                if end < 0:
+                    self._scanned = max(0, len(self._buffer) - len(THINK_CLOSE) + 1)
+                    break
+                self._close_think(end)
+            elif self.state == "think":
+                end = self._buffer.find(THINK_CLOSE)
+                if end < 0:
+                    # 只保留可能是 </think> 開頭的尾巴
+                    keep = len(THINK_CLOSE) - 1
+                    self.dropped_chars += max(0, len(self._buffer) - keep)
+                    self._buffer = self._buffer[-keep:]
+                    break
+                self._close_think(end)
+            elif self.state == "after_think":
+                self._buffer = self._buffer.lstrip("\n")
+                if self._buffer:
+                    self.state = "answer"
+            else:
+                end = self._buffer.find(THINK_CLOSE)
+                if end >= 0:
+                    # 回答中又出現 </think>：尚未輸出的部分與正規表示式一樣丟棄
+                    self._close_think(end)
+                    continue
+                # 保留可能是被切開的 </think> 的尾巴
+                keep = _partial_tag_length(self._buffer, THINK_CLOSE)
+                output.append(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+        return "".join(output)
+
+    def _close_think(self, end):
+        self.dropped_chars += end + len(THINK_CLOSE)
+        self._buffer = self._buffer[end + len(THINK_CLOSE):]
+        self.state = "after_think"
+
+    def flush(self):
+        """串流結束時取出剩餘可顯示的內容（未閉合的思考內容會被丟棄）"""
+        if self.state in ("start", "untagged", "answer"):
+            text, self._buffer = self._buffer, ""
+            return text
+        self._buffer = ""
+        return ""
+
+
+def _partial_tag_length(text, tag):
+    """text 結尾與 tag 開頭相同的最長長度"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+def truncate_answer(text, max_chars):
+    """把回答截到 max_chars 以內，盡量在句尾切開"""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    cut = max(head.rfind(ch) for ch in SENTENCE_ENDS)
+    if cut >= max_chars // 2:
+        return head[:cut + 1]
+    return head
+
+
+def collect_stream(chunks, max_chars=None, deadline=None, hold_untagged=False):
+    """讀取 ollama.chat(stream=True) 的串流，過濾思考內容並在超過長度時提早結束
+
+    deadline 為 time.perf_counter() 的時間點，超過時停止讀取並中斷生成。
+    hold_untagged 見 ThinkStripper，會思考的模型（is_reasoning_model）才需要設為 True。
+    回傳 (回答文字, 統計資料)。
+    """
+    stripper = ThinkStripper(hold_untagged)
+    parts = []
+    visible_chars = 0
+    chunk_count = 0
+    first_token_seconds = None
+    final = {}
+    strip_seconds = 0.0
+    truncated = False
+    timed_out = False
+    start_time = time.perf_counter()
+    try:
+        for chunk in chunks:
+            chunk_count += 1
+            if chunk.get("done"):
+                final = chunk
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                timed_out = True
+                break
+            strip_start = time.perf_counter()
+            text = stripper.feed(chunk.get("message", {}).get("content", ""))
+            strip_seconds += time.perf_counter() - strip_start
+            if not text:
+                continue
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - start_time
+            parts.append(text)
+            visible_chars += len(text)
+            if max_chars and visible_chars >= max_chars:
+                truncated = True
+                break
+    finally:
+        # 關閉串流會中斷與 Ollama 的連線，讓模型停止繼續生成
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+    answer = "".join(parts) + stripper.flush()
+    if max_chars:
+        answer = truncate_answer(answer, max_chars)
+    stats = {
+        "first_token_seconds": first_token_seconds,
+        "total_seconds": time.perf_counter() - start_time,
+        # 沒讀到最後一段（提早結束）時，以收到的段數估計生成的 token 數
+        "tokens": final.get("eval_count", chunk_count),
+        # Ollama 只在最後一段回傳 prompt eval 與 eval 的耗時（奈秒）
+        "prompt_eval_seconds": final["prompt_eval_duration"] / 1e9 if "prompt_eval_duration" in final else None,
+        "eval_seconds": final["eval_duration"] / 1e9 if "eval_duration" in final else None,
+        "think_chars": stripper.dropped_chars,
+        "think_strip_seconds": strip_seconds,
+        "truncated": truncated,
+        "timed_out": timed_out,
+    }
+    return answer.strip(), stats
+
+
+class StreamStats:
+    """累計串流生成的首字延遲與 token 數"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.truncated = 0
+        self.tokens = 0
+        self.first_token_seconds = 0.0
+        self.first_token_count = 0
+        self.total_seconds = 0.0
+
+    def record(self, stats):
+        with self._lock:
+            self.requests += 1
+            self.tokens += stats["tokens"]
+            self.total_seconds += stats["total_seconds"]
+            if stats["truncated"]:
+                self.truncated += 1
+            if stats["first_token_seconds"] is not None:
+                self.first_token_seconds += stats["first_token_seconds"]
+                self.first_token_count += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "truncated": self.truncated,
+                "avg_tokens": self.tokens / self.requests if self.requests else 0.0,
+                "avg_first_token_seconds": (
+                    self.first_token_seconds / self.first_token_count if self.first_token_count else 0.0
+                ),
+                "avg_total_seconds": self.total_seconds / self.requests if self.requests else 0.0,
+            }
+
+
+if __name__ == "__main__":
+    # 回歸測試：會思考的模型以各種切段方式串流，結果必須與原本的正規表示式相同；
+    # 其他模型沒有標籤的輸出要一邊收一邊輸出，超過長度時提早結束
+    import re
+    import sys
+
+    samples = [
+        "<think>\n先查公告中的期限\n</think>\n\n作業一的繳交期限是 2025/03/20 23:59。",
+        "先查公告中的期限，再整理成一句話\n</think>\n\n作業一的繳交期限是 2025/03/20 23:59。",
+        "  <think>推理</think>答案",
+        "作業一的繳交期限是 2025/03/20 23:59。",
+        "答案中提到 </thi 但不是標籤",
+        "",
+    ]
+    failed = 0
+    for sample in samples:
+        expected = re.sub(r'.*?</think>\n*', '', sample, flags=re.DOTALL).strip()
+        for size in (1, 2, 3, 5, 8, len(sample) or 1):
+            chunks = [{"message": {"content": sample[i:i + size]}} for i in range(0, len(sample), size)]
+            answer, _ = collect_stream(iter(chunks + [{"done": True}]), hold_untagged=True)
+            if answer != expected:
+                failed += 1
+                print(f"❌ 每段 {size} 字: {sample!r} -> {answer!r}，應為 {expected!r}")
+    print(f"{len(samples)} 種輸出，{'全部與正規表示式相同' if not failed else f'{failed} 個不一致'}")
+
+    read = []
+
+    def untagged_stream(count=140):
+        for i in range(count):
+            read.append(i)
+            yield {"message": {"content": "這是回答。"}}
+        yield {"done": True}
+
+    for model in ("llama2:13b-chat", "qwen:7b-chat"):
+        read.clear()
+        answer, stats = collect_stream(untagged_stream(), max_chars=120, hold_untagged=is_reasoning_model(model))
+        if not stats["truncated"] or len(read) >= 140 or stats["first_token_seconds"] is None:
+            failed += 1
+            print(f"❌ {model}: 讀了 {len(read)} 段，truncated={stats['truncated']}，首字延遲 {stats['first_token_seconds']}")
+        else:
+            print(f"{model}: 讀 {len(read)}/140 段後提早結束，回答 {len(answer)} 字")
+    if not is_reasoning_model("deepseek-r1:14b"):
+        failed += 1
+        print("❌ deepseek-r1 應視為會思考的模型")
+    sys.exit(1 if failed else 0)
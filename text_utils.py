@@ -0,0 +1,27 @@
+import unicodedata
+
+
+def normalize_query(text):
+    """正規化使用者問題：全形轉半形、去除空白與標點、英文轉小寫"""
+    # NFKC 會把全形英數字與符號轉成半形
+    text = unicodedata.normalize("NFKC", text)
+    chars = []
+    for ch in text:
+        category = unicodedata.category(ch)
+        # 去除空白（Z*）、標點（P*）與控制字元（Cc）
+        if category[0] in ("Z", "P") or category == "Cc" or ch.isspace():
+            continue
+        chars.append(ch)
+    return "".join(chars).lower()
+
+
+def estimate_tokens(text):
+    """粗估文字的 token 數：非 ASCII 字元（中文）各算 1 個，ASCII 約每 4 個字元 1 個"""
+    ascii_chars = 0
+    tokens = 0
+    for ch in text:
+        if ord(ch) < 128:
+            ascii_chars += 1
+        else:
+            tokens += 1
+    return tokens + (ascii_chars + 3) // 4
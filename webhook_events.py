@@ -0,0 +1,103 @@
+"""webhook 事件的前處理
+
+LINE 一次 webhook 可能帶多個事件。在轉成 SDK 事件物件之前，先以原始 JSON 篩掉不處理的事件類型，
+並依 webhookEventId 去除重送（deliveryContext.isRedelivery）或重複的事件，避免同一則訊息生成兩次回覆。
+事件先被「認領」，處理成功後才記為已處理；處理失敗時釋放，認領後行程中斷時認領在 claim_ttl 秒後失效，
+之後的重送仍會處理。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# 會處理的事件：(事件類型, 訊息類型)，非訊息事件的訊息類型為 None
+HANDLED_EVENTS = {("message", "text"), ("follow", None)}
+
+
+def event_kind(event):
+    message = event.get("message") if event.get("type") == "message" else None
+    return event.get("type"), message.get("type") if isinstance(message, dict) else None
+
+
+def is_redelivery(event):
+    return bool((event.get("deliveryContext") or {}).get("isRedelivery"))
+
+
+def user_key(event):
+    """事件的使用者，同一位使用者的事件需依序處理"""
+    return (event.get("source") or {}).get("userId")
+
+
+def filter_events(events, dedupe=None):
+    """回傳 (要處理的原始事件, {結果: 數量})，結果為 handled、ignored 或 duplicate，
+    另外 redelivered 為其中 LINE 標記為重送的事件數
+
+    dedupe(event_id) 認領該事件，已處理過或正在處理中時回傳 False。呼叫端處理完後需呼叫 done()，失敗時呼叫 release()；
+    重送的事件若先前沒有處理成功（例如第一次送達時失敗）仍會處理。
+    """
+    handled = []
+    outcomes = {"handled": 0, "ignored": 0, "duplicate": 0, "redelivered": 0}
+    for event in events:
+        if is_redelivery(event):
+            outcomes["redelivered"] += 1
+        if event_kind(event) not in HANDLED_EVENTS:
+            outcomes["ignored"] += 1
+            continue
+        event_id = event.get("webhookEventId")
+        if dedupe is not None and event_id and not dedupe(event_id):
+            outcomes["duplicate"] += 1
+            continue
+        handled.append(event)
+        outcomes["handled"] += 1
+    return handled, outcomes
+
+
+def group_by_user(events, key=user_key):
+    """依使用者分組並保留各自的順序，回傳 [[同一使用者的事件...]]"""
+    groups = OrderedDict()
+    for event in events:
+        groups.setdefault(key(event), []).append(event)
+    return list(groups.values())
+
+
+class EventDeduplicator:
+    """記住最近 ttl 秒內處理過、以及 claim_ttl 秒內認領的 webhookEventId（本行程）"""
+
+    def __init__(self, ttl=3600, max_size=100000, claim_ttl=60):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.claim_ttl = claim_ttl
+        # event_id -> 失效的時間
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def claim(self, event_id):
+        """認領事件，已處理過或其他執行緒正在處理時回傳 False"""
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                oldest, expires_at = next(iter(self._seen.items()))
+                if expires_at > now and len(self._seen) < self.max_size:
+                    break
+                del self._seen[oldest]
+            if self._seen.get(event_id, 0.0) > now:
+                self.duplicates += 1
+                return False
+            self._seen[event_id] = now + self.claim_ttl
+            self._seen.move_to_end(event_id)
+            return True
+
+    def done(self, event_id):
+        """事件處理成功，ttl 秒內的重送都略過"""
+        with self._lock:
+            self._seen[event_id] = time.monotonic() + self.ttl
+            self._seen.move_to_end(event_id)
+
+    def release(self, event_id):
+        """事件處理失敗，釋放認領讓重送可以再處理"""
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"tracked": len(self._seen), "duplicates": self.duplicates}
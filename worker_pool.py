@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from metrics import collect_stages, observe_stage
+
+
+class ReplyWorkerPool:
+    """處理LINE訊息的背景工作執行緒池
+
+    webhook 在簽名驗證後只負責把事件放進佇列，
+    由背景執行緒呼叫 LLM 生成回覆並送出，避免 Flask 請求執行緒被卡住。
+
+    佇列有上限，並且優先處理目前沒有訊息在排隊或處理中的使用者，
+    避免單一使用者連續發問時拖慢其他人；在佇列中等待超過 max_wait 秒的事件
+    不再生成回覆，改交給 on_expired（例如回覆「請稍後再試」）。
+    同一個 key 的事件依送入順序一次處理一個，不同 key 的事件並行處理。
+    """
+
+    def __init__(self, handler, worker_count=2, queue_size=100, max_wait=0, on_expired=None):
+        self.handler = handler
+        self.worker_count = worker_count
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.on_expired = on_expired
+        self.workers = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = {}
+        # 正在處理中的 key，以及因同一個 key 正在處理而暫緩的事件
+        self._running = set()
+        self._waiting = {}
+        self._cond = threading.Condition()
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.prioritized = 0
+
+    def start(self):
+        """啟動背景工作執行緒（重複呼叫不會重複啟動）"""
+        with self._cond:
+            if self.workers:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._run, name=f"reply-worker-{i}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def submit(self, event, key=None):
+        """將事件放入佇列，佇列已滿時回傳 False
+
+        key 通常是 user_id，同一個 key 已有事件在排隊或處理中時，新事件排在其他人之後。
+        """
+        self.start()
+        with self._cond:
+            if self._pending() >= self.queue_size:
+                self.rejected += 1
+                return False
+            priority = 1 if self._active.get(key) else 0
+            if priority == 0:
+                self.prioritized += 1
+            self._active[key] = self._active.get(key, 0) + 1
+            heapq.heappush(self._heap, (priority, next(self._seq), time.perf_counter(), key, event))
+            self.submitted += 1
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        """目前佇列中等待處理的事件數"""
+        with self._cond:
+            return self._pending()
+
+    def _pending(self):
+        return len(self._heap) + sum(len(items) for items in self._waiting.values())
+
+    def _take(self):
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                item = heapq.heappop(self._heap)
+                key = item[3]
+                if key is None or key not in self._running:
+                    break
+                # 同一個 key 的前一個事件還在處理，等它完成後再放回佇列
+                self._waiting.setdefault(key, deque()).append(item)
+            if key is not None:
+                self._running.add(key)
+            return item
+
+    def _done(self, key):
+        with self._cond:
+            self._running.discard(key)
+            waiting = self._waiting.get(key)
+            if waiting:
+                heapq.heappush(self._heap, waiting.popleft())
+                if not waiting:
+                    del self._waiting[key]
+                self._cond.notify()
+            remaining = self._active.get(key, 1) - 1
+            if remaining:
+                self._active[key] = remaining
+            else:
+                self._active.pop(key, None)
+
+    def _run(self):
+        while True:
+            _, _, enqueued_at, key, event = self._take()
+            waited = time.perf_counter() - enqueued_at
+            try:
+                # handler 內以 collect_stages() 收集的各階段耗時也會包含 queue_wait
+                with collect_stages():
+                    observe_stage("queue_wait", waited)
+                    if self.max_wait and waited > self.max_wait:
+                        with self._cond:
+                            self.expired += 1
+                        if self.on_expired is not None:
+                            self.on_expired(event)
+                    else:
+                        self.handler(event)
+            except Exception as e:
+                print(f"背景處理訊息時發生錯誤: {e}")
+            finally:
+                self._done(key)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": self._pending(),
+                "active_users": len(self._active),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "prioritized": self.prioritized
+            }
@@ -0,0 +1,17 @@
+"""gunicorn 進入點：gunicorn -c gunicorn.conf.py wsgi:app
+
+每個 worker 行程各自載入 machine-vision-chatbot.py 並啟動背景執行緒；
+多個 worker 之間的回覆快取、對話記憶與限流透過 SHARED_STATE_PATH 共用。
+"""
+import importlib.util
+import os
+
+_spec = importlib.util.spec_from_file_location(
+    "machine_vision_chatbot",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "machine-vision-chatbot.py")
+)
+bot = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bot)
+bot.start_background_tasks()
+
+app = bot.app